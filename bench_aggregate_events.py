@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Benchmark main.aggregate_events against main.aggregate_events_columnar on
+synthetic event windows, checking that both return identical results.
+
+Run with: python bench_aggregate_events.py [-n 100000 -n 1000000]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from main import aggregate_events, aggregate_events_columnar
+
+NOW = datetime(2026, 7, 12, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def make_events(
+    count: int, monitors: int, window: int, seed: int = 0
+) -> List[Dict[str, Any]]:
+    """Synthetic ``Event.get()`` dicts, shaped like the ZM events API output
+    (string numerics, UTC datetimes, some open/empty/purged events)."""
+    rnd = random.Random(seed)
+    events: List[Dict[str, Any]] = []
+    for eid in range(count, 0, -1):
+        ended_ago = rnd.randrange(0, window + 900)
+        end = NOW - timedelta(seconds=ended_ago)
+        events.append({
+            'Id': str(eid),
+            'MonitorId': str(rnd.randrange(1, monitors + 1)),
+            'StartDateTime': (end - timedelta(seconds=rnd.randrange(5, 120))
+                              ).strftime('%Y-%m-%d %H:%M:%S'),
+            'EndDateTime': (
+                None if rnd.random() < 0.01
+                else end.strftime('%Y-%m-%d %H:%M:%S')
+            ),
+            'DiskSpace': (
+                '0' if rnd.random() < 0.02
+                else str(rnd.randrange(10**5, 10**8))
+            ),
+            'Frames': str(rnd.randrange(1, 600)),
+            'Emptied': '1' if rnd.random() < 0.01 else '0',
+        })
+    return events
+
+
+def time_it(func: Callable[[], Any], repeat: int) -> float:
+    best: float = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument(
+        '-n', '--events', dest='sizes', action='append', type=int,
+        help='number of events (repeatable; default 100000 and 1000000)'
+    )
+    p.add_argument('-m', '--monitors', type=int, default=50)
+    p.add_argument(
+        '-w', '--window', type=int, default=6 * 3600,
+        help='event window in seconds (default 6h)'
+    )
+    p.add_argument('-r', '--repeat', type=int, default=3)
+    args = p.parse_args()
+    ids = list(range(1, args.monitors + 1))
+    variants = {
+        'standard': lambda ev: aggregate_events(
+            ev, ids, NOW, args.window, 120
+        ),
+        'columnar (array)': lambda ev: aggregate_events_columnar(
+            ev, ids, NOW, args.window, 120, use_numpy=False
+        ),
+        'columnar (numpy)': lambda ev: aggregate_events_columnar(
+            ev, ids, NOW, args.window, 120, use_numpy=True
+        ),
+    }
+    for size in args.sizes or [100000, 1000000]:
+        events = make_events(size, args.monitors, args.window)
+        expected = variants['standard'](events)
+        print(f'{size} events, {args.monitors} monitors, '
+              f'{args.window}s window:')
+        baseline: float = 0.0
+        for name, func in variants.items():
+            try:
+                assert func(events) == expected, f'{name} result differs'
+            except ImportError:
+                print(f'  {name:18s} skipped (numpy not installed)')
+                continue
+            secs = time_it(lambda: func(events), args.repeat)
+            baseline = baseline or secs
+            print(f'  {name:18s} {secs:8.3f}s  {baseline / secs:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark building the monitor payload and shared-memory metrics in-process
+against sharding them across worker processes (ZM_COLLECTOR_PROCESSES),
+on synthetic monitors and shared-memory files, checking that both produce
+the same samples.
+
+Run with: python bench_sharding.py [-m 1000] [-p 2 -p 4]
+"""
+
+import argparse
+import functools
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from main import (
+    build_monitor_metrics, build_shm_metrics, merge_metric_families,
+    _monitor_shard_worker, _shm_shard_worker,
+)
+
+# pyzm.ZMMemory's SharedData / TriggerData layouts
+SHARED_FMT = '@IiiIddQIiiiiii????IIIIqqqq256s256s64s64s'
+TRIGGER_FMT = 'IIII32s256s256s'
+
+INT_FIELDS = [
+    'DecodingEnabled', 'Width', 'Height', 'Colours', 'Palette', 'SaveJPEGs',
+    'VideoWriter', 'OutputCodec', 'Brightness', 'Contrast', 'Hue', 'Colour',
+    'ImageBufferCount', 'MaxImageBufferCount', 'WarmupCount',
+    'PreEventCount', 'PostEventCount', 'AlarmFrameCount', 'RefBlendPerc',
+    'AlarmRefBlendPerc', 'TrackMotion', 'ZoneCount',
+]
+
+
+def make_entry(mid: int) -> Dict[str, Any]:
+    """A ``/monitors.json`` entry shaped like ZM 1.36's."""
+    return {
+        'Monitor': {
+            'Id': str(mid), 'Name': f'Camera {mid}', 'Deleted': False,
+            'ServerId': '0', 'StorageId': str(mid % 3), 'Type': 'Ffmpeg',
+            'Device': '', 'Channel': '0', 'Format': '0',
+            'Method': 'rtpRtsp', 'Encoder': 'libx264', 'RecordAudio': '0',
+            'EventPrefix': 'Event-', 'Controllable': '0', 'ControlId': None,
+            'Importance': 'Normal', 'Capturing': 'Always',
+            'Analysing': 'Always', 'Recording': 'OnMotion',
+            'Decoding': 'Always', 'OutputCodecName': 'h264',
+            'Function': 'Modect', 'Enabled': '1',
+            **{f: str(mid % 7) for f in INT_FIELDS},
+        },
+        'Monitor_Status': {
+            'Status': 'Connected', 'CaptureFPS': '10.02',
+            'AnalysisFPS': '5.01', 'CaptureBandwidth': '250000',
+        },
+        'Event_Summary': {
+            'TotalEvents': mid * 3, 'TotalEventDiskSpace': mid * 10**6,
+            'ArchivedEvents': None, 'ArchivedEventDiskSpace': None,
+        },
+    }
+
+
+def write_shm(path: str, mid: int) -> None:
+    now = int(time.time())
+    shared = struct.pack(
+        SHARED_FMT, struct.calcsize(SHARED_FMT), mid, mid, 0, 10.0, 5.0,
+        mid, 0, 0, 0, 0, 0, 0, 0, True, True, True, True, 1920 * 1080 * 3,
+        0, 0, 0, now - 3600, now, now, now, b'', b'', b'', b''
+    )
+    trigger = struct.pack(TRIGGER_FMT, 560, 0, 0, 0, b'', b'', b'')
+    with open(os.path.join(path, f'zm.mmap.{mid}'), 'wb') as f:
+        f.write(shared + trigger)
+
+
+def samples(families) -> List[Tuple]:
+    """Comparable samples; ``*_age_seconds`` values are dropped since they
+    depend on when the files were read."""
+    return sorted(
+        (s.name, tuple(sorted(s.labels.items())),
+         None if s.name.endswith('_age_seconds') else s.value)
+        for m in families for s in m.samples
+    )
+
+
+def time_it(func: Callable[[], Any], repeat: int) -> float:
+    best: float = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument('-m', '--monitors', type=int, default=1000)
+    p.add_argument(
+        '-p', '--processes', dest='processes', action='append', type=int,
+        help='worker processes (repeatable; default 2 and 4)'
+    )
+    p.add_argument('-r', '--repeat', type=int, default=5)
+    args = p.parse_args()
+    entries = [make_entry(mid) for mid in range(1, args.monitors + 1)]
+    names = [(mid, f'Camera {mid}') for mid in range(1, args.monitors + 1)]
+    with tempfile.TemporaryDirectory() as shm_dir:
+        for mid, _ in names:
+            write_shm(shm_dir, mid)
+
+        def single():
+            return (
+                build_monitor_metrics(entries)
+                + build_shm_metrics(names, shm_dir)
+            )
+
+        expected = samples(single())
+        baseline = time_it(single, args.repeat)
+        print(f'{args.monitors} monitors (cpu_count={os.cpu_count()}):')
+        print(f'  {"in-process":14s} {baseline:8.3f}s   1.00x')
+        shm_worker = functools.partial(_shm_shard_worker, shm_dir=shm_dir)
+        for procs in args.processes or [2, 4]:
+            with ProcessPoolExecutor(
+                max_workers=procs,
+                mp_context=multiprocessing.get_context('spawn')
+            ) as pool:
+
+                def sharded():
+                    entry_shards = [entries[i::procs] for i in range(procs)]
+                    name_shards = [names[i::procs] for i in range(procs)]
+                    return (
+                        merge_metric_families(
+                            pool.map(_monitor_shard_worker, entry_shards)
+                        )
+                        + merge_metric_families(
+                            pool.map(shm_worker, name_shards)
+                        )
+                    )
+
+                assert samples(sharded()) == expected, 'results differ'
+                secs = time_it(sharded, args.repeat)
+            print(f'  {f"{procs} processes":14s} {secs:8.3f}s  '
+                  f'{baseline / secs:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+"""
+Load-test ZmExporter against a simulated ZoneMinder, with fault injection.
+
+A local ZM API simulator (in its own process, so it does not compete with
+the exporter for the GIL) serves thousands of synthetic monitors, paged
+events and shared-memory files, and can inject latency, HTTP 500s,
+truncated events pages, soft-deleted monitors with null ``Monitor_Status``
+and missing ``zm.mmap.*`` files. The exporter runs in this process and is
+scraped at a target rate; scrape latency percentiles, error rates and
+memory are reported periodically and at the end.
+
+Run with: python loadtest.py [-m 2000] [--rate 0.2] [--duration 300]
+          [--latency 0.05] [--error-rate 0.01] [--truncate-rate 0.05]
+
+Any other exporter setting (e.g. ZM_EVENT_AGGREGATION) can be passed as an
+environment variable as usual. ``--serve PORT`` only runs the simulator, to
+point a separately started exporter at it.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+from bench_sharding import make_entry, write_shm
+
+logger = logging.getLogger('loadtest')
+
+VERSION = {'version': '1.36.33', 'apiversion': '2.0'}
+DATE_FMT = '%Y-%m-%d %H:%M:%S'
+
+
+class ZmSimulator:
+    """Synthetic ZM API state plus fault injection; one instance per
+    simulator process. Counts requests and injected faults per endpoint,
+    served at ``/sim/stats.json``."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.monitors: List[Dict[str, Any]] = []
+        for mid in range(1, args.monitors + 1):
+            entry: Dict[str, Any] = make_entry(mid)
+            if self.rnd.random() < args.deleted_fraction:
+                # ZM soft-deletes: Deleted=true, all-null Monitor_Status
+                entry['Monitor']['Deleted'] = True
+                entry['Monitor_Status'] = {
+                    k: None for k in entry['Monitor_Status']
+                }
+            self.monitors.append(entry)
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def count(self, endpoint: str, key: str) -> None:
+        with self.lock:
+            ep = self.stats.setdefault(
+                endpoint, {'requests': 0, 'errors': 0, 'truncated': 0}
+            )
+            ep[key] += 1
+
+    def events(self, page: int, limit: int) -> Dict[str, Any]:
+        """One page of the newest-first events index: ``events_per_monitor``
+        events per monitor, ended over the last ``event_spread`` seconds."""
+        total: int = self.args.monitors * self.args.events_per_monitor
+        now: datetime = datetime.now(timezone.utc)
+        events: List[Dict[str, Any]] = []
+        first: int = (page - 1) * limit
+        for n in range(first, min(first + limit, total)):
+            end: datetime = now - timedelta(
+                seconds=self.args.event_spread * n / max(total, 1)
+            )
+            events.append({'Event': {
+                'Id': str(total - n),
+                'MonitorId': str(n % self.args.monitors + 1),
+                'StartDateTime': (end - timedelta(seconds=60)).strftime(
+                    DATE_FMT
+                ),
+                'EndDateTime': end.strftime(DATE_FMT) if n else None,
+                'DiskSpace': str(1000000 + n % 5000),
+                'Frames': str(300 + n % 50),
+                'Emptied': '0',
+                'StorageId': '1',
+            }})
+        return {
+            'events': events,
+            'pagination': {
+                'page': page, 'current': len(events), 'count': total,
+                'nextPage': first + limit < total,
+            },
+        }
+
+
+def make_handler(sim: ZmSimulator):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # keep-alive responses would otherwise wait on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self) -> Optional[Any]:
+            parts = urlsplit(self.path)
+            path: str = parts.path
+            query: Dict[str, List[str]] = parse_qs(parts.query)
+            if path.endswith('/host/getVersion.json'):
+                return VERSION
+            if path.endswith('/monitors.json'):
+                return {'monitors': sim.monitors}
+            m = re.search(r'/monitors/daemonStatus/id:(\d+)/', path)
+            if m:
+                return {
+                    'status': True,
+                    'statustext': f"'zmc -m {m.group(1)}' running since "
+                                  f"24/07/12 10:00:00, pid = {m.group(1)}",
+                }
+            m = re.search(r'/monitors/(\d+)\.json$', path)
+            if m and 0 < int(m.group(1)) <= len(sim.monitors):
+                return {'monitor': sim.monitors[int(m.group(1)) - 1]}
+            if '/events/index/' in path:
+                return sim.events(
+                    int(query.get('page', ['1'])[0]),
+                    int(query.get('limit', ['100'])[0]),
+                )
+            if path.endswith('/states.json'):
+                return {'states': [{'State': {
+                    'Id': '1', 'Name': 'default', 'IsActive': '1',
+                    'Definition': ','.join(
+                        f'{e["Monitor"]["Id"]}:Modect:1'
+                        for e in sim.monitors
+                    ),
+                }}]}
+            if path.endswith('/host/daemonCheck.json'):
+                return {'result': 1}
+            if path.endswith('/storage.json'):
+                return {'storage': [{'Storage': {
+                    'Id': '1', 'Name': 'Default', 'Path': '/tmp',
+                    'DiskSpace': '0', 'Enabled': True,
+                }}]}
+            return None
+
+        def do_POST(self):
+            length: int = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            self._send(200, json.dumps(VERSION).encode())
+
+        def do_GET(self):
+            if self.path == '/sim/stats.json':
+                with sim.lock:
+                    return self._send(200, json.dumps(sim.stats).encode())
+            endpoint: str = re.sub(r'\d+', 'N', urlsplit(self.path).path)
+            if '/events/index/' in endpoint:
+                endpoint = '/api/events/index'
+            sim.count(endpoint, 'requests')
+            if sim.args.latency:
+                time.sleep(sim.rnd.expovariate(1 / sim.args.latency))
+            if sim.rnd.random() < sim.args.error_rate:
+                sim.count(endpoint, 'errors')
+                return self._send(500, b'{"success": false}')
+            data: Optional[Any] = self._route()
+            if data is None:
+                return self._send(404, b'{}')
+            body: bytes = json.dumps(data).encode()
+            if (
+                endpoint == '/api/events/index'
+                and sim.rnd.random() < sim.args.truncate_rate
+            ):
+                sim.count(endpoint, 'truncated')
+                body = body[:len(body) // 2]
+            self._send(200, body)
+
+    return Handler
+
+
+def serve(args: argparse.Namespace, port: int, ready=None) -> None:
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', port), make_handler(ZmSimulator(args))
+    )
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), else the peak."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ErrorCounter(logging.Handler):
+    """Counts the exporter's ERROR log records (failed stages or
+    requests it recovered from)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count: int = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.name == 'root':
+            self.count += 1
+
+
+def report(
+    label: str, started: float, latencies: List[float], failures: int,
+    errors: int, sim_stats: Dict[str, Dict[str, int]]
+) -> None:
+    requests: int = sum(s['requests'] for s in sim_stats.values())
+    injected: int = sum(
+        s['errors'] + s['truncated'] for s in sim_stats.values()
+    )
+    print(
+        f'{label:>7s} {time.monotonic() - started:7.1f}s '
+        f'scrapes={len(latencies):5d} '
+        f'p50={percentile(latencies, 0.5):7.3f}s '
+        f'p99={percentile(latencies, 0.99):7.3f}s '
+        f'max={max(latencies, default=0):7.3f}s '
+        f'failed={failures} stage_errors={errors} '
+        f'zm_requests={requests} injected_faults={injected} '
+        f'rss={rss_bytes() / 2**20:.1f}MiB',
+        flush=True
+    )
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument('-m', '--monitors', type=int, default=1000)
+    p.add_argument(
+        '--deleted-fraction', type=float, default=0.02,
+        help='fraction of monitors soft-deleted with null Monitor_Status'
+    )
+    p.add_argument(
+        '--missing-shm-fraction', type=float, default=0.1,
+        help='fraction of monitors without a zm.mmap.<id> file'
+    )
+    p.add_argument('--events-per-monitor', type=int, default=5)
+    p.add_argument(
+        '--event-spread', type=int, default=900,
+        help='seconds over which the simulated events ended'
+    )
+    p.add_argument(
+        '--latency', type=float, default=0.0,
+        help='mean injected latency per ZM API request, in seconds'
+    )
+    p.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help='fraction of ZM API requests answered with HTTP 500'
+    )
+    p.add_argument(
+        '--truncate-rate', type=float, default=0.0,
+        help='fraction of events pages whose body is cut short'
+    )
+    p.add_argument(
+        '--rate', type=float, default=0.2, help='scrapes per second'
+    )
+    p.add_argument('--duration', type=float, default=60.0, help='seconds')
+    p.add_argument(
+        '--report-interval', type=float, default=10.0,
+        help='seconds between progress reports'
+    )
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument(
+        '--serve', type=int, metavar='PORT',
+        help='only run the simulator, on this port'
+    )
+    p.add_argument('-v', '--verbose', action='store_true')
+    args = p.parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='[%(asctime)s %(levelname)s] %(message)s'
+    )
+    if args.serve is not None:
+        print(f'Simulating ZM at http://127.0.0.1:{args.serve}/api')
+        serve(args, args.serve)
+        return
+
+    ctx = multiprocessing.get_context('fork')
+    ready = ctx.Queue()
+    sim = ctx.Process(target=serve, args=(args, 0, ready), daemon=True)
+    sim.start()
+    port: int = ready.get(timeout=30)
+    shm_dir: str = tempfile.mkdtemp(prefix='zm-loadtest-shm-')
+    rnd = random.Random(args.seed)
+    for mid in range(1, args.monitors + 1):
+        if rnd.random() >= args.missing_shm_fraction:
+            write_shm(shm_dir, mid)
+    os.environ['ZM_API_URL'] = f'http://127.0.0.1:{port}/api'
+    os.environ['ZM_SHM_DIR'] = shm_dir
+    os.environ.setdefault(
+        'ZM_EVENT_QUERY_LIMIT',
+        str(args.monitors * args.events_per_monitor)
+    )
+
+    import main as exporter_main
+    import pyzm.helpers.globals as pyzm_globals
+    from prometheus_client import CollectorRegistry, generate_latest
+
+    if not args.verbose:
+        # pyzm's console logger prints every request at debug level 5
+        pyzm_globals.logger.set_level(0)
+        # faults are injected on purpose: count the exporter's errors
+        # (and skip its expected warnings, e.g. missing shm files) rather
+        # than print them all; -v shows them
+        logging.getLogger().setLevel(logging.ERROR)
+        logging.getLogger().handlers[0].setLevel(logging.CRITICAL)
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    exporter = exporter_main.ZmExporter()
+    if not exporter._connected.wait(30):
+        sys.exit('Exporter did not connect to the simulator')
+    registry = CollectorRegistry()
+    registry.register(exporter)
+
+    def sim_stats() -> Dict[str, Dict[str, int]]:
+        with urlopen(f'http://127.0.0.1:{port}/sim/stats.json') as resp:
+            return json.load(resp)
+
+    print(
+        f'{args.monitors} monitors, {args.rate}/s scrapes for '
+        f'{args.duration}s, latency={args.latency}s '
+        f'error_rate={args.error_rate} truncate_rate={args.truncate_rate}'
+    )
+    latencies: List[float] = []
+    failures: int = 0
+    started: float = time.monotonic()
+    next_scrape: float = started
+    next_report: float = started + args.report_interval
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(max(0.0, next_scrape - time.monotonic()))
+            next_scrape += 1 / args.rate
+            scrape_start: float = time.perf_counter()
+            try:
+                generate_latest(registry)
+            except Exception as ex:
+                failures += 1
+                logger.error('Scrape failed: %s', ex)
+            latencies.append(time.perf_counter() - scrape_start)
+            if time.monotonic() >= next_report:
+                report(
+                    'report', started, latencies, failures, errors.count,
+                    sim_stats()
+                )
+                next_report += args.report_interval
+        stats: Dict[str, Dict[str, int]] = sim_stats()
+        report('final', started, latencies, failures, errors.count, stats)
+        print(f'{"endpoint":40s} {"requests":>9s} {"500s":>6s} '
+              f'{"truncated":>9s}')
+        for endpoint, counts in sorted(stats.items()):
+            print(f'{endpoint:40s} {counts["requests"]:9d} '
+                  f'{counts["errors"]:6d} {counts["truncated"]:9d}')
+    finally:
+        sim.terminate()
+        shutil.rmtree(shm_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
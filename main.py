@@ -30,28 +30,98 @@ import os
 import argparse
 import logging
 import socket
-import time
 import re
 from datetime import datetime, timezone, timedelta
-from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from typing import Generator, List, Dict, Optional, Tuple, Any
+from typing import (
+    Generator, List, Dict, Optional, Tuple, Any, Callable, Iterable,
+    FrozenSet, Mapping, Set, TYPE_CHECKING
+)
+import contextlib
+import copy
+import functools
+import gc
+import hashlib
+import multiprocessing
+import inspect
 import json
+import mmap
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
+from urllib.parse import parse_qs, urlsplit
 from wsgiref.simple_server import make_server, WSGIServer
 from prometheus_client.core import (
-    REGISTRY, GaugeMetricFamily, InfoMetricFamily, StateSetMetricFamily, Metric
+    REGISTRY, CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily,
+    InfoMetricFamily, StateSetMetricFamily, Metric
+)
+from prometheus_client.exposition import (
+    make_wsgi_app, _SilentHandler, push_to_gateway, delete_from_gateway,
+    ThreadingWSGIServer
 )
-from prometheus_client.exposition import make_wsgi_app, _SilentHandler
 from prometheus_client.samples import Sample
-from pyzm.api import ZMApi
-from pyzm.ZMMemory import ZMMemory
-from pyzm.helpers import Monitor, State
-from websocket import create_connection
+from prometheus_client.utils import floatToGoString
+
+# pyzm, websocket-client and zoneinfo are imported where they are first used
+# (the ZM connection thread, and the optional stages) so the HTTP listener
+# comes up without waiting on them.
+if TYPE_CHECKING:
+    from zoneinfo import ZoneInfo
+    from pyzm.api import ZMApi
+    from pyzm.ZMMemory import ZMMemory
+    from pyzm.helpers import State
+
+
+def _process_start_time() -> float:
+    """When this process started, from Linux's ``/proc`` (field 22 of
+    ``/proc/self/stat``, in clock ticks after boot); now, where that is
+    unavailable."""
+    try:
+        with open('/proc/self/stat') as fh:
+            # fields from the 3rd on follow the parenthesized command name,
+            # which may itself hold spaces
+            fields: List[str] = fh.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as fh:
+            uptime: float = float(fh.read().split()[0])
+        started: float = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time()
+    return time.time() - uptime + started
+
+
+# startup timing covers the interpreter and all imports
+_START_TIME: float = _process_start_time()
 
 FORMAT = "[%(asctime)s %(levelname)s] %(message)s"
 logging.basicConfig(level=logging.WARNING, format=FORMAT)
 logger = logging.getLogger()
 
+#: seconds from process start (module import) to each startup milestone
+STARTUP_PHASES: Dict[str, float] = {}
+
+
+def _env_bool(
+    name: str, default: bool, env: Optional[Mapping[str, str]] = None
+) -> bool:
+    """Boolean environment variable (from ``env``, by default the process
+    environment): true/yes/on/1 (any case) are true."""
+    val: Optional[str] = (os.environ if env is None else env).get(name)
+    if val is None or val == '':
+        return default
+    return val.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def mark_startup(phase: str) -> None:
+    """Record the first time ``phase`` of startup was reached."""
+    if phase not in STARTUP_PHASES:
+        STARTUP_PHASES[phase] = time.time() - _START_TIME
+        logger.info('Startup: %s after %.3fs', phase, STARTUP_PHASES[phase])
+
 
 def camel_to_snake(name):
     if name == 'SaveJPEGs':
@@ -79,7 +149,13 @@ def enum_metric_family(
 
 
 class LabeledGaugeMetricFamily(Metric):
-    """Not sure why the upstream one doesn't allow labels..."""
+    """Not sure why the upstream one doesn't allow labels...
+
+    Samples keep the label dicts passed to :meth:`add_metric` rather than
+    copies, so per-monitor label dicts can be shared across families: a
+    dict passed in belongs to the family from then on and is never
+    mutated by it or the caller.
+    """
 
     def __init__(
         self,
@@ -99,12 +175,14 @@ class LabeledGaugeMetricFamily(Metric):
     def add_metric(self, labels: Dict[str, str], value: float) -> None:
         """Add a metric to the metric family.
         Args:
-          labels: A dictionary of labels
+          labels: A dictionary of labels; without family-level labels it is
+            stored as-is (not copied), so it must not be mutated afterwards
           value: A float
         """
-        self.samples.append(
-            Sample(self.name, dict(labels | self._labels), value, None)
-        )
+        self.samples.append(Sample(
+            self.name, labels | self._labels if self._labels else labels,
+            value, None
+        ))
 
 
 class LabeledStateSetMetricFamily(Metric):
@@ -135,6 +213,265 @@ class LabeledStateSetMetricFamily(Metric):
             ))
 
 
+# ZM API bodies are decoded with orjson when it is installed (several times
+# faster than the stdlib on the large monitors/events payloads); it is an
+# optional dependency, so fall back to the json module.
+try:
+    import orjson
+    JSON_BACKEND: str = 'orjson'
+    _json_loads = orjson.loads
+except ImportError:
+    JSON_BACKEND = 'json'
+    _json_loads = json.loads
+
+
+def _timed(func):
+    """Cheap always-on timing for :class:`ZmExporter` methods: accumulates
+    calls and wall time per function name via ``_record_timing``. For
+    generator methods (the ``_do_*`` stages) it counts only the time spent
+    inside the generator, not in whatever consumes it."""
+    name: str = func.__name__
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(self, *args, **kwargs):
+            gen = func(self, *args, **kwargs)
+            elapsed: float = 0.0
+            try:
+                while True:
+                    start: float = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    yield item
+            finally:
+                gen.close()
+                self._record_timing(name, elapsed)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start: float = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self._record_timing(name, time.perf_counter() - start)
+    return wrapper
+
+
+# shortest stack-sampling interval /-/profile accepts; shorter ones would
+# make the sampler thread compete with the collection it is measuring
+PROFILE_MIN_INTERVAL: float = 0.001
+
+
+def sample_stacks(
+    func: Callable[[], Any], interval: float
+) -> Dict[str, int]:
+    """Call ``func`` while a background thread samples the calling thread's
+    stack every ``interval`` seconds; returns ``{collapsed_stack: samples}``
+    with frames root-first, separated by ``;``."""
+    target: int = threading.get_ident()
+    counts: Dict[str, int] = {}
+    done: threading.Event = threading.Event()
+
+    def sampler():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                    f'{code.co_firstlineno})'
+                )
+                frame = frame.f_back
+            key: str = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+
+    thread = threading.Thread(target=sampler, name='zm-sampler', daemon=True)
+    thread.start()
+    try:
+        func()
+    finally:
+        done.set()
+        thread.join()
+    return counts
+
+
+class GcPauseTracker:
+    """Times garbage-collector pauses through :data:`gc.callbacks`: the total
+    per generation, and the longest pause since the last :meth:`reset_max`.
+    """
+
+    def __init__(self):
+        self.total: List[float] = [0.0] * 3
+        self.max: List[float] = [0.0] * 3
+        self._start: float = 0.0
+
+    def install(self) -> None:
+        if self.callback not in gc.callbacks:
+            gc.callbacks.append(self.callback)
+
+    def callback(self, phase: str, info: Dict[str, int]) -> None:
+        if phase == 'start':
+            self._start = time.perf_counter()
+            return
+        pause: float = time.perf_counter() - self._start
+        gen: int = info['generation']
+        self.total[gen] += pause
+        if pause > self.max[gen]:
+            self.max[gen] = pause
+
+    def reset_max(self) -> None:
+        self.max = [0.0] * 3
+
+
+GC_PAUSES: GcPauseTracker = GcPauseTracker()
+
+
+class Tracing:
+    """Optional OpenTelemetry spans for collections: :meth:`span` nests
+    each new span under the one open in the same thread and is a no-op
+    (yielding ``None``) without a tracer.
+
+    The parent is tracked per thread rather than with the OpenTelemetry
+    context, because stages are generators that yield back to the scrape
+    handler with their span still open.
+    """
+
+    def __init__(
+        self,
+        tracer: Any = None,
+        set_span_in_context: Optional[Callable[[Any], Any]] = None,
+        error_status: Any = None,
+    ):
+        self._tracer = tracer
+        self._set_span_in_context = set_span_in_context
+        self._error_status = error_status
+        self._local: threading.local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self._tracer is not None
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: Any) -> Generator[Any, None, None]:
+        if self._tracer is None:
+            yield None
+            return
+        parent: Any = getattr(self._local, 'span', None)
+        span: Any = self._tracer.start_span(
+            name, attributes=attributes,
+            context=(
+                None if parent is None else self._set_span_in_context(parent)
+            )
+        )
+        self._local.span = span
+        try:
+            yield span
+        except Exception as ex:
+            span.record_exception(ex)
+            span.set_status(self._error_status)
+            raise
+        finally:
+            self._local.span = parent
+            span.end()
+
+
+def setup_tracing(mode: str, path: str) -> Tracing:
+    """A :class:`Tracing` exporting spans with the OpenTelemetry SDK (an
+    optional dependency, imported only here): ``otlp`` sends them to an
+    OTLP/HTTP collector, configured by the standard ``OTEL_EXPORTER_OTLP_*``
+    variables (default ``http://localhost:4318``); ``file`` appends them to
+    ``path`` as JSON lines."""
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor, ConsoleSpanExporter
+    )
+    from opentelemetry.trace import Status, StatusCode, set_span_in_context
+    if mode == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter
+        )
+        exporter: Any = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter(
+            out=open(path, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + '\n'
+        )
+    provider = TracerProvider(resource=Resource.create({
+        'service.name': os.environ.get('OTEL_SERVICE_NAME', 'zm-exporter')
+    }))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return Tracing(
+        provider.get_tracer('zm-exporter'), set_span_in_context,
+        Status(StatusCode.ERROR)
+    )
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """High-water resident set size of this process, or None where the
+    :mod:`resource` module is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+LABEL_MODES: Tuple[str, ...] = ('full', 'hash', 'drop')
+
+
+def with_label(
+    labels: Dict[str, str], key: str, value: str, mode: str
+) -> Dict[str, str]:
+    """``labels`` plus ``key``: ``value`` as is (``full``), as a short
+    stable hash of it (``hash``, for long values), or not at all
+    (``drop``, for values whose churn creates new series)."""
+    if mode == 'drop':
+        return labels
+    if mode == 'hash':
+        value = hashlib.sha1(value.encode()).hexdigest()[:12]
+    return labels | {key: value}
+
+
+def limit_info_samples(
+    family: Metric,
+    keep: Optional[FrozenSet[str]],
+    last_sent: Optional[Dict[Tuple[str, str], Tuple[Any, float]]] = None,
+    now: float = 0.0,
+    resend_seconds: float = 0.0,
+) -> None:
+    """Trim an info ``family`` in place to the ``keep`` labels (plus ``id``
+    and ``name``; all labels if ``None``). With ``last_sent`` -- label set
+    and send time per ``(id, name)``, updated here -- only samples whose
+    label set changed, or was last sent ``resend_seconds`` ago, are kept."""
+    samples: List[Sample] = []
+    for sample in family.samples:
+        labels: Dict[str, str] = sample.labels
+        if keep is not None:
+            labels = {
+                k: v for k, v in labels.items()
+                if k in keep or k in ('id', 'name')
+            }
+        if last_sent is not None:
+            key: Tuple[str, str] = (labels.get('id'), labels.get('name'))
+            prev: Optional[Tuple[Any, float]] = last_sent.get(key)
+            if (
+                prev is not None and prev[0] == labels
+                and now - prev[1] < resend_seconds
+            ):
+                continue
+            last_sent[key] = (labels, now)
+        samples.append(sample._replace(labels=labels))
+    family.samples = samples
+
+
 class InvalidStatusStringException(Exception):
     pass
 
@@ -170,7 +507,12 @@ def _event_int(raw: Dict[str, Any], key: str) -> int:
     ZM's JSON returns numeric fields (DiskSpace, Frames, Emptied) as strings,
     and DiskSpace is None/'' for events whose size ZM has not computed yet.
     """
-    val = raw.get(key)
+    return _event_int_value(raw.get(key))
+
+
+def _event_int_value(val: Any) -> int:
+    """Value-level half of :func:`_event_int`, so callers that already hold
+    the raw field value (e.g. to memoize it) parse it identically."""
     if val in (None, ''):
         return 0
     try:
@@ -179,12 +521,143 @@ def _event_int(raw: Dict[str, Any], key: str) -> int:
         return 0
 
 
+def _blank_event_agg() -> Dict[str, Any]:
+    """Per-monitor accumulator shared by the event aggregation functions."""
+    return {
+        'ended_count': 0,
+        'zero_size_count': 0,
+        'disk_space_sum': 0,
+        'min_disk_space': None,
+        'min_frames': None,
+        'last_event': None,
+    }
+
+
+_EPOCH: datetime = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class EventHistograms:
+    """Cumulative per-monitor histograms of event duration, size and frame
+    count, fed by the event aggregators in the same pass over the events
+    (``StartDateTime`` is only parsed for events not yet counted).
+
+    Each ended, non-purged event is observed once, when it is at least
+    ``grace_seconds`` old (so its size and frame count are final): event ids
+    already counted are remembered until their end time falls more than
+    ``horizon_seconds`` behind, past anything the events query can return
+    again. Counts start from zero when the exporter starts, like any other
+    Prometheus counter; the first collection observes the whole window.
+    """
+
+    KINDS: Tuple[str, ...] = ('duration', 'size', 'frames')
+
+    def __init__(
+        self,
+        buckets: Dict[str, Tuple[float, ...]],
+        horizon_seconds: int,
+    ):
+        self.buckets: Dict[str, Tuple[float, ...]] = {
+            kind: tuple(sorted(buckets[kind])) for kind in self.KINDS
+        }
+        self.horizon_seconds: int = horizon_seconds
+        self._seen: Dict[int, int] = {}
+        self._state: Dict[int, Dict[str, List[Any]]] = {}
+
+    def __contains__(self, eid: int) -> bool:
+        """Whether event ``eid`` has already been counted; callers check
+        this before parsing ``StartDateTime`` for :meth:`observe`."""
+        return eid in self._seen
+
+    def observe(
+        self,
+        mid: int,
+        eid: int,
+        end_epoch: int,
+        start_epoch: Optional[int],
+        disk: int,
+        frames: int,
+    ) -> None:
+        """Count one ended event (no-op if it was already counted)."""
+        if eid in self._seen:
+            return
+        self._seen[eid] = end_epoch
+        state: Optional[Dict[str, List[Any]]] = self._state.get(mid)
+        if state is None:
+            state = self._state[mid] = {
+                kind: [[0] * len(self.buckets[kind]), 0, 0]
+                for kind in self.KINDS
+            }
+        if start_epoch is not None and start_epoch <= end_epoch:
+            self._add(state, 'duration', end_epoch - start_epoch)
+        self._add(state, 'size', disk)
+        self._add(state, 'frames', frames)
+
+    def _add(
+        self, state: Dict[str, List[Any]], kind: str, value: float
+    ) -> None:
+        hist: List[Any] = state[kind]
+        for i, bound in enumerate(self.buckets[kind]):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += 1
+        hist[2] += value
+
+    def prune(self, now_epoch: float, monitor_ids: Iterable[int]) -> None:
+        """Forget counted event ids that ended beyond the horizon, and the
+        histograms of monitors no longer in ``monitor_ids``."""
+        cutoff: float = now_epoch - self.horizon_seconds
+        self._seen = {
+            eid: end for eid, end in self._seen.items() if end >= cutoff
+        }
+        for mid in set(self._state) - set(monitor_ids):
+            del self._state[mid]
+
+    def collect(
+        self,
+        monitors: Dict[int, str],
+        labels_for: Callable[[int, str], Dict[str, str]],
+    ) -> List[Metric]:
+        families: Dict[str, HistogramMetricFamily] = {
+            'duration': HistogramMetricFamily(
+                'zm_monitor_event_duration_seconds',
+                'Durations of ended events (EndDateTime - StartDateTime)',
+                labels=['id', 'name']
+            ),
+            'size': HistogramMetricFamily(
+                'zm_monitor_event_size_bytes',
+                'DiskSpace in bytes of ended, non-purged events',
+                labels=['id', 'name']
+            ),
+            'frames': HistogramMetricFamily(
+                'zm_monitor_event_frames',
+                'Frame counts of ended, non-purged events',
+                labels=['id', 'name']
+            ),
+        }
+        for mid, state in sorted(self._state.items()):
+            if mid not in monitors:
+                continue
+            labels: Dict[str, str] = labels_for(mid, monitors[mid])
+            values: List[str] = [labels['id'], labels['name']]
+            for kind, family in families.items():
+                counts, count, total = state[kind]
+                family.add_metric(
+                    values,
+                    [(floatToGoString(b), c) for b, c in zip(
+                        self.buckets[kind], counts
+                    )] + [('+Inf', count)],
+                    total
+                )
+        return list(families.values())
+
+
 def aggregate_events(
-    raw_events: List[Dict[str, Any]],
+    raw_events: Iterable[Dict[str, Any]],
     monitor_ids: List[int],
     now: datetime,
     window_seconds: int,
     grace_seconds: int,
+    histograms: Optional[EventHistograms] = None,
 ) -> Dict[int, Dict[str, Any]]:
     """Aggregate raw ZM event dicts (``Event.get()`` output) into per-monitor
     recording-persistence facts. Pure function -- no I/O -- so it is unit
@@ -203,18 +676,14 @@ def aggregate_events(
 
     Windowed counters default to 0 for every id in ``monitor_ids`` so callers
     can emit a series for every monitor even when it had no recent events.
-    """
-    def _blank() -> Dict[str, Any]:
-        return {
-            'ended_count': 0,
-            'zero_size_count': 0,
-            'disk_space_sum': 0,
-            'min_disk_space': None,
-            'min_frames': None,
-            'last_event': None,
-        }
 
-    agg: Dict[int, Dict[str, Any]] = {mid: _blank() for mid in monitor_ids}
+    When ``histograms`` is given, every ended, non-purged event at least
+    ``grace_seconds`` old is also observed into it (see
+    :class:`EventHistograms`).
+    """
+    agg: Dict[int, Dict[str, Any]] = {
+        mid: _blank_event_agg() for mid in monitor_ids
+    }
 
     for raw in raw_events:
         try:
@@ -226,7 +695,7 @@ def aggregate_events(
         if end_dt is None:
             # still-open / in-progress event: no final size yet -> ignore
             continue
-        m = agg.setdefault(mid, _blank())
+        m = agg.setdefault(mid, _blank_event_agg())
         disk = _event_int(raw, 'DiskSpace')
         frames = _event_int(raw, 'Frames')
         # newest ended event by id, regardless of window -> freshness gate
@@ -235,6 +704,15 @@ def aggregate_events(
             m['last_event'] = (eid, end_dt, disk, frames)
         # windowed aggregates: ended in [grace, window] ago, not purged
         end_age = (now - end_dt).total_seconds()
+        if (
+            histograms is not None and eid not in histograms
+            and end_age >= grace_seconds and _event_int(raw, 'Emptied') != 1
+        ):
+            start = _epoch_and_datetime(raw.get('StartDateTime'))
+            histograms.observe(
+                mid, eid, (end_dt - _EPOCH) // timedelta(seconds=1),
+                start[0] if start else None, disk, frames
+            )
         if not (grace_seconds <= end_age <= window_seconds):
             continue
         if _event_int(raw, 'Emptied') == 1:
@@ -250,115 +728,2674 @@ def aggregate_events(
     return agg
 
 
-class ZmExporter:
+def _epoch_and_datetime(value: Any) -> Optional[Tuple[int, datetime]]:
+    """``(epoch_seconds, datetime)`` for a ZM event datetime string, parsed by
+    :func:`_parse_zm_datetime`; ``None`` if unset/unparseable."""
+    dt: Optional[datetime] = _parse_zm_datetime(value)
+    if dt is None:
+        return None
+    return (dt - _EPOCH) // timedelta(seconds=1), dt
 
-    STATUS_RE: re.Pattern = re.compile(
-        r"^'(?P<command>[^']+)' running since (?P<year>\d{1,2})/"
-        r"(?P<month>\d{1,2})/(?P<day>\d{1,2}) (?P<hour>\d{1,2}):"
-        r"(?P<minute>\d{1,2}):(?P<second>\d{1,2}), pid = (?P<pid>\d+).*"
-    )
 
-    def _env_or_err(self, name: str) -> str:
-        s: str = os.environ.get(name)
-        if not s:
-            raise RuntimeError(
-                f'ERROR: You must set the "{name}" environment variable.'
-            )
-        return s
+def aggregate_events_columnar(
+    raw_events: Iterable[Dict[str, Any]],
+    monitor_ids: List[int],
+    now: datetime,
+    window_seconds: int,
+    grace_seconds: int,
+    use_numpy: Optional[bool] = None,
+    histograms: Optional[EventHistograms] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """Columnar implementation of :func:`aggregate_events`, for very wide
+    event windows; the result is identical.
 
-    def __init__(self):
-        logger.debug('Instantiating ZmExporter')
-        self._api_url: str = self._env_or_err('ZM_API_URL')
-        logger.info('Connecting to ZM API at: %s', self._api_url)
-        
-        # Build options dict and add optional authentication credentials if provided
-        api_options: Dict[str, Any] = {'apiurl': self._api_url}
-        zm_user: Optional[str] = os.environ.get('ZM_USER')
-        zm_password: Optional[str] = os.environ.get('ZM_PASSWORD')
-        
-        if zm_user and zm_password:
-            logger.debug('Using ZoneMinder authentication')
-            api_options['user'] = zm_user
-            api_options['password'] = zm_password
-        elif zm_user or zm_password:
-            logger.warning(
-                'Both ZM_USER and ZM_PASSWORD must be provided for authentication. '
-                'Only one was provided; proceeding without authentication.'
+    One pass converts the events payload into typed ``array.array`` columns
+    (monitor id, event id, end epoch, disk, frames, emptied). Date parsing is
+    memoized by string, as are ``Frames``/``Emptied`` -- a window of 10^5+
+    events repeats the same values constantly, so ``strptime`` runs once per
+    distinct second rather than once per event. The grouped counts, sums and
+    minimums are then computed in bulk with NumPy when it is importable
+    (``use_numpy=None``, the default), otherwise with a loop over the columns.
+    ``use_numpy=True`` requires NumPy; ``False`` never uses it.
+
+    ``raw_events`` is consumed once, so it may be a generator (e.g. streamed
+    pages). A value outside int64 switches the columns to plain lists and
+    the loop path for the rest of the call. ``histograms`` is fed during the
+    conversion pass, reusing the memoized dates.
+
+    ``now`` must be timezone-aware (UTC), as for :func:`aggregate_events`.
+    """
+    np: Any = None
+    if use_numpy is not False:
+        try:
+            import numpy as np
+        except ImportError:
+            if use_numpy:
+                raise
+    dt_cache: Dict[Any, Optional[Tuple[int, datetime]]] = {}
+    int_cache: Dict[Any, int] = {}
+    mids: array = array('q')
+    eids: array = array('q')
+    ends: array = array('q')
+    disks: array = array('q')
+    frames: array = array('q')
+    emptied: array = array('b')
+    end_dts: List[datetime] = []
+    # "ended between grace and window ago" as an inclusive range of integer
+    # end epochs; done in microseconds so it matches the float comparison in
+    # aggregate_events exactly even when ``now`` has a fractional second.
+    now_us: int = (now - _EPOCH) // timedelta(microseconds=1)
+    lo: int = -((window_seconds * 1_000_000 - now_us) // 1_000_000)
+    hi: int = (now_us - grace_seconds * 1_000_000) // 1_000_000
+    for raw in raw_events:
+        try:
+            mid = int(raw['MonitorId'])
+            eid = int(raw['Id'])
+        except (KeyError, ValueError, TypeError):
+            continue
+        val = raw.get('EndDateTime')
+        try:
+            parsed = dt_cache[val]
+        except KeyError:
+            parsed = dt_cache[val] = _epoch_and_datetime(val)
+        except TypeError:
+            # unhashable; _parse_zm_datetime rejects these anyway
+            parsed = None
+        if parsed is None:
+            # still-open / in-progress event: no final size yet -> ignore
+            continue
+        val = raw.get('Frames')
+        try:
+            frm = int_cache[val]
+        except KeyError:
+            frm = int_cache[val] = _event_int_value(val)
+        except TypeError:
+            frm = _event_int_value(val)
+        val = raw.get('Emptied')
+        try:
+            emp = int_cache[val]
+        except KeyError:
+            emp = int_cache[val] = _event_int_value(val)
+        except TypeError:
+            emp = _event_int_value(val)
+        disk = _event_int_value(raw.get('DiskSpace'))
+        if (
+            histograms is not None and emp != 1 and parsed[0] <= hi
+            and eid not in histograms
+        ):
+            val = raw.get('StartDateTime')
+            try:
+                start = dt_cache[val]
+            except KeyError:
+                start = dt_cache[val] = _epoch_and_datetime(val)
+            except TypeError:
+                start = None
+            histograms.observe(
+                mid, eid, parsed[0], start[0] if start else None, disk, frm
             )
-        
-        self._api: ZMApi = ZMApi(options=api_options)
-        logger.debug('Connected to ZM')
-        self.query_time: float = 0.0
-        self._monitor_id_to_name: Dict[int, str] = {}
-        # Recording-persistence event metrics: aggregate over events that ended
-        # in the last ZM_EVENT_WINDOW_SECONDS (default 15m), ignoring the most
-        # recent ZM_EVENT_GRACE_SECONDS (default 2m) so events whose DiskSpace
-        # ZM has not finished computing yet do not read as zero-size failures.
-        # ZM_EVENT_QUERY_LIMIT bounds how many events a single scrape fetches;
-        # keep it comfortably above the busiest window so results are not
-        # truncated (pyzm sorts newest-first and stops at the limit).
-        self._event_window_seconds: int = int(
-            os.environ.get('ZM_EVENT_WINDOW_SECONDS', '900')
-        )
-        self._event_grace_seconds: int = int(
-            os.environ.get('ZM_EVENT_GRACE_SECONDS', '120')
+        try:
+            mids.append(mid)
+            eids.append(eid)
+            ends.append(parsed[0])
+            disks.append(disk)
+            frames.append(frm)
+            emptied.append(1 if emp == 1 else 0)
+        except OverflowError:
+            # a value outside int64: drop this row's partial appends and
+            # continue with unbounded lists (the raw events cannot be
+            # replayed when streamed, so no fallback to aggregate_events)
+            n: int = len(end_dts)
+            mids, eids, ends, disks, frames, emptied = (
+                list(col[:n])
+                for col in (mids, eids, ends, disks, frames, emptied)
+            )
+            np = None
+            mids.append(mid)
+            eids.append(eid)
+            ends.append(parsed[0])
+            disks.append(disk)
+            frames.append(frm)
+            emptied.append(1 if emp == 1 else 0)
+        end_dts.append(parsed[1])
+
+    agg: Dict[int, Dict[str, Any]] = {
+        mid: _blank_event_agg() for mid in monitor_ids
+    }
+    if np is not None:
+        _group_event_columns_numpy(
+            np, agg, mids, eids, ends, disks, frames, emptied, end_dts, lo, hi
         )
-        self._event_query_limit: int = int(
-            os.environ.get('ZM_EVENT_QUERY_LIMIT', '500')
+        return agg
+    for mid, eid, end, disk, frm, emp, end_dt in zip(
+        mids, eids, ends, disks, frames, emptied, end_dts
+    ):
+        m = agg.get(mid)
+        if m is None:
+            m = agg[mid] = _blank_event_agg()
+        prev = m['last_event']
+        if prev is None or eid > prev[0]:
+            m['last_event'] = (eid, end_dt, disk, frm)
+        if emp or not lo <= end <= hi:
+            continue
+        m['ended_count'] += 1
+        m['disk_space_sum'] += disk
+        if disk == 0:
+            m['zero_size_count'] += 1
+        if m['min_disk_space'] is None or disk < m['min_disk_space']:
+            m['min_disk_space'] = disk
+        if m['min_frames'] is None or frm < m['min_frames']:
+            m['min_frames'] = frm
+    return agg
+
+
+def _group_event_columns_numpy(
+    np: Any, agg: Dict[int, Dict[str, Any]], mids: array, eids: array,
+    ends: array, disks: array, frames: array, emptied: array,
+    end_dts: List[datetime], lo: int, hi: int,
+) -> None:
+    """NumPy grouping step of :func:`aggregate_events_columnar`; fills
+    ``agg`` in place."""
+    n: int = len(mids)
+    if not n:
+        return
+    mid_a = np.frombuffer(mids, dtype=np.int64)
+    eid_a = np.frombuffer(eids, dtype=np.int64)
+    # add unseen monitors in first-appearance order, like the dict loop does
+    uniq, first = np.unique(mid_a, return_index=True)
+    for mid in uniq[np.argsort(first)].tolist():
+        if mid not in agg:
+            agg[mid] = _blank_event_agg()
+    # last_event: highest id per monitor; on duplicate ids the loop keeps the
+    # earliest row (strict ">"), so break ties by row number.
+    order = np.lexsort((np.arange(n), -eid_a, mid_a))
+    sorted_mids = mid_a[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], sorted_mids[1:] != sorted_mids[:-1]))
+    )
+    for row in order[starts].tolist():
+        agg[mids[row]]['last_event'] = (
+            eids[row], end_dts[row], disks[row], frames[row]
         )
-        # ZoneMinder's events API filters by StartTime in the ZM SERVER's local
-        # timezone (while returning EndDateTime in UTC -- yes, inconsistent). We
-        # compute the events query's `from` bound in an explicit timezone so it
-        # is correct regardless of THIS process's timezone -- the exporter
-        # container often runs as UTC even when ZM does not, which would push
-        # the bound into the future and return zero events. Source the tz from
-        # ZM_EVENT_QUERY_TZ, then TZ; if neither resolves, fall back to a
-        # process-local relative bound (correct only when this process's tz
-        # already matches the ZM server's).
-        self._event_query_tz: Optional[ZoneInfo] = None
-        tz_name: Optional[str] = (
-            os.environ.get('ZM_EVENT_QUERY_TZ') or os.environ.get('TZ')
+    end_a = np.frombuffer(ends, dtype=np.int64)
+    sel = np.flatnonzero(
+        (end_a >= lo) & (end_a <= hi)
+        & (np.frombuffer(emptied, dtype=np.int8) == 0)
+    )
+    if not len(sel):
+        return
+    win_mids = mid_a[sel]
+    order = np.argsort(win_mids, kind='stable')
+    win_mids = win_mids[order]
+    win_disk = np.frombuffer(disks, dtype=np.int64)[sel][order]
+    win_frames = np.frombuffer(frames, dtype=np.int64)[sel][order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], win_mids[1:] != win_mids[:-1]))
+    )
+    counts = np.diff(np.append(starts, len(win_mids)))
+    for mid, count, total, zeros, min_disk, min_frames in zip(
+        win_mids[starts].tolist(),
+        counts.tolist(),
+        np.add.reduceat(win_disk, starts).tolist(),
+        np.add.reduceat((win_disk == 0).astype(np.int64), starts).tolist(),
+        np.minimum.reduceat(win_disk, starts).tolist(),
+        np.minimum.reduceat(win_frames, starts).tolist(),
+    ):
+        m = agg[mid]
+        m['ended_count'] = count
+        m['disk_space_sum'] = total
+        m['zero_size_count'] = zeros
+        m['min_disk_space'] = min_disk
+        m['min_frames'] = min_frames
+
+
+def metrics_to_json(metrics: List[Metric]) -> List[Dict[str, Any]]:
+    """JSON-serializable form of collected metric families (for snapshots);
+    the inverse of :func:`metrics_from_json`."""
+    return [
+        {
+            'name': m.name,
+            'documentation': m.documentation,
+            'type': m.type,
+            'unit': m.unit,
+            'samples': [[s.name, s.labels, s.value] for s in m.samples],
+        }
+        for m in metrics
+    ]
+
+
+def metrics_from_json(data: List[Dict[str, Any]]) -> List[Metric]:
+    metrics: List[Metric] = []
+    for fam in data:
+        m = Metric(fam['name'], fam['documentation'], fam['type'], fam['unit'])
+        m.samples = [
+            Sample(name, labels, value) for name, labels, value in fam['samples']
+        ]
+        metrics.append(m)
+    return metrics
+
+
+class EventRollupStore:
+    """Incremental per-monitor event rollups persisted in a local SQLite file.
+
+    Events are folded into hourly buckets (keyed by the hour they *ended*)
+    as :meth:`ZmExporter._do_events` fetches them; each event id is recorded
+    so overlapping scrapes never count an event twice. Long-window aggregates
+    (:attr:`WINDOWS`) are then cheap ``SUM``s over at most a few hundred
+    bucket rows per monitor instead of re-querying the events API.
+
+    :meth:`compact` merges hourly buckets older than ``compact_after``
+    seconds into daily buckets, drops buckets older than the retention
+    period, and forgets ingested event ids old enough that the events query
+    can no longer return them. Windows are bucket-aligned: a window includes
+    every bucket overlapping it, so it may reach back up to one bucket width
+    further than its nominal length.
+    """
+
+    HOUR: int = 3600
+    DAY: int = 86400
+    WINDOWS: Dict[str, int] = {'1h': HOUR, '24h': DAY, '7d': 7 * DAY}
+
+    SCHEMA: str = '''
+        CREATE TABLE IF NOT EXISTS buckets (
+            monitor_id INTEGER NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            zero_size INTEGER NOT NULL,
+            disk_bytes INTEGER NOT NULL,
+            PRIMARY KEY (monitor_id, bucket_start, resolution)
+        );
+        CREATE TABLE IF NOT EXISTS ingested (
+            event_id INTEGER PRIMARY KEY,
+            end_time INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ingested_end_time ON ingested (end_time);
+    '''
+
+    UPSERT: str = '''
+        INSERT INTO buckets (
+            monitor_id, bucket_start, resolution, events, zero_size, disk_bytes
+        ) {source}
+        ON CONFLICT (monitor_id, bucket_start, resolution) DO UPDATE SET
+            events = events + excluded.events,
+            zero_size = zero_size + excluded.zero_size,
+            disk_bytes = disk_bytes + excluded.disk_bytes
+    '''
+
+    def __init__(
+        self, path: str, retention_seconds: int = 8 * DAY,
+        compact_after: int = 2 * DAY, dedupe_seconds: int = 2 * DAY,
+    ):
+        self.path: str = path
+        self._retention: int = retention_seconds
+        self._compact_after: int = compact_after
+        self._dedupe_seconds: int = dedupe_seconds
+        self._last_compaction: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+        self._db: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False
         )
-        if tz_name:
+        self._db.executescript(self.SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def ingest(
+        self, raw_events: Iterable[Dict[str, Any]], now: datetime,
+        grace_seconds: int
+    ) -> int:
+        """Fold not-yet-seen events into their hourly buckets; returns how
+        many were new. Like the windowed metrics, this skips open events,
+        purged (``Emptied=1``) events, and events that ended less than
+        ``grace_seconds`` ago (their DiskSpace may not be final); those are
+        picked up by a later call once they qualify."""
+        rows: List[Tuple[int, int, int, int]] = []
+        for raw in raw_events:
             try:
-                self._event_query_tz = ZoneInfo(tz_name)
-            except (ZoneInfoNotFoundError, ValueError) as ex:
-                logger.warning(
-                    'Could not resolve timezone %r for event queries (%s); '
-                    'falling back to process-local time. Ensure the tzdata '
-                    'package is installed or set a valid ZM_EVENT_QUERY_TZ.',
-                    tz_name, ex
+                mid = int(raw['MonitorId'])
+                eid = int(raw['Id'])
+            except (KeyError, ValueError, TypeError):
+                continue
+            end_dt: Optional[datetime] = _parse_zm_datetime(
+                raw.get('EndDateTime')
+            )
+            if end_dt is None or (now - end_dt).total_seconds() < grace_seconds:
+                continue
+            if _event_int(raw, 'Emptied') == 1:
+                continue
+            rows.append((
+                eid, int(end_dt.timestamp()), mid, _event_int(raw, 'DiskSpace')
+            ))
+        new: int = 0
+        with self._lock, self._db:
+            for eid, end, mid, disk in rows:
+                if not self._db.execute(
+                    'INSERT OR IGNORE INTO ingested VALUES (?, ?)', (eid, end)
+                ).rowcount:
+                    continue
+                new += 1
+                self._db.execute(
+                    self.UPSERT.format(source='VALUES (?, ?, ?, 1, ?, ?)'),
+                    (mid, end - end % self.HOUR, self.HOUR,
+                     1 if disk == 0 else 0, disk)
                 )
+        if time.time() - self._last_compaction >= self.HOUR:
+            self.compact(int(now.timestamp()))
+        return new
+
+    def compact(self, now: int) -> None:
+        """Merge old hourly buckets into daily ones and apply retention."""
+        cutoff: int = now - self._compact_after
+        cutoff -= cutoff % self.DAY
+        with self._lock, self._db:
+            self._db.execute(
+                self.UPSERT.format(source='''
+                    SELECT monitor_id, bucket_start - bucket_start % ?, ?,
+                        SUM(events), SUM(zero_size), SUM(disk_bytes)
+                    FROM buckets WHERE resolution = ? AND bucket_start < ?
+                    GROUP BY 1, 2
+                '''),
+                (self.DAY, self.DAY, self.HOUR, cutoff)
+            )
+            self._db.execute(
+                'DELETE FROM buckets WHERE resolution = ? AND bucket_start < ?',
+                (self.HOUR, cutoff)
+            )
+            self._db.execute(
+                'DELETE FROM buckets WHERE bucket_start + resolution <= ?',
+                (now - self._retention,)
+            )
+            self._db.execute(
+                'DELETE FROM ingested WHERE end_time < ?',
+                (now - self._dedupe_seconds,)
+            )
+        self._last_compaction = time.time()
+
+    def totals(self, now: int) -> Dict[str, Dict[int, Tuple[int, int, int]]]:
+        """``{window: {monitor_id: (events, zero_size, disk_bytes)}}`` for
+        each of :attr:`WINDOWS`, ending at epoch ``now``."""
+        result: Dict[str, Dict[int, Tuple[int, int, int]]] = {}
+        with self._lock:
+            for window, seconds in self.WINDOWS.items():
+                result[window] = {
+                    row[0]: row[1:] for row in self._db.execute(
+                        'SELECT monitor_id, SUM(events), SUM(zero_size), '
+                        'SUM(disk_bytes) FROM buckets '
+                        'WHERE bucket_start + resolution > ? '
+                        'GROUP BY monitor_id',
+                        (now - seconds,)
+                    )
+                }
+        return result
+
+
+class AdaptiveInterval:
+    """Refresh interval for an expensive collection stage: 0 (every
+    collection) while the ZM API is healthy, doubling from ``step`` up to
+    ``max_interval`` seconds while it is overloaded, and halving back once
+    it recovers."""
+
+    def __init__(self, max_interval: float, step: float = 30.0):
+        self.interval: float = 0.0
+        self.max_interval: float = max_interval
+        self.step: float = step
+        self.last_run: Optional[float] = None
+
+    def due(self, now: float) -> bool:
+        return self.last_run is None or now - self.last_run >= self.interval
+
+    def adjust(self, overloaded: bool, healthy: bool) -> None:
+        if overloaded:
+            self.interval = min(
+                max(self.interval * 2, self.step), self.max_interval
+            )
+        elif healthy and self.interval:
+            self.interval /= 2
+            if self.interval < self.step:
+                self.interval = 0.0
+
+
+def build_event_metrics(
+    agg: Dict[int, Dict[str, Any]],
+    monitors: Dict[int, str],
+    now: datetime,
+    window: int,
+    labels_for: Optional[Callable[[int, str], Dict[str, str]]] = None,
+) -> List[Metric]:
+    """Recording-persistence families for the ``monitors`` (id -> name)
+    from an :func:`aggregate_events` result over a ``window``-second
+    window ending at ``now``. No I/O; ``labels_for`` is as for
+    :func:`build_monitor_metrics`."""
+    last_disk = LabeledGaugeMetricFamily(
+        'zm_monitor_last_event_disk_space_bytes',
+        'DiskSpace in bytes of the most recent ended event for this monitor'
+    )
+    last_age = LabeledGaugeMetricFamily(
+        'zm_monitor_last_event_end_time_age_seconds',
+        'Seconds since the most recent ended event for this monitor ended'
+    )
+    last_frames = LabeledGaugeMetricFamily(
+        'zm_monitor_last_event_frames',
+        'Frame count of the most recent ended event for this monitor'
+    )
+    last_id = LabeledGaugeMetricFamily(
+        'zm_monitor_last_event_id',
+        'Event ID of the most recent ended event for this monitor '
+        '(monotonic; safe to use with increase() as an event-creation rate)'
+    )
+    ended_count = LabeledGaugeMetricFamily(
+        'zm_monitor_recent_ended_event_count',
+        f'Count of events that ended in the last {window}s (excludes '
+        f'still-open and purged events; windowed gauge, do not rate())'
+    )
+    zero_count = LabeledGaugeMetricFamily(
+        'zm_monitor_recent_ended_zero_size_event_count',
+        f'Count of events that ended in the last {window}s having saved '
+        f'zero bytes to disk (windowed gauge, do not rate())'
+    )
+    disk_sum = LabeledGaugeMetricFamily(
+        'zm_monitor_recent_event_disk_space_bytes',
+        f'Sum of DiskSpace in bytes over events that ended in the last '
+        f'{window}s -- recording throughput (windowed gauge, do not rate())'
+    )
+    min_disk = LabeledGaugeMetricFamily(
+        'zm_monitor_recent_min_event_disk_space_bytes',
+        f'Smallest DiskSpace in bytes among events that ended in the last '
+        f'{window}s -- surfaces partial/truncated writes (windowed gauge)'
+    )
+    min_frames = LabeledGaugeMetricFamily(
+        'zm_monitor_recent_min_event_frames',
+        f'Smallest frame count among events that ended in the last '
+        f'{window}s -- surfaces truncated events (windowed gauge)'
+    )
+
+    for mid, name in sorted(monitors.items()):
+        m: Optional[Dict[str, Any]] = agg.get(mid)
+        if not m:
+            continue
+        labels: Dict[str, str] = (
+            labels_for(mid, name) if labels_for
+            else {'id': str(mid), 'name': name}
+        )
+        # windowed metrics: always emit (0 default) so a series exists for
+        # every monitor and "count > 0" alerts have something to evaluate.
+        ended_count.add_metric(labels=labels, value=m['ended_count'])
+        zero_count.add_metric(labels=labels, value=m['zero_size_count'])
+        disk_sum.add_metric(labels=labels, value=m['disk_space_sum'])
+        if m['min_disk_space'] is not None:
+            min_disk.add_metric(labels=labels, value=m['min_disk_space'])
+        if m['min_frames'] is not None:
+            min_frames.add_metric(labels=labels, value=m['min_frames'])
+        # point metrics: only when there is a recent ended event, so a
+        # quiet camera (no events) does not emit a stale/false series.
+        if m['last_event'] is not None:
+            eid, end_dt, disk, frames = m['last_event']
+            last_disk.add_metric(labels=labels, value=disk)
+            last_age.add_metric(
+                labels=labels, value=(now - end_dt).total_seconds()
+            )
+            last_frames.add_metric(labels=labels, value=frames)
+            last_id.add_metric(labels=labels, value=eid)
+    return [
+        last_disk, last_age, last_frames, last_id,
+        ended_count, zero_count, disk_sum, min_disk, min_frames,
+    ]
+
+
+# (labels, Status, CaptureFPS, AnalysisFPS, CaptureBandwidth) of a monitor's
+# Monitor_Status row
+MonitorStatusRow = Tuple[Dict[str, str], str, float, float, float]
+
+
+def build_monitor_status_metrics(
+    rows: Iterable[MonitorStatusRow]
+) -> List[Metric]:
+    """The ``Monitor_Status``-derived families (connected, capture and
+    analysis FPS, capture bandwidth), one sample per monitor ``row``."""
+    connected = LabeledGaugeMetricFamily(
+        'zm_monitor_connected',
+        'Monitor is connected or not'
+    )
+    capture_fps = LabeledGaugeMetricFamily(
+        'zm_monitor_capture_fps',
+        'Monitor capture FPS'
+    )
+    analysis_fps = LabeledGaugeMetricFamily(
+        'zm_monitor_analysis_fps',
+        'Monitor analysis FPS'
+    )
+    capture_bw = LabeledGaugeMetricFamily(
+        'zm_monitor_capture_bandwidth_bytes_per_second',
+        'Monitor capture bandwidth'
+    )
+    for labels, status_str, cfps, afps, bandwidth in rows:
+        connected.add_metric(
+            labels=labels | {'status': status_str},
+            value=1 if status_str == 'Connected' else 0
+        )
+        capture_fps.add_metric(labels=labels, value=cfps)
+        analysis_fps.add_metric(labels=labels, value=afps)
+        capture_bw.add_metric(labels=labels, value=bandwidth)
+    return [connected, capture_fps, analysis_fps, capture_bw]
+
+
+def shm_monitor_status(
+    listed: MonitorStatusRow,
+    shm: Optional[Tuple[bool, float, float, int, int, bool]],
+    now: float,
+    stall_seconds: float,
+) -> MonitorStatusRow:
+    """A monitor's Monitor_Status row from the last full listing, refreshed
+    from its shared memory (:meth:`ShmReader.read_status`).
+
+    zmc keeps the live capture/analysis FPS in shared memory, so those are
+    taken from there. If zmc is gone -- no (valid) shared memory, or a
+    heartbeat older than ``stall_seconds`` -- the monitor is NotRunning,
+    as ZM records when zmc exits. If zmc is alive, it is Connected while
+    it has a signal from the camera or is capturing frames, and Running
+    (as ZM records while zmc retries its source) otherwise, whatever the
+    listing said. The capture bandwidth, which only ZM's database has,
+    stays as listed.
+    """
+    labels, _, _, _, bandwidth = listed
+    if shm is None or not shm[0] or now - shm[3] > stall_seconds:
+        return labels, 'NotRunning', 0.0, 0.0, 0.0
+    status_str: str = 'Connected' if shm[5] or shm[1] > 0 else 'Running'
+    return labels, status_str, shm[1], shm[2], bandwidth
+
+
+ZMC_FAMILIES: FrozenSet[str] = frozenset([
+    'zm_monitor_zmc_uptime_seconds', 'zm_monitor_zmc_pid'
+])
+
+
+def refresh_zmc_metrics(
+    family: Metric,
+    started: Dict[str, Optional[float]],
+    listed_at: float,
+    now: float,
+) -> Metric:
+    """A copy of one of the listing's :data:`ZMC_FAMILIES` (from
+    daemonStatus at ``listed_at``), brought up to ``now`` with ``started``:
+    each monitor id's zmc start time from shared memory, or None if zmc is
+    gone.
+
+    Monitors whose zmc is gone are dropped. A zmc started since the listing
+    has its uptime counted from that start, and no pid until the next
+    listing. Other uptimes advance by the time elapsed.
+    """
+    refreshed: Metric = copy.copy(family)
+    refreshed.samples = []
+    uptime: bool = family.name == 'zm_monitor_zmc_uptime_seconds'
+    for sample in family.samples:
+        mid: str = sample.labels['id']
+        if mid in started and started[mid] is None:
+            continue
+        start: Optional[float] = started.get(mid)
+        if start is not None and start > listed_at:
+            if not uptime:
+                continue
+            sample = sample._replace(value=now - start)
+        elif uptime:
+            sample = sample._replace(value=sample.value + now - listed_at)
+        refreshed.samples.append(sample)
+    return refreshed
+
+
+def build_monitor_metrics(
+    entries: List[Dict[str, Any]],
+    labels_for: Optional[Callable[[int, str], Dict[str, str]]] = None,
+    consume: bool = False,
+) -> List[Metric]:
+    """Metric families derived from the ``/monitors.json`` payload alone
+    (info, modes and settings, ``Monitor_Status`` and ``Event_Summary``) for
+    the given non-deleted monitor ``entries``.
+
+    No I/O, so :class:`ZmExporter` can run it in worker processes over
+    shards of the monitors. With ``consume``, the caller hands ``entries``
+    over and it is emptied as it is processed (pop from the reversed list
+    keeps API order), so each monitor's raw dict is freed once its samples
+    exist rather than the whole payload living alongside all the samples;
+    otherwise it is left as it was. ``labels_for(id, name)`` supplies each
+    monitor's ``{'id', 'name'}`` label dict; by default a new one.
+    """
+    info = InfoMetricFamily(
+        'zm_monitor', 'Information about a monitor',
+    )
+    event_count = LabeledGaugeMetricFamily(
+        'zm_monitor_event_count',
+        'Monitor event count'
+    )
+    event_disk_space = LabeledGaugeMetricFamily(
+        'zm_monitor_event_disk_space_bytes',
+        'Monitor event disk space'
+    )
+    archived_event_count = LabeledGaugeMetricFamily(
+        'zm_monitor_archived_event_count',
+        'Monitor archived event count'
+    )
+    archived_event_disk_space = LabeledGaugeMetricFamily(
+        'zm_monitor_archived_event_disk_space_bytes',
+        'Monitor archived event disk space'
+    )
+    enabled = LabeledGaugeMetricFamily(
+        'zm_monitor_enabled',
+        'Monitor is enabled'
+    )
+    function = LabeledStateSetMetricFamily(
+        'zm_monitor_function',
+        'Monitor function'
+    )
+    capturing = LabeledStateSetMetricFamily(
+        'zm_monitor_capturing',
+        'Monitor capturing mode'
+    )
+    analysing = LabeledStateSetMetricFamily(
+        'zm_monitor_analysing',
+        'Monitor analysing mode'
+    )
+    recording = LabeledStateSetMetricFamily(
+        'zm_monitor_recording',
+        'Monitor recording mode'
+    )
+    decoding = LabeledStateSetMetricFamily(
+        'zm_monitor_decoding',
+        'Monitor decoding mode'
+    )
+    janus_enabled = LabeledGaugeMetricFamily(
+        'zm_monitor_janus_enabled',
+        'Monitor Janus streaming enabled'
+    )
+    go2rtc_enabled = LabeledGaugeMetricFamily(
+        'zm_monitor_go2rtc_enabled',
+        'Monitor Go2RTC streaming enabled'
+    )
+    rtsp2web_enabled = LabeledGaugeMetricFamily(
+        'zm_monitor_rtsp2web_enabled',
+        'Monitor RTSP2Web streaming enabled'
+    )
+    mqtt_enabled = LabeledGaugeMetricFamily(
+        'zm_monitor_mqtt_enabled',
+        'Monitor MQTT enabled'
+    )
+    onvif_event_listener = LabeledGaugeMetricFamily(
+        'zm_monitor_onvif_event_listener',
+        'Monitor ONVIF event listener enabled'
+    )
+    int_fields: List[str] = [
+        'DecodingEnabled', 'Width', 'Height', 'Colours', 'Palette',
+        'SaveJPEGs', 'VideoWriter', 'OutputCodec', 'Brightness', 'Contrast',
+        'Hue', 'Colour', 'ImageBufferCount', 'MaxImageBufferCount',
+        'WarmupCount', 'PreEventCount', 'PostEventCount', 'AlarmFrameCount',
+        'RefBlendPerc', 'AlarmRefBlendPerc', 'TrackMotion', 'ZoneCount',
+    ]
+    int_metrics: Dict[str, LabeledGaugeMetricFamily] = {
+        x: LabeledGaugeMetricFamily(
+            f'zm_monitor_{camel_to_snake(x)}',
+            f'ZM Monitor {x}'
+        ) for x in int_fields
+    }
+    status_rows: List[MonitorStatusRow] = []
+    if consume:
+        entries.reverse()
+    else:
+        entries = entries[::-1]
+    while entries:
+        entry: Dict[str, Any] = entries.pop()
+        mon: Dict[str, Any] = entry['Monitor']
+        labels: Dict[str, str] = (
+            labels_for(int(mon['Id']), mon['Name']) if labels_for
+            else {'id': str(mon['Id']), 'name': mon['Name']}
+        )
+        info_vals: dict = {
+            camel_to_snake(x): str(mon[x]) for x in [
+                'ServerId', 'StorageId', 'Type', 'DecodingEnabled',
+                'Device', 'Channel', 'Format', 'Method', 'Encoder',
+                'RecordAudio', 'EventPrefix', 'Controllable', 'ControlId',
+                'Importance'
+            ]
+        } | {
+            camel_to_snake(x): str(mon.get(x, ''))
+            for x in [
+                'Capturing', 'Analysing', 'Recording',
+                'Decoding', 'OutputCodecName'
+            ]
+        } | labels
+        info.add_metric(labels=list(info_vals.keys()), value=info_vals)
+        # In ZM 1.38+, Enabled is always 0 and Capturing replaces it.
+        # Use Capturing != 'None' as the enabled indicator when available.
+        if mon.get('Capturing') is not None:
+            enabled.add_metric(
+                labels=labels,
+                value=0 if mon['Capturing'] == 'None' else 1
+            )
+        else:
+            enabled.add_metric(
+                labels=labels, value=int(mon['Enabled'])
+            )
+        function.add_metric(
+            value={
+                x: mon['Function'] == x
+                for x in [
+                    'None', 'Monitor', 'Modect', 'Record', 'Mocord',
+                    'Nodect'
+                ]
+            },
+            labels=labels
+        )
+        cap_val = mon.get('Capturing', 'Unknown')
+        capturing.add_metric(
+            value={
+                x: cap_val == x
+                for x in ['None', 'Ondemand', 'Always']
+            },
+            labels=labels
+        )
+        ana_val = mon.get('Analysing', 'Unknown')
+        analysing.add_metric(
+            value={
+                x: ana_val == x
+                for x in ['None', 'Always']
+            },
+            labels=labels
+        )
+        rec_val = mon.get('Recording', 'Unknown')
+        recording.add_metric(
+            value={
+                x: rec_val == x
+                for x in ['None', 'OnMotion', 'Always']
+            },
+            labels=labels
+        )
+        dec_val = mon.get('Decoding', 'Unknown')
+        decoding.add_metric(
+            value={
+                x: dec_val == x
+                for x in [
+                    'None', 'Ondemand', 'KeyFrames',
+                    'KeyFrames+Ondemand', 'Always'
+                ]
+            },
+            labels=labels
+        )
+        janus_enabled.add_metric(
+            labels=labels,
+            value=int(mon.get('JanusEnabled', '0'))
+        )
+        go2rtc_enabled.add_metric(
+            labels=labels,
+            value=int(mon.get('Go2RTCEnabled', '0'))
+        )
+        rtsp2web_enabled.add_metric(
+            labels=labels,
+            value=int(mon.get('RTSP2WebEnabled', '0'))
+        )
+        mqtt_enabled.add_metric(
+            labels=labels,
+            value=int(mon.get('MQTT_Enabled', '0'))
+        )
+        onvif_event_listener.add_metric(
+            labels=labels,
+            value=int(mon.get('ONVIF_Event_Listener', '0'))
+        )
+        for x in int_fields:
+            int_metrics[x].add_metric(
+                labels=labels,
+                value=0 if mon[x] is None else int(mon[x])
+            )
+        # Monitor_Status (and its fields) can be None when a monitor's
+        # capture daemon isn't running, e.g. a monitor that was just
+        # deleted but still appears in the API for one scrape.
+        mon_status: dict = entry.get('Monitor_Status') or {}
+        status_rows.append((
+            labels, mon_status.get('Status') or 'Unknown',
+            float(mon_status.get('CaptureFPS') or 0),
+            float(mon_status.get('AnalysisFPS') or 0),
+            float(mon_status.get('CaptureBandwidth') or 0),
+        ))
+        event_count.add_metric(
+            labels=labels,
+            value=0 if entry['Event_Summary']['TotalEvents'] is None
+            else entry['Event_Summary']['TotalEvents']
+        )
+        event_disk_space.add_metric(
+            labels=labels,
+            value=0 if entry['Event_Summary']['TotalEventDiskSpace'] is None
+            else entry['Event_Summary']['TotalEventDiskSpace']
+        )
+        archived_event_count.add_metric(
+            labels=labels,
+            value=0 if not entry['Event_Summary']['ArchivedEvents']
+            else entry['Event_Summary']['ArchivedEvents']
+        )
+        archived_event_disk_space.add_metric(
+            labels=labels,
+            value=0 if not entry['Event_Summary']['ArchivedEventDiskSpace']
+            else entry['Event_Summary']['ArchivedEventDiskSpace']
+        )
+    return [
+        info, event_count, enabled, function,
+        capturing, analysing, recording, decoding,
+        janus_enabled, go2rtc_enabled, rtsp2web_enabled,
+        mqtt_enabled, onvif_event_listener,
+        *build_monitor_status_metrics(status_rows), event_disk_space,
+        archived_event_count, archived_event_disk_space,
+        *int_metrics.values()
+    ]
+
+
+def _monitor_shard_worker(
+    entries: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Worker-process entry point: :func:`build_monitor_metrics` for one
+    shard, serialized with :func:`metrics_to_json`."""
+    return metrics_to_json(build_monitor_metrics(entries, consume=True))
+
+
+def merge_metric_families(
+    shards: Iterable[List[Dict[str, Any]]]
+) -> List[Metric]:
+    """Rebuild and merge per-shard :func:`metrics_to_json` results into one
+    family per metric name (first-seen order), concatenating samples."""
+    merged: Dict[str, Metric] = {}
+    for shard in shards:
+        for m in metrics_from_json(shard):
+            if m.name in merged:
+                merged[m.name].samples.extend(m.samples)
+            else:
+                merged[m.name] = m
+    return list(merged.values())
+
+
+def build_shm_metrics(
+    monitors: List[Tuple[int, str]],
+    shm_dir: str = '/dev/shm',
+    labels_for: Optional[Callable[[int, str], Dict[str, str]]] = None,
+) -> List[Metric]:
+    """``zm_monitor_mmap_*`` families read from each ``(id, name)``
+    monitor's shared-memory file in ``shm_dir``; like
+    :func:`build_monitor_metrics`, runnable in a worker process."""
+    from pyzm.ZMMemory import ZMMemory
+    int_fields: List[str] = [
+        'action', 'audio_channels', 'audio_frequency', 'imagesize',
+        'last_event', 'last_frame_score', 'last_read_index',
+        'last_write_index', 'state'
+    ]
+    bool_fields: List[str] = ['active', 'format', 'signal']
+    ts_fields: List[str] = [
+        'heartbeat_time', 'last_read_time', 'last_write_time',
+        'startup_time'
+    ]
+    metrics: Dict[str, LabeledGaugeMetricFamily] = {}
+    for i in int_fields + bool_fields:
+        metrics[i] = LabeledGaugeMetricFamily(
+            f'zm_monitor_mmap_{i}',
+            f'ZM Monitor MMAP field {i}'
+        )
+    for i in ts_fields:
+        metrics[i] = LabeledGaugeMetricFamily(
+            f'zm_monitor_mmap_{i}_age_seconds',
+            f'Seconds since value of ZM Monitor MMAP field {i}'
+        )
+    logger.debug('Handling monitor mmaps...')
+    mid: int
+    mname: str
+    for mid, mname in monitors:
+        shm_path: str = f'{shm_dir}/zm.mmap.{mid}'
+        if not os.path.exists(shm_path):
+            logger.warning(
+                'mmap file for Monitor %s at %s does not exist; skipping.',
+                mid, shm_path
+            )
+            continue
+        logger.debug('Reading shared memory for monitor %s', mid)
+        now: int = int(time.time())
+        labels: Dict[str, str] = (
+            labels_for(mid, mname) if labels_for
+            else {'id': str(mid), 'name': mname}
+        )
+        try:
+            mem: 'ZMMemory' = ZMMemory(path=shm_dir, mid=mid)
+            data: dict = mem.get_shared_data()
+            mem.close()
+        except Exception as ex:
+            logger.error(
+                'Error reading shared memory for monitor %s: %s',
+                mid, ex, exc_info=True
+            )
+            continue
+        for i in int_fields:
+            metrics[i].add_metric(
+                labels=labels,
+                value=data[i]
+            )
+        for i in bool_fields:
+            metrics[i].add_metric(
+                labels=labels,
+                value=1 if data[i] else 0
+            )
+        for i in ts_fields:
+            metrics[i].add_metric(
+                labels=labels,
+                value=now - data[i]
+            )
+    return list(metrics.values())
+
+
+def _shm_shard_worker(
+    monitors: List[Tuple[int, str]], shm_dir: str = '/dev/shm'
+) -> List[Dict[str, Any]]:
+    """Worker-process entry point: :func:`build_shm_metrics` for one shard.
+    """
+    return metrics_to_json(build_shm_metrics(monitors, shm_dir))
+
+
+# Numeric prefix of ZM's SharedData struct, in the layout pyzm.ZMMemory reads
+# (its trailing string fields are not needed here).
+SHM_SHARED_DATA: struct.Struct = struct.Struct('@IiiIddQIiiiiii????IIIIqqqq')
+
+
+def build_storage_metrics(
+    areas: List[Dict[str, Any]],
+    monitor_storage: Dict[int, int],
+    recent_disk_bytes: Dict[int, int],
+    span_seconds: Optional[int],
+) -> List[Metric]:
+    """``zm_storage_*`` families, one series per storage area.
+
+    ``areas`` are ZM Storage rows (``Id``, ``Name``, ``DiskSpace``) plus the
+    area's filesystem ``total``/``free`` bytes when known (else ``None``).
+    Each area's write rate is the disk space of the events its monitors
+    (``monitor_storage``: monitor id -> StorageId) finished during the
+    ``span_seconds`` that ``recent_disk_bytes`` covers, per second;
+    time-to-full projects the free space at that rate. Neither is exported
+    when ``span_seconds`` is None (no event aggregation to take them
+    from). Monitors with StorageId 0 use ZM's default storage, i.e. the
+    area named ``Default``.
+    """
+    default_id: Optional[int] = next(
+        (int(a['Id']) for a in areas if a.get('Name') == 'Default'), None
+    )
+    written: Dict[int, int] = {}
+    assigned: Dict[int, int] = {}
+    for mid, sid in monitor_storage.items():
+        if sid == 0 and default_id is not None:
+            sid = default_id
+        assigned[sid] = assigned.get(sid, 0) + 1
+        written[sid] = written.get(sid, 0) + recent_disk_bytes.get(mid, 0)
+    events_bytes = LabeledGaugeMetricFamily(
+        'zm_storage_event_disk_space_bytes',
+        'Disk space ZM accounts to events in this storage area'
+    )
+    total = LabeledGaugeMetricFamily(
+        'zm_storage_size_bytes',
+        'Size of the filesystem holding this storage area'
+    )
+    free = LabeledGaugeMetricFamily(
+        'zm_storage_free_bytes',
+        'Free space on the filesystem holding this storage area'
+    )
+    monitors = LabeledGaugeMetricFamily(
+        'zm_storage_monitors',
+        'Monitors recording to this storage area'
+    )
+    rate = LabeledGaugeMetricFamily(
+        'zm_storage_write_rate_bytes_per_second',
+        f'Disk space of events that ended on this storage area over the '
+        f'{span_seconds}s event window less its grace period, per second'
+    )
+    to_full = LabeledGaugeMetricFamily(
+        'zm_storage_time_to_full_seconds',
+        'Seconds until this storage area is full at the current write rate '
+        '(ignores purging by ZM filters; absent while nothing is written)'
+    )
+    for area in sorted(areas, key=lambda a: int(a['Id'])):
+        sid: int = int(area['Id'])
+        labels: Dict[str, str] = {
+            'storage_id': str(sid), 'name': str(area.get('Name') or '')
+        }
+        events_bytes.add_metric(
+            labels=labels, value=_event_int_value(area.get('DiskSpace'))
+        )
+        monitors.add_metric(labels=labels, value=assigned.get(sid, 0))
+        bytes_per_second: float = 0.0
+        if span_seconds is not None:
+            bytes_per_second = written.get(sid, 0) / span_seconds
+            rate.add_metric(labels=labels, value=bytes_per_second)
+        if area.get('total') is not None:
+            total.add_metric(labels=labels, value=area['total'])
+        if area.get('free') is not None:
+            free.add_metric(labels=labels, value=area['free'])
+            if bytes_per_second > 0:
+                to_full.add_metric(
+                    labels=labels, value=area['free'] / bytes_per_second
+                )
+    return [events_bytes, total, free, monitors, rate, to_full]
+
+
+class ShmReader:
+    """Persistent read-only mapping of one monitor's shared-memory file.
+
+    Unlike ``pyzm.ZMMemory``, which is opened per scrape and builds
+    namedtuples on every read, this keeps the mapping open and unpacks the
+    numeric fields with a precompiled struct, so it is cheap enough to poll
+    every second. The file is re-mapped when zmc recreates it (new inode).
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._map: Optional[mmap.mmap] = None
+        self._inode: Optional[int] = None
+
+    def read(self) -> Optional[Tuple[int, bool, int, int]]:
+        """``(last_write_index, active, heartbeat_time, last_write_time)``,
+        or None if the file is missing or too short."""
+        data: Optional[tuple] = self._unpack()
+        if data is None:
+            return None
+        return data[1], data[15], data[23], data[24]
+
+    def read_status(
+        self
+    ) -> Optional[Tuple[bool, float, float, int, int, bool]]:
+        """``(valid, capture_fps, analysis_fps, heartbeat_time,
+        startup_time, signal)``, the live counterparts of ZM's
+        ``Monitor_Status`` row and zmc's uptime, or None if the file is
+        missing or too short."""
+        data: Optional[tuple] = self._unpack()
+        if data is None:
+            return None
+        return data[14], data[4], data[5], data[23], data[22], data[16]
+
+    def _unpack(self) -> Optional[tuple]:
+        try:
+            inode: int = os.stat(self.path).st_ino
+            if self._map is None or inode != self._inode:
+                self.close()
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+                self._inode = inode
+        except (OSError, ValueError):
+            # missing, or empty (mmap of a zero-length file)
+            self.close()
+            return None
+        if len(self._map) < SHM_SHARED_DATA.size:
+            return None
+        return SHM_SHARED_DATA.unpack_from(self._map)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._inode = None
+
+
+class ShmWatchdog:
+    """Continuously polls monitors' shared memory to catch capture stalls,
+    including ones that start and recover between two scrapes.
+
+    A monitor is stalled while its ``last_write_index`` has not advanced,
+    or its zmc heartbeat is older than, ``stall_seconds``. A stall is taken
+    to have started when the index last advanced (or at the heartbeat time,
+    whichever is earlier), and ends when both are fresh again; each ended
+    stall's duration goes into a per-monitor histogram. Monitors that are
+    not ``active`` or have no shared-memory file are not judged.
+    """
+
+    def __init__(
+        self,
+        monitors: Callable[[], Dict[int, str]],
+        stall_seconds: float = 10.0,
+        buckets: Tuple[float, ...] = (5, 15, 30, 60, 300, 900, 3600),
+        shm_dir: str = '/dev/shm',
+    ):
+        self._monitors = monitors
+        self.stall_seconds: float = stall_seconds
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._shm_dir: str = shm_dir
+        self._readers: Dict[int, ShmReader] = {}
+        self._state: Dict[int, Dict[str, Any]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def _blank_state(self) -> Dict[str, Any]:
+        return {
+            'index': None, 'index_changed': 0.0, 'stalled_since': None,
+            'stalls': 0, 'bucket_counts': [0] * len(self.buckets),
+            'duration_count': 0, 'duration_sum': 0.0,
+            'last_start': None, 'last_end': None,
+        }
+
+    def check(self, now: Optional[float] = None) -> None:
+        """Poll every monitor once and update stall state."""
+        now = time.time() if now is None else now
+        monitors: Dict[int, str] = dict(self._monitors())
+        for mid in set(self._readers) - set(monitors):
+            self._readers.pop(mid).close()
+        with self._lock:
+            for mid in set(self._state) - set(monitors):
+                del self._state[mid]
+            for mid in monitors:
+                reader: Optional[ShmReader] = self._readers.get(mid)
+                if reader is None:
+                    reader = self._readers[mid] = ShmReader(
+                        f'{self._shm_dir}/zm.mmap.{mid}'
+                    )
+                data = reader.read()
+                state: Optional[Dict[str, Any]] = self._state.get(mid)
+                if data is None or not data[1]:
+                    if state is not None:
+                        self._end_stall(state, now)
+                        state['index'] = None
+                    continue
+                if state is None:
+                    state = self._state[mid] = self._blank_state()
+                index, _, heartbeat, _ = data
+                if index != state['index']:
+                    state['index'] = index
+                    state['index_changed'] = now
+                since: List[float] = []
+                if now - state['index_changed'] >= self.stall_seconds:
+                    since.append(state['index_changed'])
+                if now - heartbeat >= self.stall_seconds:
+                    since.append(heartbeat)
+                if not since:
+                    self._end_stall(state, now)
+                elif state['stalled_since'] is None:
+                    state['stalled_since'] = state['last_start'] = min(since)
+                    state['stalls'] += 1
+                    logger.warning(
+                        'Monitor %s shared memory stalled since %s', mid,
+                        datetime.fromtimestamp(min(since)).isoformat()
+                    )
+
+    def _end_stall(self, state: Dict[str, Any], now: float) -> None:
+        if state['stalled_since'] is None:
+            return
+        duration: float = now - state['stalled_since']
+        state['stalled_since'] = None
+        state['last_end'] = now
+        state['duration_count'] += 1
+        state['duration_sum'] += duration
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                state['bucket_counts'][i] += 1
+
+    def run(self, stop: threading.Event, interval: float) -> None:
+        while not stop.wait(interval):
+            try:
+                self.check()
+            except Exception as ex:
+                logger.error('Error in shm watchdog: %s', ex, exc_info=True)
+
+    def collect(
+        self,
+        labels_for: Callable[[int, str], Dict[str, str]],
+    ) -> List[Metric]:
+        stalled = LabeledGaugeMetricFamily(
+            'zm_monitor_shm_stalled',
+            '1 while the watchdog considers the monitor\'s capture stalled'
+        )
+        stalls = CounterMetricFamily(
+            'zm_monitor_shm_stalls',
+            'Capture stalls detected by the shared-memory watchdog',
+            labels=['id', 'name']
+        )
+        durations = HistogramMetricFamily(
+            'zm_monitor_shm_stall_duration_seconds',
+            'Durations of ended capture stalls',
+            labels=['id', 'name']
+        )
+        last_start = LabeledGaugeMetricFamily(
+            'zm_monitor_shm_last_stall_start_timestamp_seconds',
+            'When the most recent capture stall started'
+        )
+        last_end = LabeledGaugeMetricFamily(
+            'zm_monitor_shm_last_stall_end_timestamp_seconds',
+            'When the most recent ended capture stall ended'
+        )
+        names: Dict[int, str] = dict(self._monitors())
+        with self._lock:
+            for mid, state in sorted(self._state.items()):
+                if mid not in names:
+                    continue
+                labels: Dict[str, str] = labels_for(mid, names[mid])
+                values: List[str] = [labels['id'], labels['name']]
+                stalled.add_metric(
+                    labels=labels,
+                    value=0 if state['stalled_since'] is None else 1
+                )
+                stalls.add_metric(values, state['stalls'])
+                durations.add_metric(
+                    values,
+                    [(floatToGoString(b), c) for b, c in zip(
+                        self.buckets, state['bucket_counts']
+                    )] + [('+Inf', state['duration_count'])],
+                    state['duration_sum']
+                )
+                if state['last_start'] is not None:
+                    last_start.add_metric(
+                        labels=labels, value=state['last_start']
+                    )
+                if state['last_end'] is not None:
+                    last_end.add_metric(labels=labels, value=state['last_end'])
+        return [stalled, stalls, durations, last_start, last_end]
+
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class DeltaPusher:
+    """Pushes small groups of fast-changing series to a Prometheus
+    Pushgateway, only when they change.
+
+    ``sample()`` returns ``{group: metric families}`` (a group is one
+    monitor); a value of ``None`` means "could not sample this time, leave
+    it alone". Every :meth:`push_once` compares each group with what was
+    last *pushed* for it and PUTs the whole group (so replaced label sets
+    disappear) when a series appeared or vanished or a value moved by more
+    than ``min_change``, or when ``resend_seconds`` passed since its last
+    push. Groups no longer sampled are deleted from the gateway. A failed
+    push keeps the group pending and doubles the delay before the next
+    round, up to ``max_backoff`` seconds.
+    """
+
+    def __init__(
+        self,
+        gateway: str,
+        sample: Callable[[], Dict[str, Optional[List[Metric]]]],
+        job: str = 'zm_exporter',
+        interval: float = 5.0,
+        min_change: float = 1.0,
+        resend_seconds: float = 300.0,
+        max_backoff: float = 60.0,
+        timeout: float = 5.0,
+    ):
+        self.gateway: str = gateway
+        self.job: str = job
+        self.interval: float = interval
+        self.delay: float = interval
+        self._sample = sample
+        self._min_change: float = min_change
+        self._resend_seconds: float = resend_seconds
+        self._max_backoff: float = max_backoff
+        self._timeout: float = timeout
+        # group -> (series pushed, time pushed)
+        self._pushed: Dict[str, Tuple[Dict[SeriesKey, float], float]] = {}
+        self.requests: Dict[str, int] = {'success': 0, 'failure': 0}
+        self.series_pushed: int = 0
+
+    @staticmethod
+    def _series(families: List[Metric]) -> Dict[SeriesKey, float]:
+        return {
+            (s.name, tuple(sorted(s.labels.items()))): s.value
+            for m in families for s in m.samples
+        }
+
+    def _changed(
+        self, group: str, series: Dict[SeriesKey, float], now: float
+    ) -> bool:
+        if group not in self._pushed:
+            return True
+        pushed, pushed_at = self._pushed[group]
+        if (
+            now - pushed_at >= self._resend_seconds
+            or pushed.keys() != series.keys()
+        ):
+            return True
+        return any(
+            abs(value - pushed[key]) > self._min_change
+            for key, value in series.items()
+        )
+
+    def _send(self, group: str, families: Optional[List[Metric]]) -> bool:
+        """PUT (or, with no ``families``, DELETE) one group; True on success.
+        """
+        try:
+            if families is None:
+                delete_from_gateway(
+                    self.gateway, job=self.job,
+                    grouping_key={'monitor': group}, timeout=self._timeout
+                )
+            else:
+                push_to_gateway(
+                    self.gateway, job=self.job,
+                    registry=_StaticCollector(families),
+                    grouping_key={'monitor': group}, timeout=self._timeout
+                )
+        except Exception as ex:
+            logger.warning(
+                'Error pushing group %s to %s: %s', group, self.gateway, ex
+            )
+            self.requests['failure'] += 1
+            return False
+        self.requests['success'] += 1
+        return True
+
+    def push_once(self, now: Optional[float] = None) -> bool:
+        """Sample, diff and push one round; returns False if any request
+        failed (and sets :attr:`delay` accordingly)."""
+        now = time.time() if now is None else now
+        ok: bool = True
+        groups: Dict[str, Optional[List[Metric]]] = self._sample()
+        for group, families in groups.items():
+            if families is None:
+                continue
+            series: Dict[SeriesKey, float] = self._series(families)
+            if not self._changed(group, series, now):
+                continue
+            if self._send(group, families):
+                self._pushed[group] = (series, now)
+                self.series_pushed += len(series)
+            else:
+                ok = False
+        for group in [g for g in self._pushed if g not in groups]:
+            if self._send(group, None):
+                del self._pushed[group]
+            else:
+                ok = False
+        self.delay = (
+            self.interval if ok else min(self.delay * 2, self._max_backoff)
+        )
+        return ok
+
+    def run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.delay):
+            try:
+                self.push_once()
+            except Exception as ex:
+                logger.error('Error in push round: %s', ex, exc_info=True)
+                self.delay = min(self.delay * 2, self._max_backoff)
+
+
+class _StaticCollector:
+    """Minimal registry stand-in serving fixed metric families, for
+    :func:`push_to_gateway`."""
+
+    def __init__(self, families: List[Metric]):
+        self._families = families
+
+    def collect(self) -> List[Metric]:
+        return self._families
+
+
+class ZmExporter:
+
+    STATUS_RE: re.Pattern = re.compile(
+        r"^'(?P<command>[^']+)' running since (?P<year>\d{1,2})/"
+        r"(?P<month>\d{1,2})/(?P<day>\d{1,2}) (?P<hour>\d{1,2}):"
+        r"(?P<minute>\d{1,2}):(?P<second>\d{1,2}), pid = (?P<pid>\d+).*"
+    )
+
+    #: collection stages, run in this order by ``_do_<stage>`` methods
+    STAGES: Tuple[str, ...] = (
+        'monitors', 'events', 'event_rollups', 'storage', 'states',
+        'monitor_shm', 'shm_watchdog', 'zmes_websocket', 'daemon_check',
+    )
+
+    #: settings :meth:`_apply_settings` can change while running
+    RELOADABLE: FrozenSet[str] = frozenset([
+        'ZM_EVENT_WINDOW_SECONDS', 'ZM_EVENT_GRACE_SECONDS',
+        'ZM_EVENT_QUERY_LIMIT', 'ZM_EVENT_PAGE_SIZE', 'ZM_EVENT_QUERY_TZ',
+        'TZ', 'ZM_EVENT_AGGREGATION', 'ZM_DISABLED_STAGES',
+        'ZM_STATE_DEFINITION_LABEL', 'ZM_ZMC_COMMAND_LABEL',
+        'ZM_INFO_LABELS', 'ZM_INFO_ON_CHANGE', 'ZM_INFO_RESEND_SECONDS',
+        'ZM_STORAGE_REFRESH_SECONDS', 'ZM_SNAPSHOT_INTERVAL_SECONDS',
+        'ZM_ADAPTIVE_INTERVALS', 'ZM_ADAPTIVE_MAX_INTERVAL_SECONDS',
+        'ZM_API_SLOW_SECONDS', 'ZM_API_ERROR_RATIO',
+        'ZM_COLLECTOR_PROCESSES', 'ZM_SHM_STALL_SECONDS',
+        'ZM_PUSH_INTERVAL_SECONDS', 'ZM_MONITOR_LIST_REFRESH_SECONDS',
+    ])
+
+    def _env_or_err(self, name: str) -> str:
+        s: str = os.environ.get(name)
+        if not s:
+            raise RuntimeError(
+                f'ERROR: You must set the "{name}" environment variable.'
+            )
+        return s
+
+    def __init__(self):
+        logger.debug('Instantiating ZmExporter')
+        self._api_url: str = self._env_or_err('ZM_API_URL')
+        # ZM_CONFIG_FILE: a JSON object of these same settings (e.g.
+        # {"ZM_EVENT_WINDOW_SECONDS": 1800}) overriding the environment. It
+        # is re-read whenever it changes and the RELOADABLE settings are
+        # applied live (see _reload_config); others need a restart.
+        self._config_path: Optional[str] = os.environ.get('ZM_CONFIG_FILE')
+        self._config: Dict[str, str] = {}
+        self._config_stamp: Optional[Tuple[int, int]] = None
+        self._config_reloads: Dict[str, int] = {'success': 0, 'failure': 0}
+        if self._config_path:
+            try:
+                self._config_stamp, self._config = self._read_config()
+            except (OSError, ValueError) as ex:
+                raise RuntimeError(
+                    f'ERROR: cannot load ZM_CONFIG_FILE '
+                    f'{self._config_path}: {ex}'
+                )
+            logger.info('Loaded settings from %s', self._config_path)
+        env: Dict[str, str] = dict(os.environ) | self._config
+        
+        # Build options dict and add optional authentication credentials if provided
+        api_options: Dict[str, Any] = {'apiurl': self._api_url}
+        zm_user: Optional[str] = env.get('ZM_USER')
+        zm_password: Optional[str] = env.get('ZM_PASSWORD')
+        
+        if zm_user and zm_password:
+            logger.debug('Using ZoneMinder authentication')
+            api_options['user'] = zm_user
+            api_options['password'] = zm_password
+        elif zm_user or zm_password:
+            logger.warning(
+                'Both ZM_USER and ZM_PASSWORD must be provided for authentication. '
+                'Only one was provided; proceeding without authentication.'
+            )
+        
+        # Warm restart: with ZM_SNAPSHOT_PATH set, the latest collection and
+        # a little incremental state are written to that file every
+        # ZM_SNAPSHOT_INTERVAL_SECONDS. On startup a snapshot younger than
+        # ZM_SNAPSHOT_MAX_AGE_SECONDS is served immediately (marked stale by
+        # zm_exporter_snapshot_stale) while the first live collection runs in
+        # the background, instead of making the first scrape do a full cold
+        # collection.
+        self._snapshot_path: Optional[str] = env.get('ZM_SNAPSHOT_PATH')
+        self._snapshot_max_age: int = int(
+            env.get('ZM_SNAPSHOT_MAX_AGE_SECONDS', '3600')
+        )
+        self._snapshot_written: float = 0.0
+        self._stale_metrics: Optional[List[Metric]] = None
+        self._stale_time: float = 0.0
+        self._refreshed_metrics: Optional[List[Metric]] = None
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refresh_lock: threading.Lock = threading.Lock()
+        state: Dict[str, Any] = (
+            self._load_snapshot() if self._snapshot_path else {}
+        )
+        # (token, expiry timestamp) of the refresh token logged in with
+        self._saved_refresh_token: Optional[Tuple[str, float]] = None
+        if (
+            zm_user and zm_password and state.get('refresh_token')
+            and state.get('refresh_token_expires', 0) > time.time() + 300
+        ):
+            # pyzm logs in with this token, falling back to user/password
+            # if ZM rejects it
+            logger.debug('Logging in with refresh token from snapshot')
+            api_options['token'] = state['refresh_token']
+            self._saved_refresh_token = (
+                state['refresh_token'], state['refresh_token_expires']
+            )
+        self._api_options: Dict[str, Any] = api_options
+        # set by the background _connect thread once logged in to ZM
+        self._api: Optional['ZMApi'] = None
+        self._connected: threading.Event = threading.Event()
+        self.query_time: float = 0.0
+        self._decode_seconds: Dict[str, float] = {}
+        self._response_bytes: Dict[str, int] = {}
+        # function name -> [calls, seconds] for the current collection
+        self._timings: Dict[str, List[float]] = {}
+        # monitor id -> shared {'id', 'name'} label dict, see _monitor_labels
+        self._label_cache: Dict[int, Dict[str, str]] = {}
+        # ZM_TRACEMALLOC_ENABLED traces Python allocations to report the peak
+        # allocated during each collection; tracing slows allocation-heavy
+        # code noticeably, so it is meant for sizing runs, not left on.
+        if _env_bool('ZM_TRACEMALLOC_ENABLED', False, env):
+            tracemalloc.start()
+        self._collection_peak_bytes: Optional[int] = None
+        GC_PAUSES.install()
+        # ZM_TRACING=otlp|file records each collection, its stages and ZM
+        # API requests as OpenTelemetry spans, to an OTLP collector or to
+        # ZM_TRACING_FILE; the SDK is only imported when enabled.
+        tracing: str = env.get('ZM_TRACING', 'off')
+        if tracing not in ('off', 'otlp', 'file'):
+            raise RuntimeError(
+                f'ERROR: ZM_TRACING must be "off", "otlp" or "file", not '
+                f'"{tracing}".'
+            )
+        self._tracing: Tracing = Tracing()
+        if tracing != 'off':
+            try:
+                self._tracing = setup_tracing(
+                    tracing,
+                    env.get('ZM_TRACING_FILE', 'zm-exporter-traces.jsonl')
+                )
+            except ImportError as ex:
+                raise RuntimeError(
+                    f'ERROR: ZM_TRACING={tracing} requires the OpenTelemetry '
+                    f'SDK (pip install opentelemetry-sdk '
+                    f'opentelemetry-exporter-otlp-proto-http): {ex}'
+                )
+        # ZM_PROFILING_ENABLED exposes /-/profile, which runs a collection
+        # under a profiler on demand (and so is not safe to leave open to
+        # untrusted clients).
+        self.profiling_enabled: bool = _env_bool('ZM_PROFILING_ENABLED', False, env)
+        self._monitor_id_to_name: Dict[int, str] = {
+            int(k): v for k, v in state.get('monitor_id_to_name', {}).items()
+        }
+        # state kept across reloads; set before the first _apply_settings
+        self._event_settings: Optional[Tuple[Any, ...]] = None
+        self._event_histograms: Optional[EventHistograms] = None
+        self._shm_watchdog: Optional[ShmWatchdog] = None
+        self._pusher: Optional[DeltaPusher] = None
+        self._throttles: Dict[str, AdaptiveInterval] = {}
+        self._stage_cache: Dict[str, List[Metric]] = {}
+        self._info_sent: Optional[
+            Dict[Tuple[str, str], Tuple[Any, float]]
+        ] = None
+        self._processes: int = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # last full monitor listing (see _do_monitors): when it was fetched,
+        # its families, and each monitor's Monitor_Status row
+        self._monitor_list_refresh_seconds: float = 0.0
+        self._listing_fetched: float = 0.0
+        self._listing_families: List[Metric] = []
+        self._listing_status: Dict[int, MonitorStatusRow] = {}
+        self._status_readers: Dict[int, ShmReader] = {}
+        self._apply_settings(env)
+        # Per-monitor duration/size/frames histograms are observed in the
+        # same aggregation pass; each event is counted once (ids are kept
+        # for an hour past the query window) with ZM_EVENT_*_BUCKETS bounds.
+        # Opt-in, as they add about 32 series per monitor.
+        self._recent_disk_bytes: Dict[int, int] = {}
+        if _env_bool('ZM_EVENT_HISTOGRAMS', False, env):
+            self._event_histograms = EventHistograms(
+                {
+                    kind: tuple(
+                        float(x) for x in env.get(name, default)
+                        .split(',')
+                    )
+                    for kind, name, default in (
+                        ('duration', 'ZM_EVENT_DURATION_BUCKETS',
+                         '5,10,30,60,120,300,600,1800,3600'),
+                        ('size', 'ZM_EVENT_SIZE_BUCKETS',
+                         '1e5,1e6,1e7,5e7,1e8,5e8,1e9'),
+                        ('frames', 'ZM_EVENT_FRAMES_BUCKETS',
+                         '10,50,100,250,500,1000,5000'),
+                    )
+                },
+                horizon_seconds=self._event_window_seconds + 15 * 60 + 3600,
+            )
+        # ZM_ROLLUP_DB_PATH enables the on-disk hourly/daily event rollups
+        # behind the zm_monitor_rollup_* (1h/24h/7d) metrics; keep the file
+        # on a persistent volume so history survives restarts.
+        self._rollup_store: Optional[EventRollupStore] = None
+        rollup_path: Optional[str] = env.get('ZM_ROLLUP_DB_PATH')
+        if rollup_path:
+            retention_days: int = int(
+                env.get('ZM_ROLLUP_RETENTION_DAYS', '8')
+            )
+            logger.info('Persisting event rollups to %s', rollup_path)
+            self._rollup_store = EventRollupStore(
+                rollup_path,
+                retention_seconds=retention_days * EventRollupStore.DAY,
+                # ids only need remembering while the events query (window
+                # plus 15m pad) can still return them
+                dedupe_seconds=max(
+                    2 * EventRollupStore.DAY,
+                    2 * (self._event_window_seconds + 15 * 60)
+                ),
+            )
+        # ZM_SHM_ENABLED=false skips the /dev/shm monitor stage (and never
+        # imports its reader), e.g. when not running on the ZM host.
+        # ZM_SHM_DIR is where the zm.mmap.<id> files live (e.g. a simulated
+        # tree for load tests).
+        self._shm_enabled: bool = _env_bool('ZM_SHM_ENABLED', True, env)
+        self._shm_dir: str = env.get('ZM_SHM_DIR', '/dev/shm')
+        # The shm watchdog polls every ZM_SHM_WATCHDOG_INTERVAL_SECONDS
+        # (0 disables it) to catch stalls shorter than the scrape interval.
+        watchdog_interval: float = float(
+            env.get('ZM_SHM_WATCHDOG_INTERVAL_SECONDS', '1')
+        )
+        if self._shm_enabled and watchdog_interval > 0:
+            self._shm_watchdog = ShmWatchdog(
+                lambda: self._monitor_id_to_name,
+                shm_dir=self._shm_dir,
+                stall_seconds=float(
+                    env.get('ZM_SHM_STALL_SECONDS', '10')
+                ),
+                buckets=tuple(
+                    float(x) for x in env.get(
+                        'ZM_SHM_STALL_BUCKETS', '5,15,30,60,300,900,3600'
+                    ).split(',')
+                ),
+            )
+            threading.Thread(
+                target=self._shm_watchdog.run,
+                args=(threading.Event(), watchdog_interval),
+                name='zm-shm-watchdog', daemon=True
+            ).start()
+        self._storage_areas: List[Dict[str, Any]] = []
+        self._storage_fetched: float = 0.0
+        self._monitor_storage: Dict[int, int] = {}
+        # Connect to ZM in the background, retrying with backoff, so a slow
+        # or down ZM never holds up the HTTP listener or readiness probes.
+        self._connect_max_delay: int = int(
+            env.get('ZM_CONNECT_RETRY_MAX_SECONDS', '60')
+        )
+        # [requests, errors, seconds] made via _get_json this collection
+        self._api_calls: List[float] = [0, 0, 0.0]
+        # held while checking or renewing the ZM login, which the scrape
+        # and push threads share
+        self._auth_lock: threading.Lock = threading.Lock()
+        self._daemon_status_cache: Dict[int, dict] = {}
+        # ZM_PUSHGATEWAY_URL enables push mode: connected/FPS/heartbeat
+        # series for the (few, critical) ZM_PUSH_MONITOR_IDS are sampled
+        # every ZM_PUSH_INTERVAL_SECONDS and pushed when they change, for
+        # freshness well below the scrape interval. Each costs one API
+        # request per round, so the ids must be listed.
+        self._push_monitor_ids: List[int] = [
+            int(x) for x in
+            env.get('ZM_PUSH_MONITOR_IDS', '').split(',') if x.strip()
+        ]
+        # collections (scrapes, the warm-start refresh, /-/profile) run one
+        # at a time, as they share the per-collection state below
+        self._collect_lock: threading.Lock = threading.Lock()
+        # the push thread's ZM API requests use their own session and are
+        # counted apart from the collections' API stats
+        self._push_session: Any = None
+        self._push_lock: threading.Lock = threading.Lock()
+        self._push_api_calls: Dict[str, int] = {'success': 0, 'failure': 0}
+        self._push_readers: Dict[int, ShmReader] = {}
+        if env.get('ZM_PUSHGATEWAY_URL'):
+            if not self._push_monitor_ids:
+                raise RuntimeError(
+                    'ERROR: ZM_PUSHGATEWAY_URL requires ZM_PUSH_MONITOR_IDS, '
+                    'the monitors to push.'
+                )
+            self._pusher = DeltaPusher(
+                env['ZM_PUSHGATEWAY_URL'], self._sample_push_series,
+                job=env.get('ZM_PUSH_JOB', 'zm_exporter'),
+                interval=float(
+                    env.get('ZM_PUSH_INTERVAL_SECONDS', '5')
+                ),
+                min_change=float(env.get('ZM_PUSH_MIN_CHANGE', '1')),
+                resend_seconds=float(
+                    env.get('ZM_PUSH_RESEND_SECONDS', '300')
+                ),
+            )
+            threading.Thread(
+                target=self._run_pusher, name='zm-push', daemon=True
+            ).start()
+        threading.Thread(
+            target=self._connect, name='zm-connect', daemon=True
+        ).start()
+
+    def _apply_settings(self, env: Mapping[str, str]) -> None:
+        """Apply the :attr:`RELOADABLE` settings from ``env`` (the
+        environment overlaid with ``ZM_CONFIG_FILE``), at startup and on
+        every config file change. Everything is validated before anything
+        is changed, so an invalid value raises ``ValueError`` and leaves the
+        running settings alone. State still valid under the new settings --
+        the ZM session, label and daemon status caches, event histograms and
+        rollups -- is kept; the cached events stage is dropped when the
+        event query changes.
+        """
+        # Recording-persistence event metrics: aggregate over events that ended
+        # in the last ZM_EVENT_WINDOW_SECONDS (default 15m), ignoring the most
+        # recent ZM_EVENT_GRACE_SECONDS (default 2m) so events whose DiskSpace
+        # ZM has not finished computing yet do not read as zero-size failures.
+        # ZM_EVENT_QUERY_LIMIT bounds how many events a single scrape fetches;
+        # keep it comfortably above the busiest window so results are not
+        # truncated (pyzm sorts newest-first and stops at the limit).
+        window: int = int(env.get('ZM_EVENT_WINDOW_SECONDS', '900'))
+        grace: int = int(env.get('ZM_EVENT_GRACE_SECONDS', '120'))
+        limit: int = int(env.get('ZM_EVENT_QUERY_LIMIT', '500'))
+        # Events are aggregated page by page as they arrive, so at most one
+        # decoded page is held at a time; ZM_EVENT_PAGE_SIZE (default: the
+        # query limit, i.e. a single request) bounds that on large sites.
+        page_size: int = min(limit, int(env.get('ZM_EVENT_PAGE_SIZE', limit)))
+        # ZM_EVENT_AGGREGATION=columnar switches to the bulk/columnar event
+        # aggregation, which pays off once the window holds ~10^5 events
+        # (e.g. hours-wide windows for capacity reports).
+        aggregation: str = env.get('ZM_EVENT_AGGREGATION', 'standard')
+        if aggregation not in ('standard', 'columnar'):
+            raise ValueError(
+                f'ZM_EVENT_AGGREGATION must be "standard" or "columnar", '
+                f'not "{aggregation}"'
+            )
+        # ZoneMinder's events API filters by StartTime in the ZM SERVER's local
+        # timezone (while returning EndDateTime in UTC -- yes, inconsistent). We
+        # compute the events query's `from` bound in an explicit timezone so it
+        # is correct regardless of THIS process's timezone -- the exporter
+        # container often runs as UTC even when ZM does not, which would push
+        # the bound into the future and return zero events. Source the tz from
+        # ZM_EVENT_QUERY_TZ, then TZ; if neither resolves, query_tz stays None
+        # and the bound is computed in this process's naive local time
+        # (correct only when this process's tz already matches the ZM
+        # server's).
+        query_tz: Optional['ZoneInfo'] = None
+        tz_name: Optional[str] = (
+            env.get('ZM_EVENT_QUERY_TZ') or env.get('TZ')
+        )
+        if tz_name:
+            from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+            try:
+                query_tz = ZoneInfo(tz_name)
+            except (ZoneInfoNotFoundError, ValueError) as ex:
+                logger.warning(
+                    'Could not resolve timezone %r for event queries (%s); '
+                    'falling back to process-local time. Ensure the tzdata '
+                    'package is installed or set a valid ZM_EVENT_QUERY_TZ.',
+                    tz_name, ex
+                )
+        # ZM_DISABLED_STAGES: comma-separated STAGES to skip entirely.
+        disabled: FrozenSet[str] = frozenset(
+            x.strip() for x in env.get('ZM_DISABLED_STAGES', '').split(',')
+            if x.strip()
+        )
+        if disabled - set(self.STAGES):
+            raise ValueError(
+                f'unknown ZM_DISABLED_STAGES '
+                f'{", ".join(sorted(disabled - set(self.STAGES)))}; '
+                f'stages are {", ".join(self.STAGES)}'
+            )
+        # Cardinality controls. ZM_STATE_DEFINITION_LABEL and
+        # ZM_ZMC_COMMAND_LABEL keep (full), hash or drop the zm_state
+        # definition and zmc command labels; ZM_INFO_LABELS limits the
+        # zm_monitor info labels; ZM_INFO_ON_CHANGE sends each monitor's
+        # info sample only when its labels change (and every
+        # ZM_INFO_RESEND_SECONDS).
+        label_modes: Dict[str, str] = {}
+        for key, name in (
+            ('definition', 'ZM_STATE_DEFINITION_LABEL'),
+            ('command', 'ZM_ZMC_COMMAND_LABEL'),
+        ):
+            label_modes[key] = env.get(name, 'full')
+            if label_modes[key] not in LABEL_MODES:
+                raise ValueError(
+                    f'{name} must be one of {", ".join(LABEL_MODES)}, '
+                    f'not "{label_modes[key]}"'
+                )
+        info_labels: Optional[str] = env.get('ZM_INFO_LABELS')
+        info_on_change: bool = _env_bool('ZM_INFO_ON_CHANGE', False, env)
+        info_resend: float = float(env.get('ZM_INFO_RESEND_SECONDS', '3600'))
+        # ZM_STORAGE_REFRESH_SECONDS: how often the storage areas (and the
+        # size of the filesystems under them) are re-read for the
+        # zm_storage_* metrics; write rates are recomputed every collection
+        # from the event aggregation. 0 disables the stage.
+        storage_refresh: float = float(
+            env.get('ZM_STORAGE_REFRESH_SECONDS', '300')
+        )
+        snapshot_interval: int = int(
+            env.get('ZM_SNAPSHOT_INTERVAL_SECONDS', '60')
+        )
+        # Adaptive intervals: while ZM's API is slow (mean request latency
+        # over ZM_API_SLOW_SECONDS) or failing (error ratio over
+        # ZM_API_ERROR_RATIO) during a collection, the expensive stages --
+        # the events query and the per-monitor daemonStatus calls -- are
+        # refreshed less often (cached results are served in between), up to
+        # ZM_ADAPTIVE_MAX_INTERVAL_SECONDS, and every collection again once
+        # ZM recovers.
+        adaptive: bool = _env_bool('ZM_ADAPTIVE_INTERVALS', True, env)
+        max_interval: float = float(
+            env.get('ZM_ADAPTIVE_MAX_INTERVAL_SECONDS', '600')
+        )
+        api_slow: float = float(env.get('ZM_API_SLOW_SECONDS', '2'))
+        api_error_ratio: float = float(env.get('ZM_API_ERROR_RATIO', '0.1'))
+        # ZM_COLLECTOR_PROCESSES > 1 shards the monitor payload and
+        # shared-memory stages by monitor id across that many worker
+        # processes (started on first use), for installs with ~1000 monitors
+        # where building their samples is CPU-bound under the GIL.
+        processes: int = int(env.get('ZM_COLLECTOR_PROCESSES', '0'))
+        stall_seconds: float = float(env.get('ZM_SHM_STALL_SECONDS', '10'))
+        # ZM_MONITOR_LIST_REFRESH_SECONDS > 0 fetches the full monitor
+        # listing (and the daemonStatus calls) only that often; collections
+        # in between refresh just the Monitor_Status series from shared
+        # memory, so it needs the exporter on the ZM host.
+        list_refresh: float = float(
+            env.get('ZM_MONITOR_LIST_REFRESH_SECONDS', '0')
+        )
+        if list_refresh > 0 and not _env_bool('ZM_SHM_ENABLED', True, env):
+            raise ValueError(
+                'ZM_MONITOR_LIST_REFRESH_SECONDS needs ZM_SHM_ENABLED, since '
+                'monitor status is read from shared memory between listings'
+            )
+        push_interval: float = float(
+            env.get('ZM_PUSH_INTERVAL_SECONDS', '5')
+        )
+
+        event_settings: Tuple[Any, ...] = (
+            window, grace, limit, page_size, aggregation, tz_name
+        )
+        if self._event_settings not in (None, event_settings):
+            # cached event families describe the old query
+            self._stage_cache.pop('events', None)
+            if 'events' in self._throttles:
+                self._throttles['events'].last_run = None
+        self._event_settings = event_settings
+        self._event_window_seconds: int = window
+        self._event_grace_seconds: int = grace
+        self._event_query_limit: int = limit
+        self._event_page_size: int = page_size
+        self._aggregate_events = (
+            aggregate_events_columnar if aggregation == 'columnar'
+            else aggregate_events
+        )
+        self._event_query_tz: Optional['ZoneInfo'] = query_tz
+        if self._event_histograms is not None:
+            self._event_histograms.horizon_seconds = window + 15 * 60 + 3600
+        self._disabled_stages: FrozenSet[str] = disabled
+        self._label_modes: Dict[str, str] = label_modes
+        self._info_labels: Optional[FrozenSet[str]] = (
+            None if info_labels is None
+            else frozenset(x.strip() for x in info_labels.split(','))
+        )
+        if not info_on_change:
+            self._info_sent = None
+        elif self._info_sent is None:
+            self._info_sent = {}
+        self._info_resend_seconds: float = info_resend
+        self._storage_refresh_seconds: float = storage_refresh
+        self._snapshot_interval: int = snapshot_interval
+        if not adaptive:
+            self._throttles = {}
+            self._stage_cache.clear()
+        elif not self._throttles:
+            self._throttles = {
+                stage: AdaptiveInterval(max_interval)
+                for stage in ('events', 'daemon_status')
+            }
+        for throttle in self._throttles.values():
+            throttle.max_interval = max_interval
+            throttle.interval = min(throttle.interval, max_interval)
+        self._api_slow_seconds: float = api_slow
+        self._api_error_ratio: float = api_error_ratio
+        if processes != self._processes and self._pool is not None:
+            # the next sharded stage starts a pool of the new size
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._processes = processes
+        self._shm_stall_seconds: float = stall_seconds
+        if list_refresh != self._monitor_list_refresh_seconds:
+            # fetch a listing on the next collection
+            self._listing_fetched = 0.0
+        self._monitor_list_refresh_seconds = list_refresh
+        if self._shm_watchdog is not None:
+            self._shm_watchdog.stall_seconds = stall_seconds
+        if self._pusher is not None:
+            self._pusher.interval = push_interval
+
+    def _read_config(self) -> Tuple[Tuple[int, int], Dict[str, str]]:
+        """``((mtime_ns, size), settings)`` of ``ZM_CONFIG_FILE``, whose
+        values may be JSON strings, numbers or booleans."""
+        st: os.stat_result = os.stat(self._config_path)
+        with open(self._config_path) as fh:
+            data: Any = json.load(fh)
+        if not isinstance(data, dict):
+            raise ValueError('expected a JSON object of settings')
+        return (st.st_mtime_ns, st.st_size), {
+            str(k): (
+                str(v).lower() if isinstance(v, bool) else str(v)
+            ) for k, v in data.items() if v is not None
+        }
+
+    def _reload_config(self) -> None:
+        """Apply ``ZM_CONFIG_FILE`` if it changed since last read. Runs at
+        the start of each collection, so settings change between
+        collections, never during one. An unreadable or invalid file is
+        logged and ignored until it changes again."""
+        try:
+            st: os.stat_result = os.stat(self._config_path)
+        except OSError as ex:
+            logger.debug('Cannot stat %s: %s', self._config_path, ex)
+            return
+        if (st.st_mtime_ns, st.st_size) == self._config_stamp:
+            return
+        self._config_stamp = (st.st_mtime_ns, st.st_size)
+        try:
+            self._config_stamp, config = self._read_config()
+            self._apply_settings(dict(os.environ) | config)
+        except (OSError, ValueError) as ex:
+            logger.error(
+                'Not applying %s; keeping current settings: %s',
+                self._config_path, ex
+            )
+            self._config_reloads['failure'] += 1
+            return
+        changed: List[str] = sorted(
+            k for k in set(config) | set(self._config)
+            if config.get(k) != self._config.get(k)
+        )
+        self._config = config
+        self._config_reloads['success'] += 1
+        logger.info(
+            'Applied %s; changed: %s', self._config_path,
+            ', '.join(changed) or 'nothing'
+        )
+        restart: List[str] = [k for k in changed if k not in self.RELOADABLE]
+        if restart:
+            logger.warning(
+                'Restart the exporter to apply %s', ', '.join(restart)
+            )
+
+    @property
+    def ready(self) -> bool:
+        """Whether we are logged in to ZM (for the readiness endpoint)."""
+        return self._connected.is_set()
+
+    def _connect(self) -> None:
+        """Log in to the ZM API, retrying with exponential backoff until it
+        succeeds."""
+        from pyzm.api import ZMApi
+        delay: float = 1.0
+        while True:
+            logger.info('Connecting to ZM API at: %s', self._api_url)
+            try:
+                self._api = ZMApi(options=self._api_options)
+                break
+            except Exception as ex:
+                logger.error(
+                    'Error connecting to ZM API at %s (retrying in %ds): %s',
+                    self._api_url, delay, ex
+                )
+                time.sleep(delay)
+                delay = min(delay * 2, self._connect_max_delay)
+        if (
+            self._saved_refresh_token
+            and self._api.refresh_token_datetime is None
+        ):
+            # logging in with a refresh token only returns a new access
+            # token; without its own, pyzm would never refresh, and crash
+            # logging in again on a 401
+            token, expires = self._saved_refresh_token
+            self._api.refresh_token = token
+            self._api.refresh_token_datetime = datetime.fromtimestamp(expires)
+            self._api.refresh_token_expires = int(expires - time.time())
+        logger.debug('Connected to ZM')
+        mark_startup('zm_connected')
+        self._connected.set()
+
+    def _run_pusher(self) -> None:
+        import requests
+        self._connected.wait()
+        self._push_session = requests.Session()
+        self._push_session.auth = self._api.session.auth
+        self._push_session.verify = self._api.session.verify
+        logger.info(
+            'Pushing fast monitor series to %s every %ss',
+            self._pusher.gateway, self._pusher.interval
+        )
+        self._pusher.run(threading.Event())
+
+    def _sample_push_series(self) -> Dict[str, Optional[List[Metric]]]:
+        """Connected/FPS (from each monitor's own API view, not the full
+        listing) and shared-memory heartbeat ages for the push monitors,
+        grouped by monitor id; ``None`` for a monitor that could not be
+        read this round."""
+        groups: Dict[str, Optional[List[Metric]]] = {}
+        for mid in self._push_monitor_ids:
+            try:
+                view: dict = self._request_json(
+                    self._push_session, self._record_push_call,
+                    'push_monitor', f'{self._api.api_url}/monitors/{mid}.json',
+                    monitor_id=mid
+                )[0]['monitor']
+            except Exception as ex:
+                logger.warning('Error reading monitor %s: %s', mid, ex)
+                groups[str(mid)] = None
+                continue
+            if view['Monitor'].get('Deleted'):
+                continue
+            labels: Dict[str, str] = self._monitor_labels(
+                mid, view['Monitor']['Name']
+            )
+            mon_status: dict = view.get('Monitor_Status') or {}
+            status_str: str = mon_status.get('Status') or 'Unknown'
+            families: List[Metric] = [
+                LabeledGaugeMetricFamily(
+                    'zm_monitor_connected', 'Monitor is connected or not',
+                    labels=labels | {'status': status_str},
+                    value=1 if status_str == 'Connected' else 0
+                ),
+                LabeledGaugeMetricFamily(
+                    'zm_monitor_capture_fps', 'Monitor capture FPS',
+                    labels=labels,
+                    value=float(mon_status.get('CaptureFPS') or 0)
+                ),
+                LabeledGaugeMetricFamily(
+                    'zm_monitor_analysis_fps', 'Monitor analysis FPS',
+                    labels=labels,
+                    value=float(mon_status.get('AnalysisFPS') or 0)
+                ),
+            ]
+            if self._shm_enabled:
+                # persistent mapping, kept for the push thread's own use
+                reader: Optional[ShmReader] = self._push_readers.get(mid)
+                if reader is None:
+                    reader = self._push_readers[mid] = ShmReader(
+                        f'{self._shm_dir}/zm.mmap.{mid}'
+                    )
+                shm: Optional[Tuple[int, bool, int, int]] = reader.read()
+                if shm is not None:
+                    now: int = int(time.time())
+                    for field, value in (
+                        ('heartbeat_time', shm[2]),
+                        ('last_write_time', shm[3]),
+                    ):
+                        families.append(LabeledGaugeMetricFamily(
+                            f'zm_monitor_mmap_{field}_age_seconds',
+                            f'Seconds since value of ZM Monitor MMAP field '
+                            f'{field}',
+                            labels=labels, value=now - value
+                        ))
+            groups[str(mid)] = families
+        return groups
+
+    def _do_push_stats(self) -> Generator[Metric, None, None]:
+        if self._pusher is None:
+            return
+        requests = CounterMetricFamily(
+            'zm_exporter_push_requests',
+            'Pushgateway requests made in push mode, by result',
+            labels=['result']
+        )
+        for result, count in sorted(self._pusher.requests.items()):
+            requests.add_metric([result], count)
+        yield requests
+        zm_requests = CounterMetricFamily(
+            'zm_exporter_push_zm_api_requests',
+            'ZM API requests made in push mode, by result (not included in '
+            'the per-collection API stats)',
+            labels=['result']
+        )
+        with self._push_lock:
+            for result, count in sorted(self._push_api_calls.items()):
+                zm_requests.add_metric([result], count)
+        yield zm_requests
+        yield CounterMetricFamily(
+            'zm_exporter_push_series',
+            'Series sent to the Pushgateway in push mode',
+            value=self._pusher.series_pushed
+        )
+        yield GaugeMetricFamily(
+            'zm_exporter_push_interval_seconds',
+            'Current delay between push rounds (grows on failures)',
+            value=self._pusher.delay
+        )
+
+    def describe(self) -> List[Metric]:
+        # Without this, registering the collector runs a full collect() just
+        # to learn metric names.
+        return []
+
+    @_timed
+    def _get_json(
+        self, endpoint: str, url: str, query: Optional[Dict[str, Any]] = None,
+        monitor_id: Optional[int] = None
+    ) -> Any:
+        """GET a ZM API URL for the current collection (see
+        :meth:`_request_json`), recording the decode time and body size per
+        ``endpoint`` and the request in the collection's API stats."""
+        data, size, decode = self._request_json(
+            self._api.session, self._record_api_call, endpoint, url, query,
+            monitor_id=monitor_id
+        )
+        self._decode_seconds[endpoint] = self._decode_seconds.get(
+            endpoint, 0.0
+        ) + decode
+        self._response_bytes[endpoint] = self._response_bytes.get(
+            endpoint, 0
+        ) + size
+        return data
+
+    def _request_json(
+        self, session: Any, record: Callable[[float, bool], None],
+        endpoint: str, url: str, query: Optional[Dict[str, Any]] = None,
+        reauth: bool = True, monitor_id: Optional[int] = None
+    ) -> Tuple[Any, int, float]:
+        """GET a ZM API URL with ``session`` and decode the JSON body
+        ourselves; ``(data, body size, decode seconds)``.
+
+        Equivalent to pyzm's ``ZMApi._make_request`` for GETs (token/legacy
+        auth and relogin-once on 401), but decodes with the fastest
+        available JSON backend (see :func:`_json_loads`). Each request's
+        time and whether it failed go to ``record``; a span (with
+        ``monitor_id``) is recorded when tracing. Token refreshes are
+        serialized, since the push thread makes requests too.
+        """
+        attributes: Dict[str, Any] = {
+            'zm.endpoint': endpoint, 'url.path': urlsplit(url).path
+        }
+        if monitor_id is not None:
+            attributes['zm.monitor_id'] = monitor_id
+        if query and 'page' in query:
+            attributes['zm.page'] = query['page']
+        with self._tracing.span(f'GET {endpoint}', **attributes) as span:
+            api: 'ZMApi' = self._api
+            with self._auth_lock:
+                api._refresh_tokens_if_needed()
+                token: str = api.access_token
+            params: Dict[str, Any] = dict(query or {})
+            request_url: str = url
+            if api.auth_enabled:
+                if (
+                    api._versiontuple(api.api_version)
+                    >= api._versiontuple('2.0')
+                ):
+                    params['token'] = token
+                else:
+                    qchar: str = (
+                        '?' if url.lower().endswith(('json', '/')) else '&'
+                    )
+                    request_url += qchar + api.legacy_credentials
+            logger.debug('GET %s params=%s', url, params)
+            start: float = time.perf_counter()
+            try:
+                resp = session.get(request_url, params=params)
+            except Exception:
+                record(time.perf_counter() - start, True)
+                raise
+            record(time.perf_counter() - start, resp.status_code >= 500)
+            if span is not None:
+                span.set_attribute(
+                    'http.response.status_code', resp.status_code
+                )
+                span.set_attribute(
+                    'http.response.body.size', len(resp.content)
+                )
+            if resp.status_code == 401 and reauth:
+                with self._auth_lock:
+                    # unless another thread already logged in again
+                    if api.access_token == token:
+                        logger.info('Got 401 from %s; logging in again', url)
+                        api._relogin()
+                return self._request_json(
+                    session, record, endpoint, url, query, reauth=False,
+                    monitor_id=monitor_id
+                )
+            resp.raise_for_status()
+            start = time.perf_counter()
+            data: Any = _json_loads(resp.content)
+            decode: float = time.perf_counter() - start
+            if span is not None:
+                span.set_attribute('zm.decode_seconds', decode)
+            return data, len(resp.content), decode
+
+    def _record_api_call(self, seconds: float, error: bool) -> None:
+        self._api_calls[0] += 1
+        self._api_calls[1] += 1 if error else 0
+        self._api_calls[2] += seconds
+
+    def _record_push_call(self, seconds: float, error: bool) -> None:
+        with self._push_lock:
+            self._push_api_calls['failure' if error else 'success'] += 1
+
+    def _adjust_intervals(
+        self, throttles: Dict[str, AdaptiveInterval]
+    ) -> None:
+        """Lengthen or shorten the adaptive stage intervals based on the ZM
+        API latency and error ratio seen during this collection."""
+        requests, errors, seconds = self._api_calls
+        if not requests or not throttles:
+            return
+        latency: float = seconds / requests
+        error_ratio: float = errors / requests
+        overloaded: bool = (
+            latency > self._api_slow_seconds
+            or error_ratio > self._api_error_ratio
+        )
+        healthy: bool = latency < self._api_slow_seconds / 2 and not errors
+        for stage, throttle in throttles.items():
+            before: float = throttle.interval
+            throttle.adjust(overloaded, healthy)
+            if throttle.interval != before:
+                logger.warning(
+                    'ZM API mean latency %.2fs, error ratio %.2f; %s refresh '
+                    'interval now %ss', latency, error_ratio, stage,
+                    throttle.interval
+                )
+
+    def _stage_due(
+        self, stage: str, now: float, throttles: Dict[str, AdaptiveInterval]
+    ) -> bool:
+        """Whether an adaptive stage should be refreshed in this collection
+        (always, when adaptive intervals are off)."""
+        throttle: Optional[AdaptiveInterval] = throttles.get(stage)
+        if throttle is None or throttle.due(now):
+            if throttle is not None:
+                throttle.last_run = now
+            return True
+        return False
+
+    def _do_adaptive_stats(self) -> Generator[Metric, None, None]:
+        requests, errors, seconds = self._api_calls
+        yield GaugeMetricFamily(
+            'zm_exporter_api_requests',
+            'ZM API requests made during the last collection',
+            value=requests
+        )
+        if requests:
+            yield GaugeMetricFamily(
+                'zm_exporter_api_mean_latency_seconds',
+                'Mean ZM API request latency during the last collection',
+                value=seconds / requests
+            )
+            yield GaugeMetricFamily(
+                'zm_exporter_api_error_ratio',
+                'Fraction of ZM API requests that failed (connection errors '
+                'and 5xx) during the last collection',
+                value=errors / requests
+            )
+        if self._throttles:
+            interval = LabeledGaugeMetricFamily(
+                'zm_exporter_stage_interval_seconds',
+                'Current refresh interval of each adaptive collection stage '
+                '(0 = every collection)'
+            )
+            for stage, throttle in sorted(self._throttles.items()):
+                interval.add_metric(
+                    labels={'stage': stage}, value=throttle.interval
+                )
+            yield interval
+
+    def _do_series_stats(
+        self, series: Dict[str, int]
+    ) -> Generator[Metric, None, None]:
+        metric = LabeledGaugeMetricFamily(
+            'zm_exporter_series',
+            'Samples exported per ZM metric family by the last collection '
+            '(each sample is a series in Prometheus)'
+        )
+        for name, count in sorted(series.items()):
+            metric.add_metric(labels={'family': name}, value=count)
+        yield metric
+
+    def _do_api_stats(self) -> Generator[Metric, None, None]:
+        decode = LabeledGaugeMetricFamily(
+            'zm_api_json_decode_seconds',
+            'Time spent decoding JSON responses per ZM API endpoint during '
+            'the last collection',
+            labels={'backend': JSON_BACKEND}
+        )
+        size = LabeledGaugeMetricFamily(
+            'zm_api_response_size_bytes',
+            'Total ZM API response body size per endpoint during the last '
+            'collection'
+        )
+        for endpoint in sorted(self._decode_seconds):
+            decode.add_metric(
+                labels={'endpoint': endpoint},
+                value=self._decode_seconds[endpoint]
+            )
+            size.add_metric(
+                labels={'endpoint': endpoint},
+                value=self._response_bytes[endpoint]
+            )
+        yield from [decode, size]
+
+    def _load_snapshot(self) -> Dict[str, Any]:
+        """Load the snapshot file, if any; keep its metrics to serve as stale
+        until a live collection completes and return its saved state."""
+        try:
+            with open(self._snapshot_path) as fh:
+                snap: Dict[str, Any] = json.load(fh)
+        except FileNotFoundError:
+            logger.info('No snapshot at %s; starting cold', self._snapshot_path)
+            return {}
+        except (OSError, ValueError) as ex:
+            logger.warning(
+                'Ignoring unreadable snapshot %s: %s', self._snapshot_path, ex
+            )
+            return {}
+        age: float = time.time() - snap.get('written', 0)
+        if age > self._snapshot_max_age:
+            logger.info(
+                'Snapshot %s is %ds old; not serving it', self._snapshot_path,
+                age
+            )
+        else:
+            logger.info(
+                'Serving %ds old snapshot from %s until the first live '
+                'collection completes', age, self._snapshot_path
+            )
+            self._stale_metrics = metrics_from_json(snap.get('metrics', []))
+            self._stale_time = snap['written']
+        return snap.get('state', {})
+
+    def _write_snapshot(self, metrics: List[Metric]) -> None:
+        """Atomically write ``metrics`` and incremental state to the snapshot
+        file. It may hold a ZM refresh token, so it is created mode 0600."""
+        state: Dict[str, Any] = {
+            'monitor_id_to_name': self._monitor_id_to_name,
+        }
+        if self._api.auth_enabled and self._api.refresh_token_datetime:
+            state['refresh_token'] = self._api.refresh_token
+            state['refresh_token_expires'] = (
+                self._api.refresh_token_datetime.timestamp()
+            )
+        now: float = time.time()
+        tmp: str = self._snapshot_path + '.tmp'
+        try:
+            fd: int = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({
+                    'written': now,
+                    'state': state,
+                    'metrics': metrics_to_json(metrics),
+                }, fh)
+            os.replace(tmp, self._snapshot_path)
+        except OSError as ex:
+            logger.error(
+                'Error writing snapshot to %s: %s', self._snapshot_path, ex,
+                exc_info=True
+            )
+            return
+        self._snapshot_written = now
+        logger.debug('Wrote snapshot to %s', self._snapshot_path)
+
+    def _background_refresh(self) -> None:
+        """First live collection after a warm start; its result replaces the
+        stale snapshot and is served to the next scrape."""
+        self._connected.wait()
+        try:
+            metrics: List[Metric] = list(self._collect_live())
+        except Exception as ex:
+            logger.error(
+                'Error in background collection; still serving stale '
+                'snapshot: %s', ex, exc_info=True
+            )
+            return
+        self._write_snapshot(metrics)
+        with self._refresh_lock:
+            self._refreshed_metrics = metrics
+            self._stale_metrics = None
+
+    def _do_exporter_status(self) -> Generator[Metric, None, None]:
+        yield GaugeMetricFamily(
+            'zm_exporter_zm_connected',
+            '1 once the exporter has logged in to the ZM API, else 0',
+            value=1 if self._connected.is_set() else 0
+        )
+        startup = LabeledGaugeMetricFamily(
+            'zm_exporter_startup_seconds',
+            'Seconds from process start until each startup phase was reached'
+        )
+        for phase, seconds in STARTUP_PHASES.items():
+            startup.add_metric(labels={'phase': phase}, value=seconds)
+        yield startup
+        if self._config_path:
+            reloads = CounterMetricFamily(
+                'zm_exporter_config_reloads',
+                'Changes to ZM_CONFIG_FILE applied (success) or rejected '
+                '(failure)',
+                labels=['result']
+            )
+            for result, count in sorted(self._config_reloads.items()):
+                reloads.add_metric([result], count)
+            yield reloads
+        yield from self._do_push_stats()
+
+    def collect(self) -> Generator[Metric, None, None]:
+        yield from self._do_exporter_status()
+        if not self._snapshot_path:
+            if self._connected.is_set():
+                yield from self._collect_live()
+            return
+        with self._refresh_lock:
+            stale: Optional[List[Metric]] = self._stale_metrics
+            metrics: Optional[List[Metric]] = self._refreshed_metrics
+            self._refreshed_metrics = None
+            if stale is not None and not (
+                self._refresh_thread and self._refresh_thread.is_alive()
+            ):
+                self._refresh_thread = threading.Thread(
+                    target=self._background_refresh,
+                    name='zm-warm-refresh', daemon=True
+                )
+                self._refresh_thread.start()
+        if stale is not None:
+            yield from stale
+            yield GaugeMetricFamily(
+                'zm_exporter_snapshot_stale',
+                '1 if these metrics were served from the on-disk snapshot '
+                'while the first live collection runs, else 0',
+                value=1
+            )
+            yield GaugeMetricFamily(
+                'zm_exporter_snapshot_age_seconds',
+                'Age of the snapshot being served',
+                value=time.time() - self._stale_time
+            )
+            return
+        if metrics is None:
+            if not self._connected.is_set():
+                return
+            metrics = list(self._collect_live())
+            if time.time() - self._snapshot_written >= self._snapshot_interval:
+                self._write_snapshot(metrics)
+        yield from metrics
+        yield GaugeMetricFamily(
+            'zm_exporter_snapshot_stale',
+            '1 if these metrics were served from the on-disk snapshot '
+            'while the first live collection runs, else 0',
+            value=0
+        )
+
+    def _run_stage(
+        self, stage: str, meth: Callable[[], Iterable[Metric]], now: float,
+        series: Dict[str, int], throttles: Dict[str, AdaptiveInterval]
+    ) -> Generator[Metric, None, None]:
+        """Run ``meth`` (or serve its cached families) for one of
+        :attr:`STAGES` in its own span, counting samples per family into
+        ``series``; ``throttles`` are the adaptive stages' intervals."""
+        with self._tracing.span(
+            f'stage {stage}', **{'zm.stage': stage}
+        ) as span:
+            families: Iterable[Metric]
+            cached: bool = False
+            if stage not in throttles:
+                families = meth()
+            # adaptive stage: between refreshes, serve its cached families
+            elif self._stage_due(stage, now, throttles):
+                families = self._stage_cache[stage] = list(meth())
+            else:
+                logger.debug('Serving cached %s stage', stage)
+                families = self._stage_cache.get(stage, [])
+                cached = True
+            samples: int = 0
+            for family in families:
+                samples += len(family.samples)
+                series[family.name] = series.get(family.name, 0) + len(
+                    family.samples
+                )
+                yield family
+            if span is not None:
+                span.set_attribute('zm.cached', cached)
+                span.set_attribute('zm.samples', samples)
+
+    def _collect_live(
+        self, profiling: bool = False
+    ) -> Generator[Metric, None, None]:
+        """One live collection, waiting for any other to finish first.
+
+        A ``profiling`` collection (see :meth:`profile`) runs every stage
+        and leaves the state the next scrape depends on alone: adaptive
+        intervals and stage caches, ``ZM_INFO_ON_CHANGE`` send times, the
+        cached monitor listing and the GC pause maximum.
+        """
+        with self._collect_lock:
+            yield from self._collect_stages(profiling)
+
+    def _collect_stages(
+        self, profiling: bool
+    ) -> Generator[Metric, None, None]:
+        logger.debug('Beginning collection')
+        qstart = time.time()
+        self._decode_seconds = {}
+        self._response_bytes = {}
+        self._timings = {}
+        self._api_calls = [0, 0, 0.0]
+        series: Dict[str, int] = {}
+        if self._config_path:
+            self._reload_config()
+        throttles: Dict[str, AdaptiveInterval] = (
+            {} if profiling else self._throttles
+        )
+        info_sent: Optional[Dict[Tuple[str, str], Tuple[Any, float]]] = (
+            None if profiling else self._info_sent
+        )
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        try:
+            with self._tracing.span('collect') as span:
+                for stage in self.STAGES:
+                    if stage in self._disabled_stages:
+                        continue
+                    meth: Callable[[], Iterable[Metric]] = (
+                        functools.partial(
+                            self._do_monitors, throttles, info_sent,
+                            cache_listing=not profiling
+                        ) if stage == 'monitors'
+                        else getattr(self, f'_do_{stage}')
+                    )
+                    yield from self._run_stage(
+                        stage, meth, qstart, series, throttles
+                    )
+                if span is not None:
+                    span.set_attribute(
+                        'zm.api_requests', self._api_calls[0]
+                    )
+                    span.set_attribute('zm.samples', sum(series.values()))
+        finally:
+            # also when a stage failed: the errors are what should back off
+            # the adaptive stages
+            self._adjust_intervals(throttles)
+        if tracemalloc.is_tracing():
+            self._collection_peak_bytes = tracemalloc.get_traced_memory()[1]
+        yield from self._do_api_stats()
+        yield from self._do_timings()
+        yield from self._do_memory_stats(reset_gc_max=not profiling)
+        yield from self._do_adaptive_stats()
+        yield from self._do_series_stats(series)
+        self.query_time = time.time() - qstart
+        yield GaugeMetricFamily(
+            'zm_query_time_seconds',
+            'Time taken to collect data from ZM',
+            value=self.query_time
+        )
+        if not profiling:
+            mark_startup('first_collection')
+        logger.debug('Finished collection')
+
+    @_timed
+    def _do_daemon_check(self) -> Generator[Metric, None, None]:
+        dc_url: str = self._api.api_url + '/host/daemonCheck.json'
+        logger.debug('GET %s', dc_url)
+        dc_resp: dict = self._api._make_request(url=dc_url)
+        logger.debug(
+            '%s responded with: %s',dc_url, dc_resp
+        )
+        yield GaugeMetricFamily(
+            name='zm_daemon_check', documentation='ZM daemon check',
+            value=dc_resp['result']
+        )
+
+    def _build(
+        self, builder: Callable[..., List[Metric]], *args: Any, **kwargs: Any
+    ) -> List[Metric]:
+        """Call a metric-family builder, timing it like :func:`_timed`."""
+        start: float = time.perf_counter()
+        try:
+            return builder(*args, **kwargs)
+        finally:
+            self._record_timing(builder.__name__, time.perf_counter() - start)
+
+    def _record_timing(self, name: str, seconds: float) -> None:
+        calls_and_time: List[float] = self._timings.setdefault(name, [0, 0.0])
+        calls_and_time[0] += 1
+        calls_and_time[1] += seconds
+
+    def _do_timings(self) -> Generator[Metric, None, None]:
+        seconds = LabeledGaugeMetricFamily(
+            'zm_exporter_function_seconds',
+            'Wall time spent in each collection stage / helper during the '
+            'last collection'
+        )
+        calls = LabeledGaugeMetricFamily(
+            'zm_exporter_function_calls',
+            'Number of calls to each collection stage / helper during the '
+            'last collection'
+        )
+        for name, (count, total) in sorted(self._timings.items()):
+            seconds.add_metric(labels={'function': name}, value=total)
+            calls.add_metric(labels={'function': name}, value=count)
+        yield from [seconds, calls]
+
+    def _do_memory_stats(
+        self, reset_gc_max: bool = True
+    ) -> Generator[Metric, None, None]:
+        # current RSS is process_resident_memory_bytes from the default
+        # registry's process collector
+        peak_rss: Optional[int] = peak_rss_bytes()
+        if peak_rss is not None:
+            yield GaugeMetricFamily(
+                'zm_exporter_peak_rss_bytes',
+                'High-water resident set size of the exporter process',
+                value=peak_rss
+            )
+        if self._collection_peak_bytes is not None:
+            yield GaugeMetricFamily(
+                'zm_exporter_collection_peak_allocated_bytes',
+                'Peak Python memory allocated (tracemalloc) during the last '
+                'collection',
+                value=self._collection_peak_bytes
+            )
+        total = CounterMetricFamily(
+            'zm_exporter_gc_pause_seconds',
+            'Time spent paused in Python garbage collection',
+            labels=['generation']
+        )
+        longest = LabeledGaugeMetricFamily(
+            'zm_exporter_gc_max_pause_seconds',
+            'Longest Python garbage-collection pause since the previous '
+            'collection'
+        )
+        for gen in range(3):
+            total.add_metric([str(gen)], GC_PAUSES.total[gen])
+            longest.add_metric(
+                labels={'generation': str(gen)}, value=GC_PAUSES.max[gen]
+            )
+        if reset_gc_max:
+            GC_PAUSES.reset_max()
+        yield from [total, longest]
+
+    def profile(
+        self, fmt: str = 'text', interval: float = 0.005
+    ) -> Tuple[str, bytes]:
+        """Run one live collection under a profiler, for the
+        ``/-/profile`` endpoint; returns ``(content_type, body)``.
+
+        ``fmt`` is ``text`` (cProfile, sorted by cumulative time),
+        ``pstats`` (cProfile stats in :mod:`marshal` form, loadable with
+        :class:`pstats.Stats` or snakeviz) or ``collapsed`` (stacks sampled
+        every ``interval`` seconds, in the collapsed format flamegraph.pl and
+        speedscope read).
+
+        It waits for any running collection, and then runs every stage
+        live without disturbing the next scrape (see :meth:`_collect_live`).
+        """
+        if fmt == 'collapsed':
+            stacks: Dict[str, int] = sample_stacks(
+                lambda: list(self._collect_live(profiling=True)), interval
+            )
+            body: str = ''.join(
+                f'{stack} {count}\n' for stack, count in sorted(stacks.items())
+            )
+            return 'text/plain; charset=utf-8', body.encode()
+        import cProfile
+        import marshal
+        import pstats
+        import io
+        prof = cProfile.Profile()
+        prof.runcall(lambda: list(self._collect_live(profiling=True)))
+        if fmt == 'pstats':
+            prof.create_stats()
+            return 'application/octet-stream', marshal.dumps(prof.stats)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(80)
+        return 'text/plain; charset=utf-8', out.getvalue().encode()
 
-    def collect(self) -> Generator[Metric, None, None]:
-        logger.debug('Beginning collection')
-        qstart = time.time()
-        for meth in [
-            self._do_monitors,
-            self._do_events,
-            self._do_states,
-            self._do_monitor_shm,
-            self._do_zmes_websocket,
-        ]:
-            yield from meth()
-        dc_url: str = self._api.api_url + '/host/daemonCheck.json'
-        logger.debug('GET %s', dc_url)
-        dc_resp: dict = self._api._make_request(url=dc_url)
-        logger.debug(
-            '%s responded with: %s',dc_url, dc_resp
-        )
-        yield GaugeMetricFamily(
-            name='zm_daemon_check', documentation='ZM daemon check',
-            value=dc_resp['result']
-        )
-        self.query_time = time.time() - qstart
-        yield GaugeMetricFamily(
-            'zm_query_time_seconds',
-            'Time taken to collect data from ZM',
-            value=self.query_time
-        )
-        logger.debug('Finished collection')
-
     def _parse_zmdc_status(self, status: str) -> StatusType:
         m: Optional[re.Match]
         if not (m := self.STATUS_RE.match(status)):
@@ -375,15 +3412,110 @@ class ZmExporter:
         age: float = (now - dt).total_seconds()
         return m.group('command'), age, int(m.group('pid'))
 
-    def _do_monitors(self) -> Generator[Metric, None, None]:
+    @_timed
+    def _do_monitors(
+        self,
+        throttles: Dict[str, AdaptiveInterval],
+        info_sent: Optional[Dict[Tuple[str, str], Tuple[Any, float]]],
+        cache_listing: bool = True,
+    ) -> Generator[Metric, None, None]:
+        """Families from the full monitor listing and the per-monitor
+        daemonStatus calls (refreshed as the ``daemon_status`` throttle in
+        ``throttles`` allows); ``info_sent`` is the ``ZM_INFO_ON_CHANGE``
+        send state to update (see :func:`limit_info_samples`), if any.
+
+        With ``ZM_MONITOR_LIST_REFRESH_SECONDS`` set, those are fetched only
+        that often (and, with ``cache_listing``, kept); collections in
+        between serve the last listing's families with fresh Monitor_Status
+        series and zmc uptimes from shared memory (see
+        :meth:`_monitor_status_from_shm`).
+        """
+        now: float = time.time()
+        refresh: float = self._monitor_list_refresh_seconds
+        if refresh > 0 and now - self._listing_fetched < refresh:
+            rows, started = self._monitor_status_from_shm(now)
+            status: Dict[str, Metric] = {
+                family.name: family
+                for family in build_monitor_status_metrics(rows)
+            }
+            families: List[Metric] = [
+                refresh_zmc_metrics(
+                    family, started, self._listing_fetched, now
+                ) if family.name in ZMC_FAMILIES
+                else status.get(family.name, family)
+                for family in self._listing_families
+            ]
+        else:
+            families = self._fetch_monitor_listing(
+                now, throttles, cache_listing
+            )
+        for family in families:
+            if family.name == 'zm_monitor' and (
+                self._info_labels is not None or info_sent is not None
+            ):
+                # trimmed in a copy: the listing's family may be served again
+                family = copy.copy(family)
+                if info_sent is not None:
+                    for key in [
+                        k for k in info_sent
+                        if self._monitor_id_to_name.get(int(k[0])) != k[1]
+                    ]:
+                        del info_sent[key]
+                limit_info_samples(
+                    family, self._info_labels, info_sent, time.time(),
+                    self._info_resend_seconds
+                )
+            yield family
+        if refresh > 0:
+            yield GaugeMetricFamily(
+                'zm_exporter_monitor_listing_age_seconds',
+                'Seconds since the full monitor listing was fetched (status '
+                'and FPS series are refreshed from shared memory in between; '
+                'capture bandwidth is as listed)',
+                value=now - self._listing_fetched
+            )
+
+    def _monitor_status_from_shm(
+        self, now: float
+    ) -> Tuple[List[MonitorStatusRow], Dict[str, Optional[float]]]:
+        """Monitor_Status rows for the listed monitors, with FPS read from
+        each one's shared memory (through persistent :class:`ShmReader`
+        mappings) and NotRunning for monitors whose zmc is gone (see
+        :func:`shm_monitor_status`), and each monitor id's zmc start time,
+        or None if it is gone (see :func:`refresh_zmc_metrics`)."""
+        rows: List[MonitorStatusRow] = []
+        started: Dict[str, Optional[float]] = {}
+        with self._tracing.span(
+            'read_shm_status', **{'zm.monitors': len(self._listing_status)}
+        ):
+            for mid, listed in sorted(self._listing_status.items()):
+                reader: Optional[ShmReader] = self._status_readers.get(mid)
+                if reader is None:
+                    reader = self._status_readers[mid] = ShmReader(
+                        f'{self._shm_dir}/zm.mmap.{mid}'
+                    )
+                shm: Optional[
+                    Tuple[bool, float, float, int, int, bool]
+                ] = reader.read_status()
+                row: MonitorStatusRow = shm_monitor_status(
+                    listed, shm, now, self._shm_stall_seconds
+                )
+                rows.append(row)
+                started[str(mid)] = (
+                    None if row[1] == 'NotRunning' else shm[4]
+                )
+        return rows, started
+
+    def _fetch_monitor_listing(
+        self, now: float, throttles: Dict[str, AdaptiveInterval],
+        cache: bool = True
+    ) -> List[Metric]:
         logger.debug('Querying monitors')
-        monitors: List[Monitor] = self._api.monitors(
-            options={'force_reload': True}
-        ).list()
-        logger.debug('Monitors: %s', [x.get() for x in monitors])
-        info = InfoMetricFamily(
-            'zm_monitor', 'Information about a monitor',
-        )
+        monitors: List[Dict[str, Any]] = self._get_json(
+            'monitors', self._api.api_url + '/monitors.json'
+        ).get('monitors') or []
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Monitors: %s', [x['Monitor'] for x in monitors])
         zmc = LabeledGaugeMetricFamily(
             'zm_monitor_zmc_uptime_seconds',
             'Uptime of monitor zmc process in seconds'
@@ -395,129 +3527,67 @@ class ZmExporter:
         status = LabeledGaugeMetricFamily(
             'zm_monitor_status', 'Monitor status'
         )
-        event_count = LabeledGaugeMetricFamily(
-            'zm_monitor_event_count',
-            'Monitor event count'
-        )
-        event_disk_space = LabeledGaugeMetricFamily(
-            'zm_monitor_event_disk_space_bytes',
-            'Monitor event disk space'
-        )
-        archived_event_count = LabeledGaugeMetricFamily(
-            'zm_monitor_archived_event_count',
-            'Monitor archived event count'
-        )
-        archived_event_disk_space = LabeledGaugeMetricFamily(
-            'zm_monitor_archived_event_disk_space_bytes',
-            'Monitor archived event disk space'
-        )
-        enabled = LabeledGaugeMetricFamily(
-            'zm_monitor_enabled',
-            'Monitor is enabled'
-        )
-        function = LabeledStateSetMetricFamily(
-            'zm_monitor_function',
-            'Monitor function'
-        )
-        capturing = LabeledStateSetMetricFamily(
-            'zm_monitor_capturing',
-            'Monitor capturing mode'
-        )
-        analysing = LabeledStateSetMetricFamily(
-            'zm_monitor_analysing',
-            'Monitor analysing mode'
-        )
-        recording = LabeledStateSetMetricFamily(
-            'zm_monitor_recording',
-            'Monitor recording mode'
-        )
-        decoding = LabeledStateSetMetricFamily(
-            'zm_monitor_decoding',
-            'Monitor decoding mode'
+        # built aside and swapped in, since other threads (push mode, the shm
+        # watchdog) read the map
+        id_to_name: Dict[int, str] = {}
+        storage_ids: Dict[int, int] = {}
+        listing_status: Dict[int, MonitorStatusRow] = {}
+        refresh_status: bool = self._stage_due(
+            'daemon_status', now, throttles
         )
-        janus_enabled = LabeledGaugeMetricFamily(
-            'zm_monitor_janus_enabled',
-            'Monitor Janus streaming enabled'
-        )
-        go2rtc_enabled = LabeledGaugeMetricFamily(
-            'zm_monitor_go2rtc_enabled',
-            'Monitor Go2RTC streaming enabled'
-        )
-        rtsp2web_enabled = LabeledGaugeMetricFamily(
-            'zm_monitor_rtsp2web_enabled',
-            'Monitor RTSP2Web streaming enabled'
-        )
-        mqtt_enabled = LabeledGaugeMetricFamily(
-            'zm_monitor_mqtt_enabled',
-            'Monitor MQTT enabled'
-        )
-        onvif_event_listener = LabeledGaugeMetricFamily(
-            'zm_monitor_onvif_event_listener',
-            'Monitor ONVIF event listener enabled'
-        )
-        int_fields: List[str] = [
-            'DecodingEnabled', 'Width', 'Height', 'Colours', 'Palette',
-            'SaveJPEGs', 'VideoWriter', 'OutputCodec', 'Brightness', 'Contrast',
-            'Hue', 'Colour', 'ImageBufferCount', 'MaxImageBufferCount',
-            'WarmupCount', 'PreEventCount', 'PostEventCount', 'AlarmFrameCount',
-            'RefBlendPerc', 'AlarmRefBlendPerc', 'TrackMotion', 'ZoneCount',
-        ]
-        int_metrics: Dict[str, LabeledGaugeMetricFamily] = {
-            x: LabeledGaugeMetricFamily(
-                f'zm_monitor_{camel_to_snake(x)}',
-                f'ZM Monitor {x}'
-            ) for x in int_fields
-        }
-        connected = LabeledGaugeMetricFamily(
-            'zm_monitor_connected',
-            'Monitor is connected or not'
-        )
-        capture_fps = LabeledGaugeMetricFamily(
-            'zm_monitor_capture_fps',
-            'Monitor capture FPS'
-        )
-        analysis_fps = LabeledGaugeMetricFamily(
-            'zm_monitor_analysis_fps',
-            'Monitor analysis FPS'
-        )
-        capture_bw = LabeledGaugeMetricFamily(
-            'zm_monitor_capture_bandwidth_bytes_per_second',
-            'Monitor capture bandwidth'
-        )
-        self._monitor_id_to_name: Dict[int, str] = {}
-        m: Monitor
-        for m in monitors:
+        live: List[Dict[str, Any]] = []
+        for entry in monitors:
+            mon: Dict[str, Any] = entry['Monitor']
             # ZoneMinder soft-deletes monitors: a deleted monitor is flagged
             # Deleted=true and keeps being returned by the API (with all-null
             # Monitor_Status) until a later cleanup pass removes the row. Skip
             # these entirely so we don't emit stale metrics or choke on nulls.
-            if m.get().get('Deleted'):
+            if mon.get('Deleted'):
                 logger.debug(
                     'Skipping deleted monitor %s (%s)',
-                    m.get()['Id'], m.get()['Name']
+                    mon['Id'], mon['Name']
                 )
                 continue
-            labels: Dict[str, str] = {
-                'id': str(m.get()['Id']),
-                'name': m.get()['Name']
-            }
-            self._monitor_id_to_name[int(m.get()['Id'])] = m.get()['Name']
-            info_vals: dict = {
-                camel_to_snake(x): str(m.get()[x]) for x in [
-                    'ServerId', 'StorageId', 'Type', 'DecodingEnabled',
-                    'Device', 'Channel', 'Format', 'Method', 'Encoder',
-                    'RecordAudio', 'EventPrefix', 'Controllable', 'ControlId',
-                    'Importance'
-                ]
-            } | {
-                camel_to_snake(x): str(m.get().get(x, ''))
-                for x in [
-                    'Capturing', 'Analysing', 'Recording',
-                    'Decoding', 'OutputCodecName'
-                ]
-            } | labels
-            info.add_metric(labels=list(info_vals.keys()), value=info_vals)
-            curr_status = m.status()
+            live.append(entry)
+            id_to_name[int(mon['Id'])] = mon['Name']
+            storage_ids[int(mon['Id'])] = _event_int_value(
+                mon.get('StorageId')
+            )
+            labels: Dict[str, str] = self._monitor_labels(
+                int(mon['Id']), mon['Name']
+            )
+            mon_status: dict = entry.get('Monitor_Status') or {}
+            status_str: str = mon_status.get('Status') or 'Unknown'
+            listing_status[int(mon['Id'])] = (
+                labels, status_str,
+                float(mon_status.get('CaptureFPS') or 0),
+                float(mon_status.get('AnalysisFPS') or 0),
+                float(mon_status.get('CaptureBandwidth') or 0),
+            )
+            if status_str != 'Connected':
+                logger.warning(
+                    'Monitor %s Status is %s', mon['Name'], status_str
+                )
+            curr_status: Optional[dict] = None
+            if not refresh_status:
+                curr_status = self._daemon_status_cache.get(int(mon['Id']))
+            if curr_status is None:
+                try:
+                    curr_status = self._get_json(
+                        'daemon_status',
+                        f'{self._api.api_url}/monitors/daemonStatus/id:'
+                        f'{mon["Id"]}/daemon:zmc.json',
+                        monitor_id=int(mon['Id'])
+                    )
+                except Exception as ex:
+                    # one failed request only costs this monitor's zmc
+                    # series, not the whole scrape
+                    logger.error(
+                        'Error getting zmc status of monitor %s: %s',
+                        mon['Id'], ex
+                    )
+                    continue
+                self._daemon_status_cache[int(mon['Id'])] = curr_status
             status.add_metric(
                 labels=labels,
                 value=1 if curr_status['status'] else 0
@@ -535,155 +3605,46 @@ class ZmExporter:
             ):
                 try:
                     foo: StatusType = self._parse_zmdc_status(statustext)
-                    zmc.add_metric(
-                        labels=labels | {'command': foo[0]}, value=foo[1]
-                    )
-                    zmc_pid.add_metric(
-                        labels=labels | {'command': foo[0]}, value=foo[2]
+                    cmd_labels: Dict[str, str] = with_label(
+                        labels, 'command', foo[0],
+                        self._label_modes['command']
                     )
+                    zmc.add_metric(labels=cmd_labels, value=foo[1])
+                    zmc_pid.add_metric(labels=cmd_labels, value=foo[2])
                 except Exception as ex:
                     logger.error(
                         'Error parsing monitor %s status string "%s": %s',
                         labels, statustext, ex,
                         exc_info=True
                     )
-            # In ZM 1.38+, Enabled is always 0 and Capturing replaces it.
-            # Use Capturing != 'None' as the enabled indicator when available.
-            if m.get().get('Capturing') is not None:
-                enabled.add_metric(
-                    labels=labels,
-                    value=0 if m.get()['Capturing'] == 'None' else 1
-                )
-            else:
-                enabled.add_metric(
-                    labels=labels, value=int(m.get()['Enabled'])
-                )
-            function.add_metric(
-                value={
-                    x: m.function() == x
-                    for x in [
-                        'None', 'Monitor', 'Modect', 'Record', 'Mocord',
-                        'Nodect'
-                    ]
-                },
-                labels=labels
-            )
-            cap_val = m.get().get('Capturing', 'Unknown')
-            capturing.add_metric(
-                value={
-                    x: cap_val == x
-                    for x in ['None', 'Ondemand', 'Always']
-                },
-                labels=labels
-            )
-            ana_val = m.get().get('Analysing', 'Unknown')
-            analysing.add_metric(
-                value={
-                    x: ana_val == x
-                    for x in ['None', 'Always']
-                },
-                labels=labels
-            )
-            rec_val = m.get().get('Recording', 'Unknown')
-            recording.add_metric(
-                value={
-                    x: rec_val == x
-                    for x in ['None', 'OnMotion', 'Always']
-                },
-                labels=labels
-            )
-            dec_val = m.get().get('Decoding', 'Unknown')
-            decoding.add_metric(
-                value={
-                    x: dec_val == x
-                    for x in [
-                        'None', 'Ondemand', 'KeyFrames',
-                        'KeyFrames+Ondemand', 'Always'
-                    ]
-                },
-                labels=labels
-            )
-            janus_enabled.add_metric(
-                labels=labels,
-                value=int(m.get().get('JanusEnabled', '0'))
-            )
-            go2rtc_enabled.add_metric(
-                labels=labels,
-                value=int(m.get().get('Go2RTCEnabled', '0'))
-            )
-            rtsp2web_enabled.add_metric(
-                labels=labels,
-                value=int(m.get().get('RTSP2WebEnabled', '0'))
-            )
-            mqtt_enabled.add_metric(
-                labels=labels,
-                value=int(m.get().get('MQTT_Enabled', '0'))
-            )
-            onvif_event_listener.add_metric(
-                labels=labels,
-                value=int(m.get().get('ONVIF_Event_Listener', '0'))
-            )
-            for x in int_fields:
-                int_metrics[x].add_metric(
-                    labels=labels,
-                    value=0 if m.get()[x] is None else int(m.get()[x])
-                )
-            # Monitor_Status (and its fields) can be None when a monitor's
-            # capture daemon isn't running, e.g. a monitor that was just
-            # deleted but still appears in the API for one scrape.
-            mon_status: dict = m.monitor.get('Monitor_Status') or {}
-            status_str: str = mon_status.get('Status') or 'Unknown'
-            if status_str != 'Connected':
-                logger.warning(
-                    'Monitor %s Status is %s', m.name(), status_str
-                )
-            connected.add_metric(
-                labels=labels | {'status': status_str},
-                value=1 if status_str == 'Connected' else 0
-            )
-            capture_fps.add_metric(
-                labels=labels,
-                value=float(mon_status.get('CaptureFPS') or 0)
-            )
-            analysis_fps.add_metric(
-                labels=labels,
-                value=float(mon_status.get('AnalysisFPS') or 0)
-            )
-            capture_bw.add_metric(
-                labels=labels,
-                value=float(mon_status.get('CaptureBandwidth') or 0)
+        del monitors
+        self._monitor_id_to_name = id_to_name
+        self._monitor_storage = storage_ids
+        for mid in set(self._label_cache) - set(self._monitor_id_to_name):
+            del self._label_cache[mid]
+        for mid in (
+            set(self._daemon_status_cache) - set(self._monitor_id_to_name)
+        ):
+            del self._daemon_status_cache[mid]
+        for mid in set(self._status_readers) - set(self._monitor_id_to_name):
+            self._status_readers.pop(mid).close()
+        families: List[Metric] = (
+            self._run_sharded(_monitor_shard_worker, [
+                (int(entry['Monitor']['Id']), entry) for entry in live
+            ]) if self._processes > 1
+            else self._build(
+                build_monitor_metrics, live, self._monitor_labels,
+                consume=True
             )
-            event_count.add_metric(
-                labels=labels,
-                value=0 if m.monitor['Event_Summary']['TotalEvents'] is None
-                else m.monitor['Event_Summary']['TotalEvents']
-            )
-            event_disk_space.add_metric(
-                labels=labels,
-                value=0 if m.monitor['Event_Summary']['TotalEventDiskSpace'] is None
-                else m.monitor['Event_Summary']['TotalEventDiskSpace']
-            )
-            archived_event_count.add_metric(
-                labels=labels,
-                value=0 if not m.monitor['Event_Summary']['ArchivedEvents']
-                else m.monitor['Event_Summary']['ArchivedEvents']
-            )
-            archived_event_disk_space.add_metric(
-                labels=labels,
-                value=0 if not m.monitor['Event_Summary']['ArchivedEventDiskSpace']
-                else m.monitor['Event_Summary']['ArchivedEventDiskSpace']
-            )
-        yield from [
-            info, event_count, enabled, function,
-            capturing, analysing, recording, decoding,
-            janus_enabled, go2rtc_enabled, rtsp2web_enabled,
-            mqtt_enabled, onvif_event_listener,
-            connected, capture_fps,
-            analysis_fps, capture_bw, event_disk_space,
-            archived_event_count, archived_event_disk_space, zmc, zmc_pid
-        ]
-        yield from int_metrics.values()
+        )
+        families += [zmc, zmc_pid]
+        if cache and self._monitor_list_refresh_seconds > 0:
+            self._listing_fetched = now
+            self._listing_families = families
+            self._listing_status = listing_status
+        return families
 
+    @_timed
     def _do_events(self) -> Generator[Metric, None, None]:
         """Recording-persistence metrics derived from recently-ended events.
 
@@ -698,191 +3659,300 @@ class ZmExporter:
         # Fetch events whose StartTime is within the window plus a 15-minute
         # pad (ZM filters by StartTime; the pad covers long events that ended
         # inside the window). Compute the bound in the ZM server timezone when
-        # known so it is correct even if this process runs as UTC; otherwise
-        # fall back to a process-local relative bound.
+        # known so it is correct even if this process runs as UTC; with no
+        # query_tz, datetime.now(None) gives this process's naive local time.
         pad_seconds: int = window + 15 * 60
-        if self._event_query_tz is not None:
-            from_bound: str = (
-                datetime.now(self._event_query_tz)
-                - timedelta(seconds=pad_seconds)
-            ).strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            from_bound = f'{pad_seconds // 60} minutes ago'
-        options: Dict[str, Any] = {
-            'from': from_bound,
-            'limit': self._event_query_limit,
-        }
-        logger.debug('Querying events with options: %s', options)
+        from_bound: str = (
+            datetime.now(self._event_query_tz)
+            - timedelta(seconds=pad_seconds)
+        ).strftime('%Y-%m-%d %H:%M:%S')
+        logger.debug('Querying events with StartTime >= %s', from_bound)
+        # ZM's events API returns event datetimes in UTC (see
+        # _parse_zm_datetime), so compare against a UTC-aware now.
+        now: datetime = datetime.now(timezone.utc)
+        counts: Dict[str, float] = {'events': 0, 'fetch': 0.0}
+
+        def stream() -> Generator[Dict[str, Any], None, None]:
+            # Each page is aggregated (and folded into the rollup store) and
+            # then dropped, so a wide window never sits in memory at once.
+            pages = self._iter_event_pages(from_bound)
+            while True:
+                fetch_start: float = time.perf_counter()
+                page: Optional[List[Dict[str, Any]]] = next(pages, None)
+                counts['fetch'] += time.perf_counter() - fetch_start
+                if page is None:
+                    return
+                counts['events'] += len(page)
+                self._ingest_rollups(page, now, grace)
+                yield from page
+
+        start: float = time.perf_counter()
         try:
-            raw_events: List[Dict[str, Any]] = [
-                e.get() for e in self._api.events(options=options).list()
-            ]
+            with self._tracing.span(
+                'aggregate_events', **{'zm.window_seconds': window}
+            ) as span:
+                agg: Dict[int, Dict[str, Any]] = self._aggregate_events(
+                    stream(), list(self._monitor_id_to_name.keys()),
+                    now, window, grace, histograms=self._event_histograms
+                )
+                if span is not None:
+                    span.set_attribute('zm.events', counts['events'])
         except Exception as ex:
             logger.error('Error querying events: %s', ex, exc_info=True)
             return
-        logger.debug('Fetched %d events for window', len(raw_events))
-        # ZM's events API returns event datetimes in UTC (see
-        # _parse_zm_datetime), so compare against a UTC-aware now.
-        now: datetime = datetime.now(timezone.utc)
-        agg: Dict[int, Dict[str, Any]] = aggregate_events(
-            raw_events, list(self._monitor_id_to_name.keys()),
-            now, window, grace
+        self._record_timing(
+            self._aggregate_events.__name__,
+            time.perf_counter() - start - counts['fetch']
         )
+        logger.debug('Fetched %d events for window', counts['events'])
+        self._recent_disk_bytes = {
+            mid: m['disk_space_sum'] for mid, m in agg.items()
+        }
 
-        last_disk = LabeledGaugeMetricFamily(
-            'zm_monitor_last_event_disk_space_bytes',
-            'DiskSpace in bytes of the most recent ended event for this monitor'
-        )
-        last_age = LabeledGaugeMetricFamily(
-            'zm_monitor_last_event_end_time_age_seconds',
-            'Seconds since the most recent ended event for this monitor ended'
-        )
-        last_frames = LabeledGaugeMetricFamily(
-            'zm_monitor_last_event_frames',
-            'Frame count of the most recent ended event for this monitor'
+        yield from self._build(
+            build_event_metrics, agg, self._monitor_id_to_name, now, window,
+            self._monitor_labels
         )
-        last_id = LabeledGaugeMetricFamily(
-            'zm_monitor_last_event_id',
-            'Event ID of the most recent ended event for this monitor '
-            '(monotonic; safe to use with increase() as an event-creation rate)'
+        if self._event_histograms is not None:
+            self._event_histograms.prune(
+                now.timestamp(), self._monitor_id_to_name
+            )
+            yield from self._event_histograms.collect(
+                self._monitor_id_to_name, self._monitor_labels
+            )
+
+    @_timed
+    def _do_storage(self) -> Generator[Metric, None, None]:
+        """Per-storage-area usage, write rate and projected time-to-full.
+
+        The storage areas and filesystem sizes are refreshed every
+        ``ZM_STORAGE_REFRESH_SECONDS`` (a failed refresh keeps the previous
+        ones); write rates come from the latest event aggregation, which
+        covers events that ended between ``ZM_EVENT_GRACE_SECONDS`` and
+        ``ZM_EVENT_WINDOW_SECONDS`` ago, and are left out with the events
+        stage disabled.
+        """
+        if self._storage_refresh_seconds <= 0:
+            return
+        now: float = time.time()
+        if now - self._storage_fetched >= self._storage_refresh_seconds:
+            try:
+                self._storage_areas = self._fetch_storage_areas()
+                self._storage_fetched = now
+            except Exception as ex:
+                logger.error(
+                    'Error querying storage areas: %s', ex, exc_info=True
+                )
+        yield from self._build(
+            build_storage_metrics, self._storage_areas, self._monitor_storage,
+            self._recent_disk_bytes,
+            None if 'events' in self._disabled_stages
+            else self._event_window_seconds - self._event_grace_seconds
         )
-        ended_count = LabeledGaugeMetricFamily(
-            'zm_monitor_recent_ended_event_count',
-            f'Count of events that ended in the last {window}s (excludes '
-            f'still-open and purged events; windowed gauge, do not rate())'
+
+    def _fetch_storage_areas(self) -> List[Dict[str, Any]]:
+        """ZM's storage areas, each with the ``total``/``free`` bytes of the
+        filesystem at its ``Path`` when that is mounted here (the exporter
+        runs on the ZM host), else ``None``."""
+        areas: List[Dict[str, Any]] = []
+        for entry in self._get_json(
+            'storage', self._api.api_url + '/storage.json'
+        ).get('storage') or []:
+            area: Dict[str, Any] = dict(entry['Storage'])
+            area['total'] = area['free'] = None
+            try:
+                usage = shutil.disk_usage(area.get('Path') or '')
+                area['total'], area['free'] = usage.total, usage.free
+            except OSError as ex:
+                logger.debug(
+                    'No local filesystem for storage %s (%s): %s',
+                    area.get('Id'), area.get('Path'), ex
+                )
+            areas.append(area)
+        return areas
+
+    @_timed
+    def _do_event_rollups(self) -> Generator[Metric, None, None]:
+        """Long-window (1h/24h/7d) per-monitor event aggregates from the
+        local :class:`EventRollupStore`, if ``ZM_ROLLUP_DB_PATH`` is set."""
+        if self._rollup_store is None:
+            return
+        try:
+            totals: Dict[str, Dict[int, Tuple[int, int, int]]] = (
+                self._rollup_store.totals(int(time.time()))
+            )
+        except sqlite3.Error as ex:
+            logger.error(
+                'Error reading event rollups from %s: %s',
+                self._rollup_store.path, ex, exc_info=True
+            )
+            return
+        count = LabeledGaugeMetricFamily(
+            'zm_monitor_rollup_event_count',
+            'Count of ended, non-purged events per rollup window (from the '
+            'local rollup store; bucket-aligned windowed gauge)'
         )
         zero_count = LabeledGaugeMetricFamily(
-            'zm_monitor_recent_ended_zero_size_event_count',
-            f'Count of events that ended in the last {window}s having saved '
-            f'zero bytes to disk (windowed gauge, do not rate())'
+            'zm_monitor_rollup_zero_size_event_count',
+            'Count of ended events that saved zero bytes to disk per rollup '
+            'window'
         )
-        disk_sum = LabeledGaugeMetricFamily(
-            'zm_monitor_recent_event_disk_space_bytes',
-            f'Sum of DiskSpace in bytes over events that ended in the last '
-            f'{window}s -- recording throughput (windowed gauge, do not rate())'
+        zero_ratio = LabeledGaugeMetricFamily(
+            'zm_monitor_rollup_zero_size_event_ratio',
+            'Fraction of ended events that saved zero bytes to disk per '
+            'rollup window'
         )
-        min_disk = LabeledGaugeMetricFamily(
-            'zm_monitor_recent_min_event_disk_space_bytes',
-            f'Smallest DiskSpace in bytes among events that ended in the last '
-            f'{window}s -- surfaces partial/truncated writes (windowed gauge)'
+        disk = LabeledGaugeMetricFamily(
+            'zm_monitor_rollup_event_disk_space_bytes',
+            'Sum of DiskSpace in bytes of events that ended in each rollup '
+            'window -- bytes written per window'
         )
-        min_frames = LabeledGaugeMetricFamily(
-            'zm_monitor_recent_min_event_frames',
-            f'Smallest frame count among events that ended in the last '
-            f'{window}s -- surfaces truncated events (windowed gauge)'
+        for window, per_monitor in totals.items():
+            for mid, name in sorted(self._monitor_id_to_name.items()):
+                events, zeros, disk_bytes = per_monitor.get(mid, (0, 0, 0))
+                labels: Dict[str, str] = {
+                    'id': str(mid), 'name': name, 'window': window
+                }
+                count.add_metric(labels=labels, value=events)
+                zero_count.add_metric(labels=labels, value=zeros)
+                disk.add_metric(labels=labels, value=disk_bytes)
+                if events:
+                    zero_ratio.add_metric(labels=labels, value=zeros / events)
+        yield from [count, zero_count, zero_ratio, disk]
+
+    def _run_sharded(
+        self, worker: Callable[[list], List[Dict[str, Any]]],
+        items: List[Tuple[int, Any]]
+    ) -> List[Metric]:
+        """Split ``(monitor id, item)`` pairs into one shard per worker
+        process by id, run ``worker`` on each shard in the pool and merge the
+        serialized results."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        shards: List[list] = [[] for _ in range(self._processes)]
+        for mid, item in items:
+            shards[mid % self._processes].append(item)
+        return merge_metric_families(self._pool.map(worker, shards))
+
+    def _monitor_labels(self, mid: int, name: str) -> Dict[str, str]:
+        """The ``{'id', 'name'}`` label dict for a monitor, shared by every
+        sample for that monitor and reused across scrapes (callers derive
+        extra labels with ``labels | {...}`` and never mutate it)."""
+        labels: Optional[Dict[str, str]] = self._label_cache.get(mid)
+        if labels is None or labels['name'] != name:
+            labels = self._label_cache[mid] = {'id': str(mid), 'name': name}
+        return labels
+
+    @_timed
+    def _iter_event_pages(
+        self, from_bound: str
+    ) -> Generator[List[Dict[str, Any]], None, None]:
+        """Page through the events index newest-first, as pyzm's ``Events``
+        does, yielding each page's bare ``Event`` dicts (``Event.get()``
+        shape) without wrapping each one in a pyzm object. Pages hold
+        ``ZM_EVENT_PAGE_SIZE`` events; stops after ``ZM_EVENT_QUERY_LIMIT``
+        events. An event created while paging shifts older ones onto the
+        next page; those already yielded are skipped there, so each event
+        is yielded once."""
+        url: str = (
+            f'{self._api.api_url}/events/index/StartTime >=:{from_bound}.json'
         )
+        params: Dict[str, Any] = {
+            'sort': 'StartTime',
+            'direction': 'desc',
+            'page': 1,
+            'limit': self._event_page_size,
+        }
+        fetched: int = 0
+        seen: Set[str] = set()
+        while True:
+            resp: dict = self._get_json('events', url, params)
+            page: List[Dict[str, Any]] = [
+                e['Event'] for e in resp.get('events') or []
+                if e['Event']['Id'] not in seen
+            ]
+            seen.update(e['Id'] for e in page)
+            pagination: Optional[dict] = resp.get('pagination')
+            del resp
+            fetched += len(page)
+            if fetched > self._event_query_limit:
+                del page[len(page) - (fetched - self._event_query_limit):]
+            yield page
+            if not pagination or not pagination.get('nextPage'):
+                return
+            if fetched >= self._event_query_limit:
+                return
+            params['page'] += 1
 
-        for mid, name in sorted(self._monitor_id_to_name.items()):
-            m: Optional[Dict[str, Any]] = agg.get(mid)
-            if not m:
-                continue
-            labels: Dict[str, str] = {'id': str(mid), 'name': name}
-            # windowed metrics: always emit (0 default) so a series exists for
-            # every monitor and "count > 0" alerts have something to evaluate.
-            ended_count.add_metric(labels=labels, value=m['ended_count'])
-            zero_count.add_metric(labels=labels, value=m['zero_size_count'])
-            disk_sum.add_metric(labels=labels, value=m['disk_space_sum'])
-            if m['min_disk_space'] is not None:
-                min_disk.add_metric(labels=labels, value=m['min_disk_space'])
-            if m['min_frames'] is not None:
-                min_frames.add_metric(labels=labels, value=m['min_frames'])
-            # point metrics: only when there is a recent ended event, so a
-            # quiet camera (no events) does not emit a stale/false series.
-            if m['last_event'] is not None:
-                eid, end_dt, disk, frames = m['last_event']
-                last_disk.add_metric(labels=labels, value=disk)
-                last_age.add_metric(
-                    labels=labels, value=(now - end_dt).total_seconds()
-                )
-                last_frames.add_metric(labels=labels, value=frames)
-                last_id.add_metric(labels=labels, value=eid)
-        yield from [
-            last_disk, last_age, last_frames, last_id,
-            ended_count, zero_count, disk_sum, min_disk, min_frames,
-        ]
+    def _ingest_rollups(
+        self, raw_events: List[Dict[str, Any]], now: datetime, grace: int
+    ) -> None:
+        """Fold a page of events into the rollup store, if one is configured.
+        """
+        if self._rollup_store is None:
+            return
+        try:
+            new: int = self._rollup_store.ingest(raw_events, now, grace)
+            logger.debug('Ingested %d new events into rollups', new)
+        except sqlite3.Error as ex:
+            logger.error(
+                'Error updating event rollups in %s: %s',
+                self._rollup_store.path, ex, exc_info=True
+            )
 
+    @_timed
     def _do_monitor_shm(self) -> Generator[Metric, None, None]:
-        int_fields: List[str] = [
-            'action', 'audio_channels', 'audio_frequency', 'imagesize',
-            'last_event', 'last_frame_score', 'last_read_index',
-            'last_write_index', 'state'
-        ]
-        bool_fields: List[str] = ['active', 'format', 'signal']
-        ts_fields: List[str] = [
-            'heartbeat_time', 'last_read_time', 'last_write_time',
-            'startup_time'
-        ]
-        metrics: Dict[str, LabeledGaugeMetricFamily] = {}
-        for i in int_fields + bool_fields:
-            metrics[i] = LabeledGaugeMetricFamily(
-                f'zm_monitor_mmap_{i}',
-                f'ZM Monitor MMAP field {i}'
-            )
-        for i in ts_fields:
-            metrics[i] = LabeledGaugeMetricFamily(
-                f'zm_monitor_mmap_{i}_age_seconds',
-                f'Seconds since value of ZM Monitor MMAP field {i}'
-            )
-        logger.debug('Handling monitor mmaps...')
-        mid: int
-        mname: str
-        for mid, mname in sorted(self._monitor_id_to_name.items()):
-            shm_path: str = f'/dev/shm/zm.mmap.{mid}'
-            if not os.path.exists(shm_path):
-                logger.warning(
-                    'mmap file for Monitor %s at %s does not exist; skipping.',
-                    mid, shm_path
-                )
-                continue
-            logger.debug('Reading shared memory for monitor %s', mid)
-            now: int = int(time.time())
-            labels: Dict[str, str] = {'id': str(mid), 'name': mname}
-            try:
-                mem: ZMMemory = ZMMemory(mid=mid)
-                data: dict = mem.get_shared_data()
-                mem.close()
-            except Exception as ex:
-                logger.error(
-                    'Error reading shared memory for monitor %s: %s',
-                    mid, ex, exc_info=True
-                )
-                continue
-            for i in int_fields:
-                metrics[i].add_metric(
-                    labels=labels,
-                    value=data[i]
-                )
-            for i in bool_fields:
-                metrics[i].add_metric(
-                    labels=labels,
-                    value=1 if data[i] else 0
+        if not self._shm_enabled:
+            logger.debug('ZM_SHM_ENABLED is false; not reading shared memory')
+            return
+        monitors: List[Tuple[int, str]] = sorted(
+            self._monitor_id_to_name.items()
+        )
+        with self._tracing.span(
+            'read_shm', **{'zm.monitors': len(monitors)}
+        ):
+            if self._processes > 1:
+                families: List[Metric] = self._run_sharded(
+                    functools.partial(
+                        _shm_shard_worker, shm_dir=self._shm_dir
+                    ),
+                    [(mid, (mid, name)) for mid, name in monitors]
                 )
-            for i in ts_fields:
-                metrics[i].add_metric(
-                    labels=labels,
-                    value=now - data[i]
+            else:
+                families = self._build(
+                    build_shm_metrics, monitors, self._shm_dir,
+                    labels_for=self._monitor_labels
                 )
-        yield from metrics.values()
+        yield from families
 
+    def _do_shm_watchdog(self) -> Generator[Metric, None, None]:
+        if self._shm_watchdog is not None:
+            yield from self._shm_watchdog.collect(self._monitor_labels)
+
+    @_timed
     def _do_states(self) -> Generator[Metric, None, None]:
         logger.debug('Getting ZM states')
-        states: List[State] = self._api.states().list()
+        states: List['State'] = self._api.states().list()
         metric = LabeledGaugeMetricFamily(
             'zm_state',
             'Monitor state'
         )
-        s: State
+        s: 'State'
         for s in states:
             metric.add_metric(
-                labels={
-                    'name': s.name(),
-                    'id': str(s.id()),
-                    'definition': str(s.definition())
-                },
+                labels=with_label(
+                    {'name': s.name(), 'id': str(s.id())},
+                    'definition', str(s.definition()),
+                    self._label_modes['definition']
+                ),
                 value=s.get()['IsActive']
             )
         yield metric
 
+    @_timed
     def _do_zmes_websocket(self) -> Generator[Metric, None, None]:
         wsurl: Optional[str] = os.environ.get('ZMES_WEBSOCKET_URL')
         if not wsurl:
@@ -890,13 +3960,15 @@ class ZmExporter:
                 'ZMES_WEBSOCKET_URL not set; not checking websocket server'
             )
             return
+        from websocket import create_connection
         start = time.time()
         try:
             logger.debug('Connecting to websocket server at: %s', wsurl)
-            ws = create_connection(wsurl, timeout=10)
-            ws.send('{"event":"control","data":{"type":"version"}}')
-            val = ws.recv()
-            ws.close()
+            with self._tracing.span('zmes_websocket version'):
+                ws = create_connection(wsurl, timeout=10)
+                ws.send('{"event":"control","data":{"type":"version"}}')
+                val = ws.recv()
+                ws.close()
             data = json.loads(val)
             logger.debug('Websocket response: %s', data)
             duration = time.time() - start
@@ -937,20 +4009,93 @@ def _get_best_family(address, port):
     return family, sockaddr[0]
 
 
-def serve_exporter(port: int, addr: str = '0.0.0.0'):
+def make_app(exporter: Optional[ZmExporter] = None, registry=REGISTRY):
+    """WSGI app serving metrics from ``registry`` on every path except:
+
+    * ``/-/healthy`` - liveness; 200 whenever the process is serving HTTP.
+    * ``/-/ready`` - readiness; 200 once ``exporter`` has connected to ZM,
+      503 until then.
+    * ``/-/profile`` - only if ``ZM_PROFILING_ENABLED``; runs one collection
+      under a profiler and returns the profile (see :meth:`ZmExporter.profile`).
+    """
+    metrics_app = make_wsgi_app(registry)
+
+    def app(environ, start_response):
+        path: str = environ.get('PATH_INFO', '/')
+        if path == '/-/healthy':
+            status, body = '200 OK', b'OK\n'
+        elif path == '/-/profile' and exporter is not None and (
+            exporter.profiling_enabled
+        ):
+            if not exporter.ready:
+                status, body = '503 Service Unavailable', b'Not ready\n'
+            else:
+                query: Dict[str, List[str]] = parse_qs(
+                    environ.get('QUERY_STRING', '')
+                )
+                fmt: str = query.get('format', ['text'])[0]
+                if fmt not in ('text', 'pstats', 'collapsed'):
+                    start_response(
+                        '400 Bad Request', [('Content-Type', 'text/plain')]
+                    )
+                    return [b'format must be text, pstats or collapsed\n']
+                try:
+                    interval: float = float(
+                        query.get('interval', ['0.005'])[0]
+                    )
+                except ValueError:
+                    interval = float('nan')
+                # also rejects nan
+                if not PROFILE_MIN_INTERVAL <= interval <= 60:
+                    start_response(
+                        '400 Bad Request', [('Content-Type', 'text/plain')]
+                    )
+                    return [
+                        f'interval must be {PROFILE_MIN_INTERVAL} to 60 '
+                        f'seconds\n'.encode()
+                    ]
+                ctype, body = exporter.profile(fmt, interval)
+                start_response('200 OK', [('Content-Type', ctype)])
+                return [body]
+        elif path == '/-/ready':
+            if exporter is not None and exporter.ready:
+                status, body = '200 OK', b'Ready\n'
+            else:
+                status, body = '503 Service Unavailable', b'Not ready\n'
+        else:
+            return metrics_app(environ, start_response)
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [body]
+
+    return app
+
+
+def make_exporter_server(
+    port: int, addr: str = '0.0.0.0', exporter: Optional[ZmExporter] = None,
+    registry=REGISTRY
+) -> WSGIServer:
     """
-    Copied from prometheus_client.exposition.start_http_server, but doesn't run
-    in a thread because we're just a proxy.
+    Copied from prometheus_client.exposition.start_http_server, but leaves
+    serving to the caller. Each request gets its own thread, so a slow
+    collection does not hold up the health and readiness probes.
     """
 
-    class TmpServer(WSGIServer):
-        """Copy of WSGIServer to update address_family locally"""
+    class TmpServer(ThreadingWSGIServer):
+        """Copy of ThreadingWSGIServer to update address_family locally"""
 
     TmpServer.address_family, addr = _get_best_family(addr, port)
-    app = make_wsgi_app(REGISTRY)
-    httpd = make_server(
+    app = make_app(exporter, registry)
+    return make_server(
         addr, port, app, TmpServer, handler_class=_SilentHandler
     )
+
+
+def serve_exporter(
+    port: int, addr: str = '0.0.0.0', exporter: Optional[ZmExporter] = None
+):
+    """Serve the exporter on ``addr:port`` until the process exits."""
+    httpd: WSGIServer = make_exporter_server(port, addr, exporter)
+    mark_startup('http_listening')
     httpd.serve_forever()
 
 
@@ -999,6 +4144,7 @@ if __name__ == "__main__":
     elif args.verbose == 1:
         set_log_info()
     logger.debug('Registering collector...')
-    REGISTRY.register(ZmExporter())
+    exporter = ZmExporter()
+    REGISTRY.register(exporter)
     logger.info('Starting HTTP server on port %d', 8080)
-    serve_exporter(8080)
+    serve_exporter(8080, exporter=exporter)
@@ -3,10 +3,35 @@
 Run with: python -m unittest test_main
 """
 
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from urllib.request import urlopen
 
-from main import aggregate_events, _parse_zm_datetime, _event_int
+from main import (
+    aggregate_events, aggregate_events_columnar, _parse_zm_datetime,
+    _event_int, EventRollupStore, LabeledGaugeMetricFamily,
+    LabeledStateSetMetricFamily, metrics_to_json, metrics_from_json,
+    sample_stacks, _timed, GcPauseTracker, DeltaPusher, AdaptiveInterval,
+    build_monitor_metrics, merge_metric_families, _monitor_shard_worker,
+    SHM_SHARED_DATA, ShmReader, ShmWatchdog, EventHistograms,
+    build_storage_metrics, with_label, limit_info_samples, ZmExporter,
+    Tracing, shm_monitor_status, build_monitor_status_metrics,
+    refresh_zmc_metrics, make_app, make_exporter_server, GC_PAUSES,
+    _process_start_time,
+)
+from prometheus_client.core import CollectorRegistry, InfoMetricFamily
 
 # ZM's events API returns UTC; the exporter compares against a UTC-aware now.
 NOW = datetime(2026, 7, 12, 12, 0, 0, tzinfo=timezone.utc)
@@ -132,5 +157,1431 @@ class TestAggregateEvents(unittest.TestCase):
         self.assertEqual(agg[9]['zero_size_count'], 1)
 
 
+def _histograms():
+    return EventHistograms(
+        {'duration': (10, 60), 'size': (0, 1000), 'frames': (30,)},
+        horizon_seconds=WINDOW * 2,
+    )
+
+
+def _histogram_samples(hists, monitors=None):
+    monitors = monitors or {mid: str(mid) for mid in range(10)}
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in hists.collect(
+            monitors, lambda mid, name: {'id': str(mid), 'name': name}
+        )
+        for sample in family.samples
+    }
+
+
+class TestEventHistograms(unittest.TestCase):
+
+    def test_buckets_and_once_per_event(self):
+        hists = _histograms()
+        events = [
+            _event(1, 1, ended_ago=300, disk='500', frames='30'),
+            _event(2, 1, ended_ago=200, disk='5000', frames='40'),
+            _event(3, 1, ended_ago=60, disk='0'),          # within grace
+            _event(4, 1, ended_ago=250, emptied='1'),      # purged
+            _event(5, 1, open_event=True),
+            _event(6, 1, ended_ago=WINDOW + 60, disk='0'),  # outside window
+        ]
+        for _ in range(2):
+            aggregate_events(events, [1], NOW, WINDOW, GRACE, histograms=hists)
+        samples = _histogram_samples(hists)
+
+        def value(name, le=None):
+            labels = {'id': '1', 'name': '1'}
+            if le is not None:
+                labels['le'] = le
+            return samples[(name, tuple(sorted(labels.items())))]
+
+        # events 1, 2 and 6: ended, non-purged, out of grace; counted once
+        self.assertEqual(value('zm_monitor_event_size_bytes_count'), 3)
+        self.assertEqual(value('zm_monitor_event_size_bytes_sum'), 5500)
+        self.assertEqual(value('zm_monitor_event_size_bytes_bucket', '0.0'), 1)
+        self.assertEqual(
+            value('zm_monitor_event_size_bytes_bucket', '1000.0'), 2
+        )
+        self.assertEqual(value('zm_monitor_event_frames_bucket', '30.0'), 2)
+        # _event starts every event 30s before it ends
+        self.assertEqual(value('zm_monitor_event_duration_seconds_sum'), 90)
+        self.assertEqual(
+            value('zm_monitor_event_duration_seconds_bucket', '10.0'), 0
+        )
+        # event 3 leaves the grace period on a later scrape
+        aggregate_events(
+            events, [1], NOW + timedelta(seconds=GRACE), WINDOW, GRACE,
+            histograms=hists
+        )
+        self.assertEqual(
+            _histogram_samples(hists)[(
+                'zm_monitor_event_size_bytes_count',
+                (('id', '1'), ('name', '1'))
+            )], 4
+        )
+
+    def test_prune_forgets_old_ids(self):
+        hists = _histograms()
+        aggregate_events(
+            [_event(1, 1, ended_ago=300)], [1], NOW, WINDOW, GRACE,
+            histograms=hists
+        )
+        self.assertIn(1, hists)
+        hists.prune(NOW.timestamp() + WINDOW * 2 - 300, [1])
+        self.assertIn(1, hists)
+        hists.prune(NOW.timestamp() + WINDOW * 2 - 299, [1])
+        self.assertNotIn(1, hists)
+
+    def test_prune_drops_removed_monitors(self):
+        hists = _histograms()
+        aggregate_events(
+            [_event(1, 1, ended_ago=300), _event(2, 2, ended_ago=300)],
+            [1, 2], NOW, WINDOW, GRACE, histograms=hists
+        )
+        hists.prune(NOW.timestamp(), [2, 3])
+        self.assertEqual(
+            {dict(labels)['id'] for _, labels in _histogram_samples(hists)},
+            {'2'}
+        )
+
+
+class TestAggregateEventsColumnar(unittest.TestCase):
+    """The columnar path must return exactly what aggregate_events does."""
+
+    def _assert_same(self, events, monitor_ids, now=NOW):
+        hists = _histograms()
+        expected = aggregate_events(
+            events, monitor_ids, now, WINDOW, GRACE, histograms=hists
+        )
+        for use_numpy in (False, None):
+            # a generator too, as _do_events streams pages into it
+            for source in (events, (e for e in events)):
+                got_hists = _histograms()
+                got = aggregate_events_columnar(
+                    source, monitor_ids, now, WINDOW, GRACE,
+                    use_numpy=use_numpy, histograms=got_hists
+                )
+                self.assertEqual(got, expected)
+                self.assertEqual(list(got), list(expected))
+                self.assertEqual(
+                    _histogram_samples(got_hists), _histogram_samples(hists)
+                )
+
+    def test_edge_cases_match(self):
+        self._assert_same([], [1, 2])
+        self._assert_same([
+            _event(10, 1, ended_ago=300, disk='2000', frames='40'),
+            _event(11, 1, ended_ago=250, disk='0'),
+            _event(12, 1, ended_ago=240, disk=None),
+            _event(13, 1, ended_ago=60, disk='0'),
+            _event(14, 1, ended_ago=WINDOW + 300, disk='0'),
+            _event(15, 1, ended_ago=300, disk='0', emptied='1'),
+            _event(16, 1, open_event=True),
+            _event(17, 9, ended_ago=300, disk='0'),
+            _event(17, 9, ended_ago=400, disk='5'),   # duplicate id
+            {'Id': 'x', 'MonitorId': '1', 'EndDateTime': None},
+            {'Id': '18', 'MonitorId': '1', 'EndDateTime': 'garbage'},
+        ], [1, 2])
+
+    def test_int64_overflow_mid_stream(self):
+        self._assert_same([
+            _event(10, 1, ended_ago=300, disk='2000'),
+            _event(11, 2, ended_ago=300, disk=str(2 ** 64)),
+            _event(12, 1, ended_ago=200, disk='0'),
+        ], [1, 2])
+
+    def test_window_bounds_exact(self):
+        # events exactly on (and either side of) both inclusive window edges,
+        # with and without a fractional-second now
+        events = [
+            _event(i, 1, ended_ago=age)
+            for i, age in enumerate(
+                [GRACE - 1, GRACE, GRACE + 1, WINDOW - 1, WINDOW, WINDOW + 1]
+            )
+        ]
+        for now in (NOW, NOW + timedelta(microseconds=500000)):
+            self._assert_same(events, [1], now=now)
+
+    def test_random_events_match(self):
+        rnd = random.Random(42)
+        events = [
+            _event(
+                rnd.randrange(1, 3000), rnd.randrange(1, 8),
+                ended_ago=rnd.randrange(0, WINDOW * 2),
+                disk=rnd.choice(['0', None, '', str(rnd.randrange(1, 10**7))]),
+                frames=str(rnd.randrange(0, 100)),
+                emptied=rnd.choice(['0', '0', '1']),
+                open_event=rnd.random() < 0.05,
+            )
+            for _ in range(2000)
+        ]
+        self._assert_same(events, [1, 2, 3])
+
+
+class TestEventRollupStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = EventRollupStore(':memory:')
+        self.now = int(NOW.timestamp())
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_ingest_is_incremental(self):
+        events = [
+            _event(1, 1, ended_ago=300, disk='1000'),
+            _event(2, 1, ended_ago=400, disk='0'),
+            _event(3, 1, ended_ago=60, disk='0'),          # within grace
+            _event(4, 1, open_event=True),
+            _event(5, 1, ended_ago=300, emptied='1'),
+        ]
+        self.assertEqual(self.store.ingest(events, NOW, GRACE), 2)
+        # overlapping scrape: nothing counted twice
+        self.assertEqual(self.store.ingest(events, NOW, GRACE), 0)
+        # event 3 qualifies once it is past the grace period
+        later = NOW + timedelta(seconds=GRACE)
+        self.assertEqual(self.store.ingest(events, later, GRACE), 1)
+        totals = self.store.totals(self.now)
+        self.assertEqual(totals['24h'][1], (3, 2, 1000))
+
+    def test_windows(self):
+        events = [
+            _event(1, 1, ended_ago=1800, disk='10'),
+            _event(2, 1, ended_ago=12 * 3600, disk='20'),
+            _event(3, 2, ended_ago=3 * 86400, disk='0'),
+        ]
+        self.store.ingest(events, NOW, GRACE)
+        totals = self.store.totals(self.now)
+        self.assertEqual(totals['1h'], {1: (1, 0, 10)})
+        self.assertEqual(totals['24h'], {1: (2, 0, 30)})
+        self.assertEqual(totals['7d'], {1: (2, 0, 30), 2: (1, 1, 0)})
+
+    def test_compaction_and_retention(self):
+        events = [
+            _event(i, 1, ended_ago=86400 * 3 + i * 3600, disk='5')
+            for i in range(10)
+        ] + [_event(99, 1, ended_ago=86400 * 10, disk='7')]
+        self.store.ingest(events, NOW, GRACE)
+        rows = self.store._db.execute(
+            'SELECT resolution, SUM(events), SUM(disk_bytes) FROM buckets '
+            'GROUP BY resolution'
+        ).fetchall()
+        # everything is older than 2 days: compacted to daily buckets, and
+        # the 10-day-old event is past the default 8-day retention
+        self.assertEqual(rows, [(EventRollupStore.DAY, 10, 50)])
+        self.assertEqual(self.store.totals(self.now)['7d'][1], (10, 0, 50))
+
+    def test_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rollups.sqlite')
+            store = EventRollupStore(path)
+            store.ingest([_event(1, 1, ended_ago=300)], NOW, GRACE)
+            store.close()
+            store = EventRollupStore(path)
+            self.assertEqual(
+                store.ingest([_event(1, 1, ended_ago=300)], NOW, GRACE), 0
+            )
+            self.assertEqual(store.totals(self.now)['1h'][1], (1, 0, 1000))
+            store.close()
+
+
+class TestSnapshotSerialization(unittest.TestCase):
+
+    def test_round_trip(self):
+        gauge = LabeledGaugeMetricFamily('zm_monitor_status', 'Monitor status')
+        gauge.add_metric(labels={'id': '1', 'name': 'Cam'}, value=1)
+        info = InfoMetricFamily('zm_monitor', 'Information about a monitor')
+        info.add_metric(labels=['id'], value={'id': '1'})
+        states = LabeledStateSetMetricFamily('zm_monitor_function', 'Fn')
+        states.add_metric(value={'None': False, 'Modect': True})
+        metrics = [gauge, info, states]
+        restored = metrics_from_json(
+            json.loads(json.dumps(metrics_to_json(metrics)))
+        )
+        self.assertEqual(restored, metrics)
+
+
+class TestProfilingHelpers(unittest.TestCase):
+
+    def test_timed_generator_and_function(self):
+        class Collector:
+            def __init__(self):
+                self.timings = {}
+
+            def _record_timing(self, name, seconds):
+                calls, total = self.timings.get(name, (0, 0.0))
+                self.timings[name] = (calls + 1, total + seconds)
+
+            @_timed
+            def _do_stage(self):
+                time.sleep(0.01)
+                yield 1
+                yield 2
+
+            @_timed
+            def helper(self):
+                return 3
+
+        c = Collector()
+        self.assertEqual(list(c._do_stage()), [1, 2])
+        self.assertEqual(c.helper(), 3)
+        self.assertEqual(c.timings['_do_stage'][0], 1)
+        self.assertGreaterEqual(c.timings['_do_stage'][1], 0.01)
+        self.assertEqual(c.timings['helper'][0], 1)
+
+    def test_gc_pause_tracker(self):
+        tracker = GcPauseTracker()
+        tracker.install()
+        tracker.install()
+        try:
+            self.assertEqual(gc.callbacks.count(tracker.callback), 1)
+            gc.collect()
+        finally:
+            gc.callbacks.remove(tracker.callback)
+        self.assertGreater(tracker.total[2], 0)
+        self.assertEqual(tracker.max[2], tracker.total[2])
+        tracker.reset_max()
+        self.assertEqual(tracker.max, [0.0, 0.0, 0.0])
+
+    def test_sample_stacks(self):
+        def busy_wait():
+            end = time.time() + 0.05
+            while time.time() < end:
+                pass
+
+        stacks = sample_stacks(busy_wait, 0.001)
+        self.assertTrue(stacks)
+        self.assertTrue(any(
+            'busy_wait (test_main.py:' in stack for stack in stacks
+        ))
+
+
+def _monitor_entry(mid, status='Connected'):
+    return {
+        'Monitor': {
+            'Id': str(mid), 'Name': f'Cam{mid}', 'ServerId': '0',
+            'StorageId': '1', 'Type': 'Ffmpeg', 'DecodingEnabled': '1',
+            'Device': '', 'Channel': '0', 'Format': '0', 'Method': 'rtpRtsp',
+            'Encoder': 'libx264', 'RecordAudio': '0', 'EventPrefix': 'Event-',
+            'Controllable': '0', 'ControlId': None, 'Importance': 'Normal',
+            'Capturing': 'Always', 'Function': 'Modect', 'Enabled': '1',
+            **{f: str(mid) for f in [
+                'Width', 'Height', 'Colours', 'Palette', 'SaveJPEGs',
+                'VideoWriter', 'OutputCodec', 'Brightness', 'Contrast', 'Hue',
+                'Colour', 'ImageBufferCount', 'MaxImageBufferCount',
+                'WarmupCount', 'PreEventCount', 'PostEventCount',
+                'AlarmFrameCount', 'RefBlendPerc', 'AlarmRefBlendPerc',
+                'TrackMotion', 'ZoneCount',
+            ]},
+        },
+        'Monitor_Status': {'Status': status, 'CaptureFPS': '10.5'},
+        'Event_Summary': {
+            'TotalEvents': mid, 'TotalEventDiskSpace': None,
+            'ArchivedEvents': None, 'ArchivedEventDiskSpace': None,
+        },
+    }
+
+
+class TestMonitorSharding(unittest.TestCase):
+
+    @staticmethod
+    def _samples(families):
+        return sorted(
+            (s.name, sorted(s.labels.items()), s.value)
+            for m in families for s in m.samples
+        )
+
+    def test_sharded_build_matches_in_process(self):
+        entries = [
+            _monitor_entry(mid, 'Connected' if mid % 2 else None)
+            for mid in range(1, 8)
+        ]
+        single = build_monitor_metrics(entries)
+        shards = [
+            _monitor_shard_worker([e for e in entries if int(
+                e['Monitor']['Id']) % 3 == i
+            ]) for i in range(3)
+        ]
+        merged = merge_metric_families(json.loads(json.dumps(shards)))
+        self.assertEqual(
+            [m.name for m in merged], [m.name for m in single]
+        )
+        self.assertEqual(self._samples(merged), self._samples(single))
+        connected = {
+            s.labels['id']: s.labels['status']
+            for m in merged if m.name == 'zm_monitor_connected'
+            for s in m.samples
+        }
+        self.assertEqual((connected['1'], connected['2']),
+                         ('Connected', 'Unknown'))
+
+    def test_entries_consumed_only_when_handed_over(self):
+        entries = [_monitor_entry(mid, 'Connected') for mid in (1, 2)]
+        kept = list(entries)
+        families = build_monitor_metrics(entries)
+        self.assertEqual(entries, kept)
+        self.assertEqual(
+            self._samples(build_monitor_metrics(entries, consume=True)),
+            self._samples(families)
+        )
+        self.assertEqual(entries, [])
+
+
+def _write_shm(path, index, heartbeat, active=True, fps=(0.0, 0.0)):
+    """Write a monitor shared-memory file with the given fields."""
+    fields = [0] * 26
+    fields[1], fields[15], fields[23], fields[24] = (
+        index, active, heartbeat, heartbeat
+    )
+    fields[4], fields[5] = fps
+    fields[14:18] = [True, active, True, True]
+    with open(path, 'wb') as f:
+        f.write(SHM_SHARED_DATA.pack(*fields) + b'\0' * 1024)
+
+
+class TestStorageMetrics(unittest.TestCase):
+
+    def test_fill_rate_and_time_to_full(self):
+        areas = [
+            {'Id': '1', 'Name': 'Default', 'DiskSpace': '5000',
+             'total': 10**9, 'free': 9 * 10**6},
+            {'Id': '2', 'Name': 'NAS', 'DiskSpace': None,
+             'total': None, 'free': None},
+            {'Id': '3', 'Name': 'Idle', 'DiskSpace': '0',
+             'total': 10**9, 'free': 10**8},
+        ]
+        # monitor 1 uses the default storage (StorageId 0); events ended
+        # over a 900s window less its 120s grace period
+        families = build_storage_metrics(
+            areas, {1: 0, 2: 1, 3: 2}, {1: 520000, 2: 260000, 3: 780}, 780
+        )
+        values = {
+            (s.name, s.labels['storage_id']): s.value
+            for m in families for s in m.samples
+        }
+        self.assertEqual(values[('zm_storage_monitors', '1')], 2)
+        self.assertEqual(
+            values[('zm_storage_write_rate_bytes_per_second', '1')], 1000
+        )
+        self.assertEqual(values[('zm_storage_time_to_full_seconds', '1')], 9000)
+        self.assertEqual(values[('zm_storage_event_disk_space_bytes', '1')], 5000)
+        self.assertEqual(
+            values[('zm_storage_write_rate_bytes_per_second', '2')], 1
+        )
+        # no filesystem info, or nothing written: no projection
+        self.assertNotIn(('zm_storage_free_bytes', '2'), values)
+        self.assertNotIn(('zm_storage_time_to_full_seconds', '2'), values)
+        self.assertNotIn(('zm_storage_time_to_full_seconds', '3'), values)
+        self.assertEqual(values[('zm_storage_monitors', '3')], 0)
+
+    def test_no_write_rate_without_events(self):
+        areas = [{'Id': '1', 'Name': 'Default', 'DiskSpace': '5000',
+                  'total': 10**9, 'free': 9 * 10**6}]
+        names = {
+            s.name for m in build_storage_metrics(areas, {1: 0}, {}, None)
+            for s in m.samples
+        }
+        self.assertIn('zm_storage_free_bytes', names)
+        self.assertNotIn('zm_storage_write_rate_bytes_per_second', names)
+        self.assertNotIn('zm_storage_time_to_full_seconds', names)
+
+
+class TestCardinalityControls(unittest.TestCase):
+
+    def test_with_label_modes(self):
+        labels = {'id': '1', 'name': 'Cam1'}
+        self.assertEqual(
+            with_label(labels, 'command', '/usr/bin/zmc -m 1', 'full'),
+            labels | {'command': '/usr/bin/zmc -m 1'}
+        )
+        self.assertIs(with_label(labels, 'command', 'x', 'drop'), labels)
+        hashed = with_label(labels, 'command', '/usr/bin/zmc -m 1', 'hash')
+        self.assertEqual(len(hashed['command']), 12)
+        self.assertEqual(
+            hashed, with_label(labels, 'command', '/usr/bin/zmc -m 1', 'hash')
+        )
+        self.assertEqual(labels, {'id': '1', 'name': 'Cam1'})
+
+    @staticmethod
+    def _info(types):
+        family = InfoMetricFamily('zm_monitor', 'Information about a monitor')
+        for mid, type_ in types.items():
+            family.add_metric(
+                labels=['id', 'name', 'type', 'device'],
+                value={'id': str(mid), 'name': f'Cam{mid}', 'type': type_,
+                       'device': '/dev/video0'}
+            )
+        return family
+
+    def test_trim_and_on_change(self):
+        family = self._info({1: 'Ffmpeg'})
+        limit_info_samples(family, frozenset(['type']))
+        self.assertEqual(
+            family.samples[0].labels,
+            {'id': '1', 'name': 'Cam1', 'type': 'Ffmpeg'}
+        )
+        sent = {}
+        for now, types, expected in [
+            (0, {1: 'Ffmpeg', 2: 'Local'}, ['1', '2']),
+            (10, {1: 'Ffmpeg', 2: 'Local'}, []),
+            (20, {1: 'Remote', 2: 'Local'}, ['1']),
+            (110, {1: 'Remote', 2: 'Local'}, ['2']),   # resend after 100s
+        ]:
+            family = self._info(types)
+            limit_info_samples(family, None, sent, now, 100)
+            self.assertEqual(
+                [s.labels['id'] for s in family.samples], expected
+            )
+
+
+class TestShmWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.path = os.path.join(self.dir, 'zm.mmap.1')
+        self.watchdog = ShmWatchdog(
+            lambda: {1: 'Cam1', 2: 'Cam2'}, stall_seconds=10,
+            buckets=(5, 30, 60), shm_dir=self.dir
+        )
+
+    def _metrics(self):
+        return {
+            (s.name, s.labels.get('le')): s.value
+            for m in self.watchdog.collect(
+                lambda mid, name: {'id': str(mid), 'name': name}
+            )
+            for s in m.samples if s.labels['id'] == '1'
+        }
+
+    def test_reader_follows_recreated_file(self):
+        reader = ShmReader(self.path)
+        self.assertIsNone(reader.read())
+        _write_shm(self.path, 7, 1000)
+        self.assertEqual(reader.read(), (7, True, 1000, 1000))
+        os.unlink(self.path)
+        _write_shm(self.path, 8, 1001)
+        self.assertEqual(reader.read(), (8, True, 1001, 1001))
+        reader.close()
+
+    def test_short_stall_between_scrapes_is_recorded(self):
+        _write_shm(self.path, 1, 1000)
+        self.watchdog.check(now=1000)
+        self.watchdog.check(now=1009)
+        self.assertEqual(self._metrics()[('zm_monitor_shm_stalled', None)], 0)
+        # index stops advancing (heartbeat still fresh) ...
+        _write_shm(self.path, 1, 1015)
+        self.watchdog.check(now=1015)
+        self.assertEqual(self._metrics()[('zm_monitor_shm_stalled', None)], 1)
+        # ... and resumes
+        _write_shm(self.path, 2, 1030)
+        self.watchdog.check(now=1030)
+        metrics = self._metrics()
+        self.assertEqual(metrics[('zm_monitor_shm_stalled', None)], 0)
+        self.assertEqual(metrics[('zm_monitor_shm_stalls_total', None)], 1)
+        self.assertEqual(
+            metrics[('zm_monitor_shm_last_stall_start_timestamp_seconds',
+                     None)], 1000
+        )
+        self.assertEqual(
+            metrics[('zm_monitor_shm_stall_duration_seconds_sum', None)], 30
+        )
+        self.assertEqual(
+            [metrics[('zm_monitor_shm_stall_duration_seconds_bucket', le)]
+             for le in ('5.0', '30.0', '60.0', '+Inf')],
+            [0, 1, 1, 1]
+        )
+
+    def test_stale_heartbeat_and_inactive(self):
+        _write_shm(self.path, 1, 900)
+        self.watchdog.check(now=1000)
+        start = 'zm_monitor_shm_last_stall_start_timestamp_seconds'
+        self.assertEqual(self._metrics()[(start, None)], 900)
+        _write_shm(self.path, 1, 900, active=False)
+        self.watchdog.check(now=1001)
+        self.assertEqual(self._metrics()[('zm_monitor_shm_stalled', None)], 0)
+
+
+class TestMonitorStatusFromShm(unittest.TestCase):
+
+    LISTED = ({'id': '1', 'name': 'Cam1'}, 'Connected', 9.0, 4.0, 123456.0)
+
+    def test_fps_from_live_shm(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'zm.mmap.1')
+            reader = ShmReader(path)
+            self.assertIsNone(reader.read_status())
+            _write_shm(path, 7, 1000, fps=(12.5, 6.25))
+            shm = reader.read_status()
+            reader.close()
+        self.assertEqual(shm, (True, 12.5, 6.25, 1000, 0, True))
+        row = shm_monitor_status(self.LISTED, shm, 1005, 10)
+        # bandwidth is only in ZM's database, so the listed value stands
+        self.assertEqual(row[1:], ('Connected', 12.5, 6.25, 123456.0))
+        connected, capture_fps, _, bandwidth = build_monitor_status_metrics(
+            [row]
+        )
+        self.assertEqual(
+            connected.samples[0].labels,
+            {'id': '1', 'name': 'Cam1', 'status': 'Connected'}
+        )
+        self.assertEqual(capture_fps.samples[0].value, 12.5)
+        self.assertEqual(bandwidth.samples[0].value, 123456.0)
+
+    def test_zmc_gone_is_not_running(self):
+        for shm, now in (
+            (None, 1005),                      # no shared memory
+            ((False, 12.5, 6.25, 1000, 0, True), 1005),  # not valid
+            ((True, 12.5, 6.25, 1000, 0, True), 1011),   # stale heartbeat
+        ):
+            row = shm_monitor_status(self.LISTED, shm, now, 10)
+            self.assertEqual(row[1:], ('NotRunning', 0.0, 0.0, 0.0))
+
+    def test_zmc_series_follow_shm(self):
+        uptime = LabeledGaugeMetricFamily(
+            'zm_monitor_zmc_uptime_seconds', 'Uptime'
+        )
+        pid = LabeledGaugeMetricFamily('zm_monitor_zmc_pid', 'PID')
+        for mid in ('1', '2', '3'):
+            uptime.add_metric(labels={'id': mid, 'name': mid}, value=100)
+            pid.add_metric(labels={'id': mid, 'name': mid}, value=int(mid))
+        # listed at 1000: 1 still running, 2 gone, 3 restarted at 1020
+        started = {'1': 900, '2': None, '3': 1020}
+        self.assertEqual(
+            [(s.labels['id'], s.value) for s in refresh_zmc_metrics(
+                uptime, started, 1000, 1030
+            ).samples], [('1', 130), ('3', 10)]
+        )
+        self.assertEqual(
+            [s.labels['id'] for s in refresh_zmc_metrics(
+                pid, started, 1000, 1030
+            ).samples], ['1']
+        )
+        # the listing's family is left as it was
+        self.assertEqual(len(uptime.samples), 3)
+
+    def test_zmc_back_is_connected(self):
+        for status in ('NotRunning', 'Unknown'):
+            listed = (self.LISTED[0], status, 0.0, 0.0, 0.0)
+            for shm in (
+                (True, 12.5, 6.25, 1000, 0, False),   # capturing
+                (True, 0.0, 0.0, 1000, 0, True),      # signal, no frames yet
+            ):
+                row = shm_monitor_status(listed, shm, 1005, 10)
+                self.assertEqual(row[1], 'Connected')
+                connected = build_monitor_status_metrics([row])[0]
+                self.assertEqual(connected.samples[0].value, 1)
+
+    def test_zmc_without_camera_is_running(self):
+        # zmc alive but retrying its source, whether or not the listing
+        # still says Connected
+        for status in ('Connected', 'NotRunning', 'Unknown'):
+            listed = (self.LISTED[0], status, 9.0, 4.0, 0.0)
+            row = shm_monitor_status(
+                listed, (True, 0.0, 0.0, 1000, 0, False), 1005, 10
+            )
+            self.assertEqual(row[1:], ('Running', 0.0, 0.0, 0.0))
+            connected = build_monitor_status_metrics([row])[0]
+            self.assertEqual(connected.samples[0].value, 0)
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+
+    def test_backs_off_and_recovers(self):
+        throttle = AdaptiveInterval(max_interval=100, step=30)
+        self.assertTrue(throttle.due(0))
+        seen = []
+        for _ in range(4):
+            throttle.adjust(overloaded=True, healthy=False)
+            seen.append(throttle.interval)
+        self.assertEqual(seen, [30, 60, 100, 100])
+        throttle.last_run = 0
+        self.assertFalse(throttle.due(99))
+        self.assertTrue(throttle.due(100))
+        # neither overloaded nor clearly healthy: hold
+        throttle.adjust(overloaded=False, healthy=False)
+        self.assertEqual(throttle.interval, 100)
+        seen = []
+        for _ in range(3):
+            throttle.adjust(overloaded=False, healthy=True)
+            seen.append(throttle.interval)
+        self.assertEqual(seen, [50, 0, 0])
+
+
+class PushgatewayStub:
+    """Local stand-in for a Pushgateway: records ``(method, path, body)``
+    for every request, and answers 500 while ``fail`` is set."""
+
+    def __init__(self):
+        self.requests = []
+        self.fail = False
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub.requests.append(
+                    (self.command, self.path, self.rfile.read(length).decode())
+                )
+                self.send_response(500 if stub.fail else 200)
+                self.end_headers()
+
+            do_PUT = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'127.0.0.1:{self.server.server_address[1]}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestDeltaPusher(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway = PushgatewayStub()
+        self.addCleanup(self.gateway.close)
+        self.fps = {'1': 10.0, '2': 5.0}
+        self.pusher = DeltaPusher(
+            self.gateway.url, self._sample, interval=5, resend_seconds=300,
+            max_backoff=30
+        )
+
+    def _sample(self):
+        groups = {}
+        for mid, fps in self.fps.items():
+            fam = LabeledGaugeMetricFamily('zm_monitor_capture_fps', 'FPS')
+            fam.add_metric(labels={'id': mid}, value=fps)
+            groups[mid] = [fam] if fps is not None else None
+        return groups
+
+    def _paths(self):
+        paths = [(method, path) for method, path, _ in self.gateway.requests]
+        self.gateway.requests.clear()
+        return paths
+
+    def test_pushes_only_changed_groups(self):
+        self.assertTrue(self.pusher.push_once(now=0))
+        self.assertEqual(sorted(self._paths()), [
+            ('PUT', '/metrics/job/zm_exporter/monitor/1'),
+            ('PUT', '/metrics/job/zm_exporter/monitor/2'),
+        ])
+        self.fps['1'] = 10.5   # within min_change
+        self.fps['2'] = 0.0
+        self.pusher.push_once(now=10)
+        self.assertEqual(
+            self._paths(), [('PUT', '/metrics/job/zm_exporter/monitor/2')]
+        )
+        self.pusher.push_once(now=301)   # resend interval for group 1
+        self.assertEqual(
+            self._paths(), [('PUT', '/metrics/job/zm_exporter/monitor/1')]
+        )
+        self.fps['2'] = None    # unreadable this round: left alone
+        del self.fps['1']       # gone: deleted from the gateway
+        self.pusher.push_once(now=302)
+        self.assertEqual(
+            self._paths(), [('DELETE', '/metrics/job/zm_exporter/monitor/1')]
+        )
+        self.assertEqual(self.pusher.series_pushed, 4)
+
+    def test_backoff_and_retry(self):
+        self.gateway.fail = True
+        self.assertFalse(self.pusher.push_once(now=0))
+        self.assertEqual(self.pusher.delay, 10)
+        self.pusher.push_once(now=1)
+        self.pusher.push_once(now=2)
+        self.assertEqual(self.pusher.delay, 30)
+        self.gateway.fail = False
+        self.gateway.requests.clear()
+        self.assertTrue(self.pusher.push_once(now=3))
+        self.assertEqual(self.pusher.delay, 5)
+        self.assertIn(
+            'zm_monitor_capture_fps{id="1"} 10.0',
+            '\n'.join(body for _, _, body in self.gateway.requests)
+        )
+        self.assertEqual(len(self._paths()), 2)
+        self.assertEqual(self.pusher.requests, {'success': 2, 'failure': 6})
+
+
+class ZmApiStub:
+    """Local stand-in for the ZM API: lets pyzm log in and answers GETs of
+    the paths in ``routes`` with a ``(status, JSON-able body)`` pair, or a
+    callable taking the query dict and returning one. Requested paths
+    (with query strings) are kept in ``requests``."""
+
+    VERSION = {'version': '1.36.33', 'apiversion': '2.0'}
+
+    def __init__(self, routes=None):
+        stub = self
+        self.routes = dict(routes or {})
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                url = urlsplit(self.path)
+                stub.requests.append(self.path)
+                route = stub.routes.get(
+                    unquote(url.path), (200, stub.VERSION)
+                )
+                if callable(route):
+                    route = route(parse_qs(url.query))
+                status, body = route
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _handle
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/api'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _stub_exporter(test, routes=None, **env):
+    """A connected ZmExporter against a new :class:`ZmApiStub` (returned
+    too), with the shared-memory watchdog thread turned off."""
+    api = ZmApiStub(routes)
+    test.addCleanup(api.close)
+    patch = mock.patch.dict(os.environ, {
+        'ZM_API_URL': api.url, 'ZM_SHM_WATCHDOG_INTERVAL_SECONDS': '0',
+        **env
+    })
+    patch.start()
+    test.addCleanup(patch.stop)
+    exporter = ZmExporter()
+    test.assertTrue(exporter._connected.wait(10))
+    return exporter, api
+
+
+class TestApiRequests(unittest.TestCase):
+
+    def _exporter(self, routes, **env):
+        exporter, api = _stub_exporter(
+            self, routes, ZM_SHM_ENABLED='false', **env
+        )
+        api.requests.clear()
+        return exporter, api
+
+    def _token_auth(self, exporter):
+        zm = exporter._api
+        zm.auth_enabled, zm.api_version, zm.access_token = True, '2.0', 'old'
+
+        def relogin():
+            zm.access_token = 'new'
+
+        zm._relogin = mock.Mock(side_effect=relogin)
+        return zm
+
+    def test_relogin_once_on_401(self):
+        exporter, api = self._exporter({'/api/monitors.json': lambda q: (
+            (200, {'monitors': []}) if q['token'] == ['new'] else (401, {})
+        )})
+        zm = self._token_auth(exporter)
+        url = f'{api.url}/monitors.json'
+        self.assertEqual(
+            exporter._get_json('monitors', url), {'monitors': []}
+        )
+        self.assertEqual(zm._relogin.call_count, 1)
+        self.assertEqual(
+            [parse_qs(urlsplit(r).query)['token'] for r in api.requests],
+            [['old'], ['new']]
+        )
+        self.assertEqual(exporter._api_calls[:2], [2, 0])
+
+    def test_second_401_raises(self):
+        import requests
+        exporter, api = self._exporter({'/api/monitors.json': (401, {})})
+        zm = self._token_auth(exporter)
+        with self.assertRaises(requests.HTTPError):
+            exporter._get_json('monitors', f'{api.url}/monitors.json')
+        self.assertEqual(zm._relogin.call_count, 1)
+        self.assertEqual(len(api.requests), 2)
+
+    def test_legacy_credentials_appended_once(self):
+        import requests
+        exporter, api = self._exporter({'/api/monitors.json': (401, {})})
+        zm = self._token_auth(exporter)
+        zm.api_version, zm.legacy_credentials = '1.0', 'auth=abc'
+        with self.assertRaises(requests.HTTPError):
+            exporter._get_json(
+                'monitors', f'{api.url}/monitors.json', {'page': 2}
+            )
+        # the retry does not append the credentials a second time
+        self.assertEqual(
+            [parse_qs(urlsplit(r).query) for r in api.requests],
+            [{'auth': ['abc'], 'page': ['2']}] * 2
+        )
+
+    def _events(self, total, **env):
+        def page(query):
+            number, size = int(query['page'][0]), int(query['limit'][0])
+            ids = range((number - 1) * size + 1, min(number * size, total) + 1)
+            return 200, {
+                'events': [{'Event': {'Id': str(eid)}} for eid in ids],
+                'pagination': {'nextPage': number * size < total},
+            }
+
+        exporter, api = self._exporter({
+            '/api/events/index/StartTime >=:2026-07-12 11:00:00.json': page
+        }, **env)
+        pages = [
+            [e['Id'] for e in events]
+            for events in exporter._iter_event_pages('2026-07-12 11:00:00')
+        ]
+        return pages, api.requests
+
+    def test_event_pages(self):
+        pages, requested = self._events(
+            5, ZM_EVENT_PAGE_SIZE='2', ZM_EVENT_QUERY_LIMIT='10'
+        )
+        self.assertEqual(pages, [['1', '2'], ['3', '4'], ['5']])
+        self.assertEqual(
+            [parse_qs(urlsplit(r).query)['page'] for r in requested],
+            [['1'], ['2'], ['3']]
+        )
+
+    def test_event_created_while_paging_counted_once(self):
+        events = [str(eid) for eid in range(5, 0, -1)]
+
+        def page(query):
+            number, size = int(query['page'][0]), int(query['limit'][0])
+            if number == 2:
+                # a new event pushes 4 from page 1 onto page 2
+                events.insert(0, '6')
+            rows = events[(number - 1) * size:number * size]
+            return 200, {
+                'events': [{'Event': {'Id': eid}} for eid in rows],
+                'pagination': {'nextPage': number * size < len(events)},
+            }
+
+        exporter, _ = self._exporter({
+            '/api/events/index/StartTime >=:2026-07-12 11:00:00.json': page
+        }, ZM_EVENT_PAGE_SIZE='2', ZM_EVENT_QUERY_LIMIT='10')
+        pages = [
+            [e['Id'] for e in batch]
+            for batch in exporter._iter_event_pages('2026-07-12 11:00:00')
+        ]
+        self.assertEqual(pages, [['5', '4'], ['3'], ['2', '1']])
+
+    def test_event_pages_truncated_at_query_limit(self):
+        pages, requested = self._events(
+            10, ZM_EVENT_PAGE_SIZE='2', ZM_EVENT_QUERY_LIMIT='3'
+        )
+        self.assertEqual(pages, [['1', '2'], ['3']])
+        self.assertEqual(len(requested), 2)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'snapshot.json')
+
+    def _write(self, age, state=None):
+        gauge = LabeledGaugeMetricFamily('zm_cached', 'From the snapshot')
+        gauge.add_metric(labels={'id': '1'}, value=1)
+        with open(self.path, 'w') as fh:
+            json.dump({
+                'written': time.time() - age, 'state': state or {},
+                'metrics': metrics_to_json([gauge]),
+            }, fh)
+
+    def _exporter(self, routes=None, **env):
+        return _stub_exporter(
+            self, routes, ZM_SHM_ENABLED='false', ZM_SNAPSHOT_PATH=self.path,
+            ZM_SNAPSHOT_MAX_AGE_SECONDS='3600', **env
+        )[0]
+
+    @staticmethod
+    def _values(metrics):
+        return {m.name: m.samples[0].value for m in metrics if m.samples}
+
+    def test_max_age(self):
+        self._write(age=7200)
+        self.assertIsNone(self._exporter()._stale_metrics)
+        self._write(age=60)
+        self.assertEqual(
+            [m.name for m in self._exporter()._stale_metrics], ['zm_cached']
+        )
+
+    def test_stale_until_background_refresh(self):
+        self._write(age=60)
+        exporter = self._exporter()
+        done = threading.Event()
+        live = LabeledGaugeMetricFamily('zm_live', 'From ZM')
+        live.add_metric(labels={'id': '1'}, value=2)
+
+        def collect_live():
+            done.wait(10)
+            return iter([live])
+
+        with mock.patch.object(
+            exporter, '_collect_live', side_effect=collect_live
+        ) as collect:
+            for _ in range(2):
+                values = self._values(exporter.collect())
+                self.assertEqual(values['zm_cached'], 1)
+                self.assertEqual(values['zm_exporter_snapshot_stale'], 1)
+                self.assertGreaterEqual(
+                    values['zm_exporter_snapshot_age_seconds'], 60
+                )
+            done.set()
+            exporter._refresh_thread.join(10)
+            values = self._values(exporter.collect())
+        # one background collection, whose result is served next
+        self.assertEqual(collect.call_count, 1)
+        self.assertEqual(values['zm_live'], 2)
+        self.assertNotIn('zm_cached', values)
+        self.assertEqual(values['zm_exporter_snapshot_stale'], 0)
+        with open(self.path) as fh:
+            self.assertEqual(
+                [m['name'] for m in json.load(fh)['metrics']], ['zm_live']
+            )
+
+    def test_refresh_token_reuse(self):
+        env = {'ZM_USER': 'admin', 'ZM_PASSWORD': 'secret'}
+        self._write(age=60, state={
+            'refresh_token': 'saved', 'refresh_token_expires': time.time() + 60
+        })
+        self.assertNotIn('token', self._exporter(**env)._api_options)
+        self._write(age=60, state={
+            'refresh_token': 'saved',
+            'refresh_token_expires': time.time() + 3600
+        })
+        # a refresh-token login answers with a new access token only
+        login = dict(
+            ZmApiStub.VERSION, access_token='access',
+            access_token_expires='3600'
+        )
+        exporter = self._exporter(
+            {'/api/host/login.json': (200, login)}, **env
+        )
+        self.assertEqual(exporter._api_options['token'], 'saved')
+        zm = exporter._api
+        self.assertEqual(zm.access_token, 'access')
+        self.assertEqual(zm.refresh_token, 'saved')
+        self.assertGreater(
+            zm.refresh_token_datetime, datetime.now() + timedelta(minutes=55)
+        )
+        # relogin on a 401 works, with the same saved token
+        zm._relogin()
+        self.assertEqual(zm.options['token'], 'saved')
+        exporter._write_snapshot([])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        with open(self.path) as fh:
+            self.assertEqual(
+                json.load(fh)['state']['refresh_token'], 'saved'
+            )
+
+
+class TestPushSampling(unittest.TestCase):
+
+    def setUp(self):
+        import requests
+        self.exporter, self.api = _stub_exporter(self, {
+            '/api/monitors/1.json': (200, {'monitor': {
+                'Monitor': {'Id': '1', 'Name': 'Cam1'},
+                'Monitor_Status': {'Status': 'Connected', 'CaptureFPS': '9'},
+            }}),
+            '/api/monitors/2.json': (500, {}),
+        }, ZM_SHM_ENABLED='false')
+        self.exporter._push_session = requests.Session()
+        self.addCleanup(self.exporter._push_session.close)
+
+    def test_push_requests_kept_out_of_collection_stats(self):
+        exporter = self.exporter
+        exporter._push_monitor_ids = [1, 2]
+        groups = exporter._sample_push_series()
+        self.assertIsNone(groups['2'])
+        self.assertEqual(
+            [(s.name, s.value) for m in groups['1'] for s in m.samples],
+            [('zm_monitor_connected', 1), ('zm_monitor_capture_fps', 9.0),
+             ('zm_monitor_analysis_fps', 0.0)]
+        )
+        self.assertEqual(
+            exporter._push_api_calls, {'success': 1, 'failure': 1}
+        )
+        self.assertEqual(exporter._api_calls, [0, 0, 0.0])
+        self.assertEqual(exporter._decode_seconds, {})
+        self.assertEqual(exporter._response_bytes, {})
+
+    def test_heartbeat_ages_from_persistent_reader(self):
+        exporter = self.exporter
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        exporter._shm_enabled, exporter._shm_dir = True, tmp.name
+        exporter._push_monitor_ids = [1]
+        _write_shm(os.path.join(tmp.name, 'zm.mmap.1'), 5, int(time.time()))
+        for _ in range(2):
+            ages = {
+                s.name: s.value
+                for m in exporter._sample_push_series()['1'] for s in m.samples
+            }
+            self.assertLess(
+                ages['zm_monitor_mmap_heartbeat_time_age_seconds'], 5
+            )
+        self.assertEqual(list(exporter._push_readers), [1])
+        exporter._push_readers[1].close()
+
+    def test_push_monitor_ids_required(self):
+        with mock.patch.dict(os.environ, {
+            'ZM_API_URL': self.api.url,
+            'ZM_PUSHGATEWAY_URL': 'localhost:9091',
+            'ZM_PUSH_MONITOR_IDS': '',
+        }):
+            with self.assertRaisesRegex(RuntimeError, 'ZM_PUSH_MONITOR_IDS'):
+                ZmExporter()
+
+
+class TestAdaptiveBackoff(unittest.TestCase):
+
+    def test_failed_listing_backs_off(self):
+        exporter, api = _stub_exporter(
+            self, {'/api/monitors.json': (500, {})},
+            ZM_SHM_ENABLED='false'
+        )
+        import requests
+        with self.assertRaises(requests.HTTPError):
+            list(exporter._collect_live())
+        self.assertEqual(exporter._api_calls[:2], [1, 1])
+        for stage, throttle in exporter._throttles.items():
+            with self.subTest(stage):
+                self.assertEqual(throttle.interval, throttle.step)
+
+
+def _wsgi_get(app, path, query=''):
+    """``(status, headers, body)`` of a GET of ``path`` from a WSGI app."""
+    response = {}
+
+    def start_response(status, headers):
+        response.update(status=status, headers=dict(headers))
+
+    body = b''.join(app({'PATH_INFO': path, 'QUERY_STRING': query},
+                        start_response))
+    return response['status'], response['headers'], body
+
+
+class TestHealthEndpoints(unittest.TestCase):
+
+    def test_healthy_without_exporter(self):
+        self.assertEqual(
+            _wsgi_get(make_app(), '/-/healthy')[::2], ('200 OK', b'OK\n')
+        )
+        self.assertEqual(
+            _wsgi_get(make_app(), '/-/ready')[0], '503 Service Unavailable'
+        )
+
+    def test_ready_once_connect_retries_succeed(self):
+        retry = threading.Event()
+        with mock.patch.dict(os.environ, {
+            'ZM_API_URL': 'http://127.0.0.1:1/api',
+            'ZM_SHM_WATCHDOG_INTERVAL_SECONDS': '0',
+        }), mock.patch('pyzm.api.ZMApi', side_effect=[
+            OSError('refused'), OSError('refused'), mock.Mock()
+        ]) as zmapi, mock.patch(
+            'main.time.sleep', side_effect=lambda delay: retry.wait(10)
+        ) as sleep:
+            exporter = ZmExporter()
+            app = make_app(exporter)
+            self.assertEqual(
+                _wsgi_get(app, '/-/ready')[0], '503 Service Unavailable'
+            )
+            self.assertEqual(_wsgi_get(app, '/-/healthy')[0], '200 OK')
+            retry.set()
+            self.assertTrue(exporter._connected.wait(10))
+            self.assertEqual(
+                _wsgi_get(app, '/-/ready')[::2], ('200 OK', b'Ready\n')
+            )
+        self.assertEqual(zmapi.call_count, 3)
+        # exponential backoff between attempts
+        self.assertEqual(
+            sleep.call_args_list[:2], [mock.call(1.0), mock.call(2.0)]
+        )
+
+
+class TestStartupTime(unittest.TestCase):
+
+    def test_measured_from_process_start(self):
+        # in a fresh interpreter, startup is counted from before main (or
+        # anything else) was imported
+        before_import = float(subprocess.check_output([
+            sys.executable, '-c',
+            'import time; now = time.time(); import main; '
+            'print(now - main._START_TIME)'
+        ], cwd=os.path.dirname(os.path.abspath(__file__))))
+        self.assertGreater(before_import, 0)
+        self.assertLess(before_import, 60)
+
+    def test_falls_back_to_now(self):
+        with mock.patch('builtins.open', side_effect=OSError):
+            self.assertAlmostEqual(_process_start_time(), time.time(), 1)
+
+
+class TestHttpServer(unittest.TestCase):
+
+    def test_slow_collection_does_not_block_probes(self):
+        collecting, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        class SlowCollector:
+            def collect(self):
+                collecting.set()
+                release.wait(10)
+                return []
+
+        registry = CollectorRegistry()
+        registry.register(SlowCollector())
+        httpd = make_exporter_server(0, '127.0.0.1', registry=registry)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        url = f'http://127.0.0.1:{httpd.server_address[1]}'
+        threading.Thread(
+            target=urlopen, args=(f'{url}/metrics',), daemon=True
+        ).start()
+        self.assertTrue(collecting.wait(5))
+        with urlopen(f'{url}/-/healthy', timeout=2) as resp:
+            self.assertEqual(resp.status, 200)
+        self.assertFalse(release.is_set())
+
+
+class TestProfileEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.exporter, self.api = _stub_exporter(self, {
+            '/api/monitors.json': (200, {
+                'monitors': [_monitor_entry(1, 'Connected')]
+            }),
+            '/api/monitors/daemonStatus/id:1/daemon:zmc.json': (
+                200, {'status': False, 'statustext': 'not running'}
+            ),
+        }, ZM_SHM_DIR=tmp.name, ZM_PROFILING_ENABLED='true',
+            ZM_INFO_ON_CHANGE='true', ZM_MONITOR_LIST_REFRESH_SECONDS='300',
+            ZM_DISABLED_STAGES='storage,states,zmes_websocket,daemon_check')
+        self.app = make_app(self.exporter)
+
+    def test_bad_interval(self):
+        with mock.patch.object(self.exporter, 'profile') as profile:
+            for interval in ('abc', '0', '0.0001', '-1', 'nan', 'inf'):
+                with self.subTest(interval):
+                    status, _, body = _wsgi_get(
+                        self.app, '/-/profile',
+                        f'format=collapsed&interval={interval}'
+                    )
+                    self.assertEqual(status, '400 Bad Request')
+                    self.assertIn(b'interval', body)
+        profile.assert_not_called()
+
+    def test_profile_leaves_scrape_state(self):
+        throttle = self.exporter._throttles['events']
+        throttle.interval, throttle.last_run = 60.0, time.time()
+        info_sent = self.exporter._info_sent
+        GC_PAUSES.max[2] = 5.0
+        for fmt in ('collapsed', 'text'):
+            with self.subTest(fmt):
+                status, headers, body = _wsgi_get(
+                    self.app, '/-/profile', f'format={fmt}&interval=0.001'
+                )
+                self.assertEqual(status, '200 OK')
+        # every stage ran live, without touching the adaptive intervals
+        self.assertIn('/api/events', ''.join(self.api.requests))
+        self.assertIs(self.exporter._throttles['events'], throttle)
+        self.assertEqual(throttle.interval, 60)
+        # info not marked as sent, listing not cached, GC maximum kept
+        self.assertIs(self.exporter._info_sent, info_sent)
+        self.assertEqual(info_sent, {})
+        self.assertEqual(self.exporter._listing_fetched, 0)
+        self.assertEqual(GC_PAUSES.max[2], 5.0)
+        # unlike a scrape
+        families = {m.name: m for m in self.exporter._collect_live()}
+        self.assertEqual(list(info_sent), [('1', 'Cam1')])
+        timed = {
+            s.labels['function']
+            for s in families['zm_exporter_function_calls'].samples
+        }
+        self.assertLessEqual(
+            {'build_monitor_metrics', 'build_shm_metrics'}, timed
+        )
+        self.assertGreater(self.exporter._listing_fetched, 0)
+
+    def test_profile_waits_for_collection(self):
+        done = threading.Event()
+
+        def profile():
+            _wsgi_get(self.app, '/-/profile', 'format=text')
+            done.set()
+
+        with self.exporter._collect_lock:
+            threading.Thread(target=profile, daemon=True).start()
+            self.assertFalse(done.wait(0.5))
+        self.assertTrue(done.wait(10))
+
+
+class TestConfigReload(unittest.TestCase):
+
+    def setUp(self):
+        api = ZmApiStub()
+        self.addCleanup(api.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'config.json')
+        self._write({'ZM_EVENT_WINDOW_SECONDS': 1800})
+        env = mock.patch.dict(os.environ, {
+            'ZM_API_URL': api.url, 'ZM_CONFIG_FILE': self.path,
+            'ZM_EVENT_GRACE_SECONDS': '60',
+            'ZM_SHM_WATCHDOG_INTERVAL_SECONDS': '0',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.exporter = ZmExporter()
+        self.assertTrue(self.exporter._connected.wait(10))
+
+    def _write(self, config):
+        with open(self.path, 'w') as fh:
+            json.dump(config, fh)
+        # make each write visible even within the mtime granularity
+        os.utime(self.path, ns=(time.time_ns(), time.time_ns()))
+
+    def test_file_overrides_environment_and_reloads(self):
+        exporter = self.exporter
+        self.assertEqual(exporter._event_window_seconds, 1800)
+        self.assertEqual(exporter._event_grace_seconds, 60)
+        exporter._stage_cache['events'] = ['cached']
+        exporter._stage_cache['daemon_status'] = ['cached']
+        self._write({
+            'ZM_EVENT_WINDOW_SECONDS': 600, 'ZM_EVENT_AGGREGATION': 'columnar',
+            'ZM_DISABLED_STAGES': 'states', 'ZM_INFO_ON_CHANGE': True,
+        })
+        exporter._reload_config()
+        self.assertEqual(exporter._event_window_seconds, 600)
+        self.assertIs(exporter._aggregate_events, aggregate_events_columnar)
+        self.assertEqual(exporter._disabled_stages, {'states'})
+        self.assertEqual(exporter._info_sent, {})
+        # the events query changed; other cached stages are still valid
+        self.assertNotIn('events', exporter._stage_cache)
+        self.assertIn('daemon_status', exporter._stage_cache)
+        self.assertEqual(exporter._config_reloads['success'], 1)
+        # unchanged file: nothing re-read
+        exporter._reload_config()
+        self.assertEqual(exporter._config_reloads['success'], 1)
+
+    def test_invalid_file_keeps_settings(self):
+        exporter = self.exporter
+        for config in (
+            {'ZM_EVENT_WINDOW_SECONDS': 60, 'ZM_DISABLED_STAGES': 'bogus'},
+            {'ZM_EVENT_WINDOW_SECONDS': 'soon'},
+        ):
+            self._write(config)
+            exporter._reload_config()
+        with open(self.path, 'w') as fh:
+            fh.write('{not json')
+        exporter._reload_config()
+        self.assertEqual(exporter._config_reloads['failure'], 3)
+        self.assertEqual(exporter._event_window_seconds, 1800)
+        self.assertEqual(exporter._disabled_stages, frozenset())
+
+
+class _FakeSpan:
+
+    def __init__(self, name, attributes, parent, ended):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.status = None
+        self.exceptions = []
+        self._ended = ended
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, ex):
+        self.exceptions.append(ex)
+
+    def set_status(self, status):
+        self.status = status
+
+    def end(self):
+        self._ended.append(self)
+
+
+class _FakeTracer:
+
+    def __init__(self):
+        self.ended = []
+
+    def start_span(self, name, attributes, context):
+        return _FakeSpan(name, attributes, context, self.ended)
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = _FakeTracer()
+        # the "context" is just the parent span
+        self.tracing = Tracing(self.tracer, lambda span: span, 'ERROR')
+
+    def test_disabled_is_noop(self):
+        tracing = Tracing()
+        self.assertFalse(tracing.enabled)
+        with tracing.span('collect', stage='x') as span:
+            self.assertIsNone(span)
+
+    def test_spans_nest_across_generators(self):
+        def stage(name):
+            with self.tracing.span(f'stage {name}', **{'zm.stage': name}):
+                with self.tracing.span('GET monitors') as span:
+                    span.set_attribute('http.response.body.size', 10)
+                yield name
+
+        with self.tracing.span('collect') as root:
+            self.assertEqual(
+                [v for n in ('a', 'b') for v in stage(n)], ['a', 'b']
+            )
+        ended = {span.name: span for span in self.tracer.ended}
+        self.assertEqual(len(self.tracer.ended), 5)
+        self.assertIsNone(root.parent)
+        self.assertIs(ended['stage b'].parent, root)
+        self.assertEqual(ended['stage b'].attributes, {'zm.stage': 'b'})
+        self.assertIs(ended['GET monitors'].parent, ended['stage b'])
+        self.assertEqual(
+            ended['GET monitors'].attributes, {'http.response.body.size': 10}
+        )
+        # closed spans are no longer parents
+        with self.tracing.span('after') as span:
+            self.assertIsNone(span.parent)
+
+    def test_exception_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.tracing.span('collect'):
+                with self.tracing.span('GET events'):
+                    raise ValueError('bad page')
+        inner, outer = self.tracer.ended
+        self.assertEqual(inner.status, 'ERROR')
+        self.assertEqual(outer.status, 'ERROR')
+        self.assertIsInstance(inner.exceptions[0], ValueError)
+
+
 if __name__ == '__main__':
     unittest.main()
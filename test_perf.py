@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Performance regression tests: time and allocation budgets for event
+aggregation, metric-family construction and exposition rendering, on
+fixtures of increasing size. No ZoneMinder is needed.
+
+Run with: python -m unittest test_perf
+Scaling report: python test_perf.py --report [-x 10]
+
+Budgets are per event or per monitor, with headroom over what the code
+currently needs, so a failure means a real regression. Allocation budgets
+and linear scaling are always checked; the absolute time budgets depend on
+the machine and its load, so they only run with ZM_PERF=1 (and
+ZM_PERF_TIME_SCALE=3 loosens them).
+Fixtures are generated like the benchmarks' unless ZM_PERF_FIXTURES names
+a directory holding a recorded ``monitors.json`` (a saved
+``/api/monitors.json`` response) and/or ``events.json`` (a saved events
+index page), whose entries are replicated up to each size.
+"""
+
+import argparse
+import functools
+import gc
+import json
+import math
+import os
+import time
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from bench_aggregate_events import NOW, make_events
+from bench_sharding import make_entry
+from main import (
+    aggregate_events, aggregate_events_columnar, build_event_metrics,
+    build_monitor_metrics, _parse_zm_datetime,
+)
+
+WINDOW = 6 * 3600
+GRACE = 120
+EVENTS_PER_MONITOR = 20
+# per-unit time may grow by this factor from the smallest to the largest
+# size of a case before it counts as worse than linear
+MAX_SCALING = 3.0
+
+
+class Case(NamedTuple):
+    """A measured operation: ``setup(size)`` builds the fixture and
+    returns the call to measure, costing at most ``time_budget`` seconds
+    and ``alloc_budget`` bytes of peak allocation per ``unit``."""
+    unit: str
+    sizes: Tuple[int, ...]
+    setup: Callable[[int], Callable[[], Any]]
+    time_budget: float
+    alloc_budget: int
+
+
+class Result(NamedTuple):
+    size: int
+    seconds: float
+    peak_bytes: Optional[int]
+
+
+def _recorded(name: str) -> Optional[List[Dict[str, Any]]]:
+    """Entries of the recorded ``name`` fixture, if there is one."""
+    directory: Optional[str] = os.environ.get('ZM_PERF_FIXTURES')
+    if not directory or not os.path.exists(os.path.join(directory, name)):
+        return None
+    with open(os.path.join(directory, name)) as fh:
+        data: dict = json.load(fh)
+    return data['monitors'] if name == 'monitors.json' else [
+        e['Event'] for e in data['events']
+    ]
+
+
+def monitor_entries(count: int) -> List[Dict[str, Any]]:
+    """``count`` ``/monitors.json`` entries, with unique ids and names."""
+    recorded = _recorded('monitors.json')
+    if not recorded:
+        return [make_entry(mid) for mid in range(1, count + 1)]
+    entries: List[Dict[str, Any]] = []
+    for mid in range(1, count + 1):
+        entry: Dict[str, Any] = recorded[(mid - 1) % len(recorded)]
+        entries.append(dict(entry, Monitor=dict(
+            entry['Monitor'], Id=str(mid),
+            Name=f'{entry["Monitor"]["Name"]} {mid}'
+        )))
+    return entries
+
+
+@functools.lru_cache(maxsize=None)
+def events(count: int, monitors: int) -> Tuple[List[Dict[str, Any]], datetime]:
+    """``count`` events over ``monitors`` monitors, and the "now" to
+    aggregate them at (just after the newest recorded event). Cached, as
+    they take longer to make than to aggregate; not to be modified."""
+    recorded = _recorded('events.json')
+    if not recorded:
+        return make_events(count, monitors, WINDOW), NOW
+    ends: List[datetime] = [
+        _parse_zm_datetime(e.get('EndDateTime') or e['StartDateTime'])
+        for e in recorded
+    ]
+    replicated: List[Dict[str, Any]] = [
+        dict(
+            recorded[i % len(recorded)], Id=str(count - i),
+            MonitorId=str(i % monitors + 1)
+        ) for i in range(count)
+    ]
+    return replicated, max(ends) + timedelta(seconds=GRACE)
+
+
+def _aggregate(func: Callable[..., Any]) -> Callable[[int], Callable]:
+    def setup(size: int) -> Callable[[], Any]:
+        monitors: int = max(size // EVENTS_PER_MONITOR, 1)
+        evs, now = events(size, monitors)
+        ids: List[int] = list(range(1, monitors + 1))
+        return lambda: func(evs, ids, now, WINDOW, GRACE)
+    return setup
+
+
+def _event_metrics(size: int) -> Callable[[], Any]:
+    evs, now = events(size * EVENTS_PER_MONITOR, size)
+    agg = aggregate_events(evs, list(range(1, size + 1)), now, WINDOW, GRACE)
+    names: Dict[int, str] = {mid: f'Camera {mid}' for mid in agg}
+    return lambda: build_event_metrics(agg, names, now, WINDOW)
+
+
+def _monitor_metrics(size: int) -> Callable[[], Any]:
+    entries = monitor_entries(size)
+    return lambda: build_monitor_metrics(entries)
+
+
+def _exposition(size: int) -> Callable[[], Any]:
+    evs, now = events(size * EVENTS_PER_MONITOR, size)
+    agg = aggregate_events(evs, list(range(1, size + 1)), now, WINDOW, GRACE)
+    families = build_monitor_metrics(monitor_entries(size)) + (
+        build_event_metrics(
+            agg, {mid: f'Camera {mid}' for mid in agg}, now, WINDOW
+        )
+    )
+
+    class Collector:
+        def collect(self):
+            return families
+
+    registry = CollectorRegistry()
+    registry.register(Collector())
+    return lambda: generate_latest(registry)
+
+
+CASES: Dict[str, Case] = {
+    'aggregate_events': Case(
+        'event', (1000, 4000, 16000), _aggregate(aggregate_events),
+        time_budget=60e-6, alloc_budget=200,
+    ),
+    'aggregate_events_columnar': Case(
+        'event', (1000, 4000, 16000), _aggregate(aggregate_events_columnar),
+        time_budget=45e-6, alloc_budget=1000,
+    ),
+    'build_monitor_metrics': Case(
+        'monitor', (25, 100, 400), _monitor_metrics,
+        time_budget=750e-6, alloc_budget=40000,
+    ),
+    'build_event_metrics': Case(
+        'monitor', (25, 100, 400), _event_metrics,
+        time_budget=30e-6, alloc_budget=5000,
+    ),
+    'exposition': Case(
+        'monitor', (25, 100, 400), _exposition,
+        time_budget=2000e-6, alloc_budget=60000,
+    ),
+}
+
+
+def measure(
+    func: Callable[[], Any], repeat: int = 3, trace: bool = True
+) -> Tuple[float, Optional[int]]:
+    """Best wall time of ``repeat`` calls and, if ``trace``, the peak
+    memory allocated during one more call (traced separately, since
+    tracing slows it several times over)."""
+    best: float = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start: float = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    if not trace:
+        return best, None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base: int = tracemalloc.get_traced_memory()[0]
+        func()
+        peak: int = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_case(
+    case: Case, factor: int = 1, trace_all: bool = True
+) -> List[Result]:
+    """Measure ``case`` at each of its sizes times ``factor``; allocations
+    are traced at every size or, to keep the tests quick, the smallest."""
+    results: List[Result] = []
+    for i, size in enumerate(case.sizes):
+        size *= factor
+        seconds, peak = measure(
+            case.setup(size), trace=trace_all or i == 0
+        )
+        results.append(Result(size, seconds, peak))
+    return results
+
+
+class TestPerformanceBudgets(unittest.TestCase):
+
+    results: Dict[str, List[Result]] = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = {
+            name: run_case(case, trace_all=False)
+            for name, case in CASES.items()
+        }
+
+    @unittest.skipUnless(
+        os.environ.get('ZM_PERF') == '1', 'time budgets need ZM_PERF=1'
+    )
+    def test_time_budgets(self):
+        scale: float = float(os.environ.get('ZM_PERF_TIME_SCALE', '1'))
+        for name, case in CASES.items():
+            for result in self.results[name]:
+                with self.subTest(name, size=result.size):
+                    self.assertLessEqual(
+                        result.seconds / result.size,
+                        case.time_budget * scale,
+                        f'{name}: {result.seconds:.3f}s for {result.size} '
+                        f'{case.unit}s'
+                    )
+
+    def test_allocation_budgets(self):
+        for name, case in CASES.items():
+            for result in self.results[name]:
+                if result.peak_bytes is None:
+                    continue
+                with self.subTest(name, size=result.size):
+                    self.assertLessEqual(
+                        result.peak_bytes / result.size, case.alloc_budget,
+                        f'{name}: peak {result.peak_bytes} bytes for '
+                        f'{result.size} {case.unit}s'
+                    )
+
+    def test_scaling_is_linear(self):
+        for name, results in self.results.items():
+            with self.subTest(name):
+                first, last = results[0], results[-1]
+                self.assertLessEqual(
+                    (last.seconds / last.size) / (first.seconds / first.size),
+                    MAX_SCALING
+                )
+
+
+def report(factor: int) -> None:
+    """Print time and peak allocation per size for every case, with the
+    scaling exponent between consecutive sizes (1.0 is linear)."""
+    print(f'{"case":26s} {"size":>8s} {"ms":>9s} {"us/unit":>8s} '
+          f'{"budget":>7s} {"peak KiB":>9s} {"B/unit":>7s} {"budget":>7s} '
+          f'{"exp":>5s}')
+    for name, case in CASES.items():
+        prev: Optional[Result] = None
+        for result in run_case(case, factor):
+            exponent: str = '' if prev is None else '%.2f' % (
+                math.log(result.seconds / prev.seconds)
+                / math.log(result.size / prev.size)
+            )
+            print(
+                f'{name:26s} {result.size:8d} {result.seconds * 1e3:9.2f} '
+                f'{result.seconds / result.size * 1e6:8.2f} '
+                f'{case.time_budget * 1e6:7.1f} '
+                f'{result.peak_bytes / 1024:9.0f} '
+                f'{result.peak_bytes / result.size:7.0f} '
+                f'{case.alloc_budget:7d} {exponent:>5s}'
+            )
+            prev = result
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument(
+        '--report', action='store_true',
+        help='print a scaling report instead of running the tests'
+    )
+    p.add_argument(
+        '-x', '--factor', type=int, default=1,
+        help='multiply the fixture sizes by this in the report'
+    )
+    args, rest = p.parse_known_args()
+    if args.report:
+        report(args.factor)
+    else:
+        unittest.main(argv=[p.prog] + rest)
+
+
+if __name__ == '__main__':
+    main()